@@ -1,62 +1,56 @@
 import os
+import sys
 
-def text_to_bits(text):
-    return ''.join(f'{ord(c):08b}' for c in text)
+if __package__ in (None, ''):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def bits_to_text(bits):
-    chars = [bits[i:i+8] for i in range(0, len(bits), 8)]
-    return ''.join(chr(int(char, 2)) for char in chars)
+from stego import profiling
+from stego.codec import bytes_to_bits, decode_text, encode_text
+from stego.header import METHOD_TEXT_LINE_ENDINGS, bit_stream_reader, build_frame, read_frame
+from stego.lines import WRITE_BUFFER_SIZE, count_file_lines
 
-def embed_message_in_container(file_path, message, output_path):
-    message_bits = text_to_bits(message)
-    message_length = len(message_bits)
+@profiling.profiled('line_endings.embed')
+def embed_message_in_container(file_path, message, output_path, check_capacity=True, fec=None):
+    message_bits = bytes_to_bits(build_frame(METHOD_TEXT_LINE_ENDINGS, encode_text(message), fec=fec))
+    message_length = message_bits.size
 
-    with open(file_path, 'rb') as file:
-        lines = file.readlines()
-
-    if message_length > len(lines):
+    if check_capacity and message_length > count_file_lines(file_path):
         raise ValueError("Сообщение слишком длинное для данного контейнера.")
 
-    embedded_lines = []
     bit_index = 0
-    for line in lines:
-        if bit_index < message_length:
-            bit = message_bits[bit_index]
-            if bit == '0':
-                line = line.rstrip(b'\r\n') + b'\n'
-            else:
-                line = line.rstrip(b'\r\n') + b'\r\n'
-            bit_index += 1
-        embedded_lines.append(line)
-
-    with open(output_path, 'wb') as output_file:
-        output_file.writelines(embedded_lines)
+    with open(file_path, 'rb') as file, \
+            open(output_path, 'wb', buffering=WRITE_BUFFER_SIZE) as output_file:
+        for line in file:
+            if bit_index < message_length:
+                bit = message_bits[bit_index]
+                if bit == 0:
+                    line = line.rstrip(b'\r\n') + b'\n'
+                else:
+                    line = line.rstrip(b'\r\n') + b'\r\n'
+                bit_index += 1
+            output_file.write(line)
+
+    if bit_index < message_length:
+        raise ValueError("Сообщение слишком длинное для данного контейнера.")
 
+    profiling.add_bytes(read=os.path.getsize(file_path), written=os.path.getsize(output_path))
     return bit_index
 
-def extract_message_from_container(file_path, message_length):
-    message_bits = []
-
-    with open(file_path, 'rb') as file:
-        lines = file.readlines()
-
-    for line in lines:
+def _line_ending_bits(file):
+    for line in file:
         if line.endswith(b'\r\n'):
-            message_bits.append('1')
+            yield 1
         elif line.endswith(b'\n'):
-            message_bits.append('0')
-
-        if len(message_bits) >= message_length * 8:
-            break
-
-    bits_str = ''.join(message_bits[:message_length * 8])
-    return bits_to_text(bits_str)
+            yield 0
 
-def calculate_capacity_and_efficiency(file_path, message_length):
+@profiling.profiled('line_endings.extract')
+def extract_message_from_container(file_path):
     with open(file_path, 'rb') as file:
-        lines = file.readlines()
+        _, payload = read_frame(bit_stream_reader(_line_ending_bits(file)), METHOD_TEXT_LINE_ENDINGS)
+    return decode_text(payload)
 
-    capacity = len(lines)
+def calculate_capacity_and_efficiency(file_path, message_length):
+    capacity = count_file_lines(file_path)
     efficiency = (message_length * 8) / capacity if capacity > 0 else 0
 
     return capacity, efficiency
@@ -89,7 +83,7 @@ if __name__ == "__main__":
         print(f"Ошибка: {e}")
         exit(1)
 
-    extracted_message = extract_message_from_container(output_file, len(message))
+    extracted_message = extract_message_from_container(output_file)
     print(f"Извлеченное сообщение: {extracted_message}")
 
     capacity, efficiency = calculate_capacity_and_efficiency(container_file, len(message))
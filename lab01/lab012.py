@@ -1,70 +1,156 @@
+import itertools
 import os
-
-# Функция для преобразования текста в бинарный формат
-def text_to_bits(text):
-    return ''.join(f'{ord(c):08b}' for c in text)
-
-# Функция для преобразования бинарного формата в текст
-def bits_to_text(bits):
-    chars = [bits[i:i+8] for i in range(0, len(bits), 8)]
-    return ''.join(chr(int(char, 2)) for char in chars)
-
-# Внедрение сообщения в файл-контейнер (через пробелы в конце предложения)
-def embed_message_in_spaces(file_path, message, output_path):
-    message_bits = text_to_bits(message)
-    message_length = len(message_bits)
-
+import re
+import sys
+
+import numpy as np
+
+if __package__ in (None, ''):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stego import profiling
+from stego.codec import bytes_to_bits, decode_text, encode_text
+from stego.header import (HEADER_BITS, METHOD_TEXT_SPACES, bit_stream_reader, build_frame, decode_body,
+                          header_size, read_header, verify_payload)
+from stego.lines import READ_CHUNK_SIZE, WRITE_BUFFER_SIZE, check_bits_per_line, count_file_lines
+
+# Промежуток между словами: один пробел (бит 0) или два (бит 1)
+WORD_GAP = re.compile(r'(?<=[^ \t\r\n]) +(?=[^ \t\r\n])')
+# Байты, которые могут стоять по краям промежутка (в UTF-8 байты многобайтных символов тоже подходят)
+WORD_BYTES = np.ones(256, dtype=bool)
+WORD_BYTES[list(b' \t\r\n')] = False
+
+# Сколько бит строка несет в промежутках между словами
+def line_capacity(line, bits_per_line):
+    return min(bits_per_line, len(WORD_GAP.findall(line)))
+
+# Емкость контейнера: заголовок (header_bits строк) - по одному биту на строку, далее - по промежуткам между словами
+def count_capacity(lines, bits_per_line=1, header_bits=HEADER_BITS):
+    capacity = 0
+    for line_index, line in enumerate(lines):
+        if bits_per_line == 1 or line_index < header_bits:
+            capacity += 1
+        else:
+            capacity += line_capacity(line, bits_per_line)
+    return capacity
+
+def count_gap_bits(file, bits_per_line, header_bits=HEADER_BITS, chunk_size=READ_CHUNK_SIZE):
+    # Сумма line_capacity по строкам двоичного файла после первых header_bits (строки делятся по '\n').
+    # Файл читается порциями: серия пробелов на границе порции переносится в следующую
+    # вместе с предшествующим байтом, поэтому память не зависит от длины строк
+    bits = 0
+    newlines = 0
+    open_line, open_gaps = -1, 0
+    carry = b'\n'
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        buffer = carry + chunk
+        first_line = newlines - carry.count(b'\n')
+        newlines += chunk.count(b'\n')
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        # Серии пробелов [start, end); буфер начинается не с пробела, незавершенная серия отбрасывается
+        edges = np.diff((data == 32).view(np.int8))
+        ends = np.nonzero(edges == -1)[0] + 1
+        starts = np.nonzero(edges == 1)[0][:ends.size] + 1
+        gaps = ends[WORD_BYTES[data[starts - 1]] & WORD_BYTES[data[ends]]]
+        gap_lines = first_line + np.searchsorted(np.nonzero(data == 10)[0], gaps)
+        lines, counts = np.unique(gap_lines, return_counts=True)
+        if lines.size:
+            # Последняя строка порции может продолжиться в следующей
+            if lines[0] == open_line:
+                counts[0] += open_gaps
+            elif open_line >= header_bits:
+                bits += min(open_gaps, bits_per_line)
+            complete = lines[:-1] >= header_bits
+            bits += int(np.minimum(counts[:-1], bits_per_line)[complete].sum())
+            open_line, open_gaps = int(lines[-1]), int(counts[-1])
+        last = len(buffer.rstrip(b' ')) - 1
+        carry = buffer[last:last + 2]
+    if open_line >= header_bits:
+        bits += min(open_gaps, bits_per_line)
+    return bits
+
+def calculate_capacity(file_path, bits_per_line=1, header_bits=HEADER_BITS):
+    if bits_per_line == 1:
+        return count_file_lines(file_path)
     with open(file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
+        return count_capacity(file, bits_per_line, header_bits)
 
-    if message_length > len(lines):
+# Внедрение сообщения в файл-контейнер (через пробелы в конце предложения)
+@profiling.profiled('spaces.embed')
+def embed_message_in_spaces(file_path, message, output_path, check_capacity=True, bits_per_line=1, fec=None):
+    check_bits_per_line(bits_per_line)
+    # Сообщение внедряется вместе с заголовком (длина, CRC32); число бит на строку - в параметрах заголовка
+    frame = build_frame(METHOD_TEXT_SPACES, encode_text(message), options=bits_per_line - 1, fec=fec)
+    message_bits = bytes_to_bits(frame)
+    message_length = message_bits.size
+    header_bits = header_size(fec) * 8
+
+    if check_capacity and message_length > calculate_capacity(file_path, bits_per_line, header_bits):
         raise ValueError("Сообщение слишком длинное для данного контейнера.")
 
-    embedded_lines = []
     bit_index = 0
-    for line in lines:
-        if bit_index < message_length:
-            bit = message_bits[bit_index]
-            if bit == '0':
-                # Добавляем один пробел (бит 0)
-                line = line.rstrip() + ' \n'
-            else:
-                # Добавляем два пробела (бит 1)
-                line = line.rstrip() + '  \n'
-            bit_index += 1
-        embedded_lines.append(line)
-
-    with open(output_path, 'w', encoding='utf-8') as output_file:
-        output_file.writelines(embedded_lines)
+    with open(file_path, 'r', encoding='utf-8') as file, \
+            open(output_path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as output_file:
+        for line_index, line in enumerate(file):
+            if bits_per_line > 1 and line_index >= header_bits:
+                # После заголовка биты кодируются промежутками между словами
+                count = min(line_capacity(line, bits_per_line), message_length - bit_index)
+                if count > 0:
+                    bits = iter(message_bits[bit_index:bit_index + count])
+                    line = WORD_GAP.sub(lambda match: '  ' if next(bits) else ' ', line, count=count)
+                    bit_index += count
+            elif bit_index < message_length:
+                bit = message_bits[bit_index]
+                if bit == 0:
+                    # Добавляем один пробел (бит 0)
+                    line = line.rstrip() + ' \n'
+                else:
+                    # Добавляем два пробела (бит 1)
+                    line = line.rstrip() + '  \n'
+                bit_index += 1
+            output_file.write(line)
+
+    if bit_index < message_length:
+        raise ValueError("Сообщение слишком длинное для данного контейнера.")
 
+    profiling.add_bytes(read=os.path.getsize(file_path), written=os.path.getsize(output_path))
     return bit_index
 
-# Извлечение сообщения из контейнера (по количеству пробелов в конце строки)
-def extract_message_from_spaces(file_path, message_length):
-    message_bits = []
-
-    with open(file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-
-    for line in lines:
-        # Определяем количество пробелов в конце строки
+# Биты по количеству пробелов в конце строки
+def _trailing_space_bits(file):
+    for line in file:
         if line.endswith('  \n'):
-            message_bits.append('1')
+            yield 1
         elif line.endswith(' \n'):
-            message_bits.append('0')
+            yield 0
 
-        if len(message_bits) >= message_length * 8:
-            break
+# Биты по промежуткам между словами: не больше bits_per_line с каждой строки
+def _word_gap_bits(file, bits_per_line):
+    for line in file:
+        for match in itertools.islice(WORD_GAP.finditer(line), bits_per_line):
+            yield 1 if len(match.group()) > 1 else 0
 
-    bits_str = ''.join(message_bits[:message_length * 8])
-    return bits_to_text(bits_str)
-
-# Функция для расчета коэффициента сокрытия и информационной ёмкости
-def calculate_capacity_and_efficiency(file_path, message_length):
+# Извлечение сообщения из контейнера: сначала заголовок, затем ровно столько строк, сколько нужно
+@profiling.profiled('spaces.extract')
+def extract_message_from_spaces(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
+        # Строки заголовка читаются по одной, пока не наберется заголовок (версии 1 или 2)
+        header = read_header(bit_stream_reader(_trailing_space_bits(file)), METHOD_TEXT_SPACES)
+        bits_per_line = header.options + 1
+        if bits_per_line == 1:
+            payload_bits = _trailing_space_bits(file)
+        else:
+            payload_bits = _word_gap_bits(file, bits_per_line)
+        payload = decode_body(header, bit_stream_reader(payload_bits)(header.body_size))
+    verify_payload(header, payload)
+    return decode_text(payload)
 
-    capacity = len(lines)  # 1 бит на строку
+# Функция для расчета коэффициента сокрытия и информационной ёмкости
+def calculate_capacity_and_efficiency(file_path, message_length, bits_per_line=1):
+    capacity = calculate_capacity(file_path, bits_per_line)
     efficiency = (message_length * 8) / capacity if capacity > 0 else 0
 
     return capacity, efficiency
@@ -84,7 +170,7 @@ if __name__ == "__main__":
         exit(1)
 
     # Извлечение сообщения
-    extracted_message = extract_message_from_spaces(output_file, len(message))
+    extracted_message = extract_message_from_spaces(output_file)
     print(f"Извлеченное сообщение: {extracted_message}")
 
     # Расчет емкости и коэффициента сокрытия
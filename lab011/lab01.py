@@ -1,62 +1,109 @@
 import os
-
-def text_to_bits(text):
-    return ''.join(f'{ord(c):08b}' for c in text)
-
-def bits_to_text(bits):
-    chars = [bits[i:i + 8] for i in range(0, len(bits), 8)]
-    return ''.join(chr(int(char, 2)) for char in chars)
-
-def embed_message_in_invisible_chars(file_path, message, output_path):
-    message_bits = text_to_bits(message)
-    message_length = len(message_bits)
-
-    with open(file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-
-    if message_length > len(lines):
+import sys
+
+import numpy as np
+
+if __package__ in (None, ''):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stego import profiling
+from stego.codec import bytes_to_bits, decode_text, encode_text
+from stego.header import (HEADER_BITS, METHOD_TEXT_INVISIBLE, bit_stream_reader, build_frame, decode_body,
+                          header_size, read_header, verify_payload)
+from stego.lines import WRITE_BUFFER_SIZE, check_bits_per_line, count_file_lines
+
+# Алфавит невидимых символов: каждый символ несет 2 бита
+ZERO_WIDTH_CHARS = '\u200B\u200C\u200D\u2060'
+
+def calculate_capacity(line_count, bits_per_line=1, header_bits=HEADER_BITS):
+    # Заголовок всегда внедряется по одному биту на строку, остальные строки несут bits_per_line бит
+    if bits_per_line == 1 or line_count <= header_bits:
+        return line_count
+    return header_bits + (line_count - header_bits) * bits_per_line
+
+def _line_suffixes(bits, bits_per_line):
+    # Биты разбиваются по строкам, дополняются нулями до четного числа и кодируются символами алфавита
+    symbols_per_line = -(-bits_per_line // 2)
+    line_count = -(-bits.size // bits_per_line)
+    line_bits = np.zeros(line_count * bits_per_line, dtype=np.uint8)
+    line_bits[:bits.size] = bits
+    padded = np.zeros((line_count, symbols_per_line * 2), dtype=np.uint8)
+    padded[:, :bits_per_line] = line_bits.reshape(line_count, bits_per_line)
+    symbols = padded[:, 0::2] * 2 + padded[:, 1::2]
+    return [''.join(ZERO_WIDTH_CHARS[symbol] for symbol in row) for row in symbols.tolist()]
+
+@profiling.profiled('invisible.embed')
+def embed_message_in_invisible_chars(file_path, message, output_path, check_capacity=True, bits_per_line=1,
+                                     fec=None):
+    check_bits_per_line(bits_per_line)
+    # Число бит на строку записывается в параметры заголовка
+    frame = build_frame(METHOD_TEXT_INVISIBLE, encode_text(message), options=bits_per_line - 1, fec=fec)
+    message_bits = bytes_to_bits(frame)
+    message_length = message_bits.size
+    header_bits = header_size(fec) * 8
+
+    if check_capacity and message_length > calculate_capacity(count_file_lines(file_path), bits_per_line,
+                                                              header_bits):
         raise ValueError("Too long message")
 
-    embedded_lines = []
+    suffixes = _line_suffixes(message_bits[header_bits:], bits_per_line) if bits_per_line > 1 else []
+
     bit_index = 0
-    for line in lines:
-        if bit_index < message_length:
-            bit = message_bits[bit_index]
-            if bit == '1':
-                line = line.rstrip() + '\u200B\n'
-            else:
-                line = line.rstrip() + '\n'
-            bit_index += 1
-        embedded_lines.append(line)
-
-    with open(output_path, 'w', encoding='utf-8') as output_file:
-        output_file.writelines(embedded_lines)
+    with open(file_path, 'r', encoding='utf-8') as file, \
+            open(output_path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as output_file:
+        line_index = 0
+        for line in file:
+            if bits_per_line == 1 or line_index < header_bits:
+                if bit_index < message_length:
+                    bit = message_bits[bit_index]
+                    if bit == 1:
+                        line = line.rstrip() + '\u200B\n'
+                    else:
+                        line = line.rstrip() + '\n'
+                    bit_index += 1
+            elif line_index - header_bits < len(suffixes):
+                line = line.rstrip().rstrip(ZERO_WIDTH_CHARS) + suffixes[line_index - header_bits] + '\n'
+                bit_index = min(bit_index + bits_per_line, message_length)
+            line_index += 1
+            output_file.write(line)
+
+    if bit_index < message_length:
+        raise ValueError("Too long message")
 
+    profiling.add_bytes(read=os.path.getsize(file_path), written=os.path.getsize(output_path))
     return bit_index
 
-def extract_message_from_invisible_chars(file_path, message_length):
-    message_bits = []
-
+def _invisible_char_bits(file):
+    for line in file:
+        yield 1 if line.endswith('\u200B\n') else 0
+
+def _zero_width_bits(file, bits_per_line):
+    # Биты строки - коды невидимых символов в ее конце, по 2 бита на символ
+    for line in file:
+        line = line.rstrip('\r\n')
+        suffix = line[len(line.rstrip(ZERO_WIDTH_CHARS)):]
+        bits = []
+        for char in suffix:
+            symbol = ZERO_WIDTH_CHARS.index(char)
+            bits += (symbol >> 1, symbol & 1)
+        yield from bits[:bits_per_line]
+
+@profiling.profiled('invisible.extract')
+def extract_message_from_invisible_chars(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-
-    for line in lines:
-        if line.endswith('\u200B\n'):
-            message_bits.append('1')
+        # Заголовок читается по одному биту со строки, после него известно число бит на строку
+        header = read_header(bit_stream_reader(_invisible_char_bits(file)), METHOD_TEXT_INVISIBLE)
+        bits_per_line = header.options + 1
+        if bits_per_line == 1:
+            payload_bits = _invisible_char_bits(file)
         else:
-            message_bits.append('0')
-
-        if len(message_bits) >= message_length * 8:
-            break
-
-    bits_str = ''.join(message_bits[:message_length * 8])
-    return bits_to_text(bits_str)
-
-def calculate_capacity_and_efficiency(file_path, message_length):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
+            payload_bits = _zero_width_bits(file, bits_per_line)
+        payload = decode_body(header, bit_stream_reader(payload_bits)(header.body_size))
+    verify_payload(header, payload)
+    return decode_text(payload)
 
-    capacity = len(lines)
+def calculate_capacity_and_efficiency(file_path, message_length, bits_per_line=1):
+    capacity = calculate_capacity(count_file_lines(file_path), bits_per_line)
     efficiency = (message_length * 8) / capacity if capacity > 0 else 0
 
     return capacity, efficiency
@@ -73,7 +120,7 @@ if __name__ == "__main__":
         print(f"Ошибка: {e}")
         exit(1)
 
-    extracted_message = extract_message_from_invisible_chars(output_file, len(message))
+    extracted_message = extract_message_from_invisible_chars(output_file)
     print(f"Извлеченное сообщение: {extracted_message}")
 
     capacity, efficiency = calculate_capacity_and_efficiency(container_file, len(message))
@@ -1,65 +1,344 @@
+import os
+import shutil
+import sys
 import numpy as np
 from PIL import Image
-import math
 
-def embed_text_lsb(image_path, text, output_path):
-    img = Image.open(image_path)
-    img_data = np.array(img)
-    text_bin = ''.join(format(ord(char), '08b') for char in text) + '00000000'
-    text_len = len(text_bin)
-    height, width, _ = img_data.shape
-    max_bits = height * width * 3
+if __package__ in (None, ''):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stego import bmp, images, metrics, profiling, tiles
+from stego.codec import bits_to_bytes, bytes_to_bits, decode_text, encode_text
+from stego.fec import get_code
+from stego.header import (HEADER_BITS, METHOD_LSB, body_size, build_frame, decode_body, header_size, read_header,
+                          verify_payload)
+
+MAX_DEPTH = 4
+# Параметры в заголовке: биты 0-1 - глубина минус 1, биты 2-5 - маска каналов (0 - цветовые каналы подряд)
+DEPTH_BITS = 0x03
+CHANNEL_MASK_SHIFT = 2
+# Форматы, из которых альфа-канал не читается обратно: 32-битный BMP открывается как RGB
+ALPHA_LOSING_FORMATS = ('BMP', 'JPEG')
+
+def _color_channels(channel_count):
+    # Альфа-канал (LA, RGBA) в цветовые каналы не входит
+    return list(range(3)) if channel_count >= 3 else [0]
+
+def _bits_to_values(bits, depth):
+    # Группы по depth бит упаковываются в значения, по одному на отсчет канала
+    if depth == 1:
+        return bits
+    groups = np.zeros((-(-bits.size // depth), depth), dtype=np.uint8)
+    groups.reshape(-1)[:bits.size] = bits
+    values = groups[:, 0].copy()
+    for column in range(1, depth):
+        values <<= 1
+        values |= groups[:, column]
+    return values
+
+def _values_to_bits(values, depth):
+    if depth == 1:
+        return values & 1
+    groups = np.empty((values.size, depth), dtype=np.uint8)
+    for column in range(depth):
+        np.bitwise_and(values >> (depth - 1 - column), 1, out=groups[:, column])
+    return groups.reshape(-1)
+
+def _bytes_to_values(data, depth):
+    # При глубине, делящей 8, значения получаются сдвигами байт без промежуточного массива бит
+    if depth == 1 or 8 % depth:
+        return _bits_to_values(bytes_to_bits(data), depth)
+    data = np.frombuffer(data, dtype=np.uint8)
+    per_byte = 8 // depth
+    values = np.empty((data.size, per_byte), dtype=np.uint8)
+    for column in range(per_byte):
+        np.bitwise_and(data >> (8 - depth * (column + 1)), (1 << depth) - 1, out=values[:, column])
+    return values.reshape(-1)
+
+def _values_to_bytes(values, depth):
+    if depth == 1 or 8 % depth:
+        return bits_to_bytes(_values_to_bits(values, depth)[:values.size * depth // 8 * 8])
+    groups = values.reshape(-1, 8 // depth)
+    data = groups[:, 0].copy()
+    for column in range(1, groups.shape[1]):
+        data <<= depth
+        data |= groups[:, column]
+    return data.tobytes()
+
+def _row_span(pixels, start, stop, channels):
+    # Строки изображения, содержащие отсчеты выбранных каналов с номерами [start, stop)
+    row_size = pixels.shape[1] * len(channels)
+    first_row = start // row_size
+    last_row = -(-stop // row_size)
+    return first_row, last_row, first_row * row_size
+
+def _all_channels(pixels, channels):
+    return list(channels) == list(range(pixels.shape[2]))
+
+def _read_values(pixels, start, stop, channels):
+    first_row, last_row, offset = _row_span(pixels, start, stop, channels)
+    region = pixels[first_row:last_row]
+    if not _all_channels(pixels, channels):
+        region = region[:, :, channels]
+    values = np.ascontiguousarray(region).reshape(-1)
+    return values[start - offset:stop - offset]
+
+def _write_values(pixels, start, values, depth, channels):
+    # Меняются только строки, в которые попадают биты сообщения
+    stop = start + values.size
+    first_row, last_row, offset = _row_span(pixels, start, stop, channels)
+    region = np.array(pixels[first_row:last_row])
+    selected = region if _all_channels(pixels, channels) else np.ascontiguousarray(region[:, :, channels])
+    flat = selected.reshape(-1)
+    keep = 0xFF ^ ((1 << depth) - 1)
+    flat[start - offset:stop - offset] = (flat[start - offset:stop - offset] & keep) | values
+    if selected is not region:
+        region[:, :, channels] = selected
+    pixels[first_row:last_row] = region
 
-    if text_len > max_bits:
+def embed_bits(pixels, bits, depth=1, channels=None, start=0):
+    pixels = images.as_channels(pixels)
+    height, width, channel_count = pixels.shape
+    channels = _color_channels(channel_count) if channels is None else channels
+    values = _bits_to_values(bits, depth)
+
+    if start + values.size > height * width * len(channels):
         raise ValueError("Текст слишком длинный для внедрения в изображение")
 
-    bit_index = 0
-    for i in range(height):
-        for j in range(width):
-            for k in range(3):
-                if bit_index < text_len:
-                    pixel_value = img_data[i, j, k]
-                    img_data[i, j, k] = (pixel_value & 0xFE) | int(text_bin[bit_index])
-                    bit_index += 1
-                else:
-                    break
+    _write_values(pixels, start, values, depth, channels)
 
-    embedded_image = Image.fromarray(img_data.astype(np.uint8))
-    embedded_image.save(output_path)
+def extract_bits(pixels, count, start=0, depth=1, channels=None):
+    pixels = images.as_channels(pixels)
+    channels = _color_channels(pixels.shape[2]) if channels is None else channels
+    values = _read_values(pixels, start, start + -(-count // depth), channels)
+    return _values_to_bits(values, depth)[:count]
 
-def extract_text_lsb(image_path):
-    img = Image.open(image_path)
+def calculate_capacity(width, height, depth=1, channels=3):
+    return width * height * channels * depth
+
+def _encode_options(depth, channels):
+    mask = 0 if channels is None else sum(1 << channel for channel in channels)
+    return (depth - 1) | (mask << CHANNEL_MASK_SHIFT)
+
+def _decode_options(options):
+    mask = options >> CHANNEL_MASK_SHIFT
+    channels = [channel for channel in range(4) if mask >> channel & 1] or None
+    return (options & DEPTH_BITS) + 1, channels
+
+def _payload_layout(channel_count, channels, header_bits=HEADER_BITS):
+    # Заголовок всегда занимает первые header_bits отсчетов цветовых каналов с глубиной 1.
+    # Без маски сообщение продолжает тот же поток отсчетов (совместимо с прежним форматом),
+    # с маской - начинается с первого пикселя после заголовка
+    color = _color_channels(channel_count)
+    if channels is None:
+        return header_bits, color
+    if max(channels) >= channel_count:
+        raise ValueError("В изображении нет выбранного канала")
+    header_pixels = -(-header_bits // len(color))
+    return header_pixels * len(channels), channels
+
+def _fits(shape, payload_size, depth, channels, header_bits=HEADER_BITS):
+    height, width, channel_count = shape
+    start, channels = _payload_layout(channel_count, channels, header_bits)
+    return start + -(-payload_size * 8 // depth) <= height * width * len(channels)
+
+def _choose_depth(shape, payload_size, depth, channels, header_bits=HEADER_BITS):
+    if depth == 'fit':
+        # Наименьшая глубина, при которой сообщение помещается в контейнер
+        for depth in range(1, MAX_DEPTH + 1):
+            if _fits(shape, payload_size, depth, channels, header_bits):
+                return depth
+        raise ValueError("Текст слишком длинный для внедрения в изображение")
+    if not 1 <= depth <= MAX_DEPTH:
+        raise ValueError(f"Глубина внедрения должна быть от 1 до {MAX_DEPTH} или 'fit'")
+    if not _fits(shape, payload_size, depth, channels, header_bits):
+        raise ValueError("Текст слишком длинный для внедрения в изображение")
+    return depth
+
+def _frame_segments(shape, payload, depth, channels, fec=None):
+    # Участки записи: (первый отсчет, значения, глубина, каналы) - заголовок и сообщение
+    code = get_code(fec)
+    size = header_size(code)
+    depth = _choose_depth(shape, body_size(len(payload), code), depth, channels, size * 8)
+    frame = build_frame(METHOD_LSB, payload, _encode_options(depth, channels), fec=code)
+    start, payload_channels = _payload_layout(shape[2], channels, size * 8)
+    return depth, [
+        (0, bytes_to_bits(frame[:size]), 1, _color_channels(shape[2])),
+        (start, _bytes_to_values(frame[size:], depth), depth, payload_channels),
+    ]
+
+def _write_segments(pixels, segments, top=0):
+    # pixels может быть полосой изображения, начинающейся со строки top
+    row_pixels = pixels.shape[1]
+    for start, values, depth, channels in segments:
+        strip_start = top * row_pixels * len(channels)
+        strip_stop = strip_start + pixels.shape[0] * row_pixels * len(channels)
+        first = max(start, strip_start)
+        last = min(start + values.size, strip_stop)
+        if first < last:
+            _write_values(pixels, first - strip_start, values[first - start:last - start], depth, channels)
+
+def _touched_rows(shape, segments):
+    # Сообщение занимает начало изображения; число затронутых строк округляется до окон SSIM
+    height, width, _ = shape
+    last_row = max(-(-(start + values.size) // (width * len(channels))) for start, values, _, channels in segments)
+    return min(height, -(-last_row // metrics.SSIM_WINDOW) * metrics.SSIM_WINDOW)
+
+def embed_payload(pixels, payload, depth=1, channels=None, meter=None, fec=None):
+    # pixels - массив (H, W) или (H, W, C), изменяется на месте; возвращает выбранную глубину.
+    # meter (metrics.QualityMeter) получает только затронутые строки, остальные учитываются как неизмененные
+    pixels = images.as_channels(pixels)
+    with profiling.stage('payload'):
+        depth, segments = _frame_segments(pixels.shape, payload, depth, channels, fec)
+    if meter is None:
+        with profiling.stage('modify'):
+            _write_segments(pixels, segments)
+        return depth
+
+    height, width, channel_count = pixels.shape
+    rows = _touched_rows(pixels.shape, segments)
+    original = np.array(pixels[:rows])
+    with profiling.stage('modify'):
+        _write_segments(pixels, segments)
+    with profiling.stage('metrics'):
+        meter.update(original, pixels[:rows])
+        meter.add_unchanged(height - rows, width, channel_count)
+    return depth
+
+def _sample_reader(pixels, channels):
+    # Последовательное чтение байт из младших бит отсчетов (глубина 1) - для заголовка
+    position = 0
+
+    def read_bytes(count):
+        nonlocal position
+        if position + count * 8 > pixels.shape[0] * pixels.shape[1] * len(channels):
+            raise ValueError("Изображение не содержит сообщения заявленной длины")
+        bits = extract_bits(pixels, count * 8, start=position, channels=channels)
+        position += count * 8
+        return bits_to_bytes(bits)
+
+    return read_bytes
+
+def extract_payload(pixels):
+    pixels = images.as_channels(pixels)
+    height, width, channel_count = pixels.shape
+    header = read_header(_sample_reader(pixels, _color_channels(channel_count)), METHOD_LSB)
+
+    depth, channels = _decode_options(header.options)
+    start, channels = _payload_layout(channel_count, channels, header.size * 8)
+    value_count = -(-header.body_size * 8 // depth)
+    if start + value_count > height * width * len(channels):
+        raise ValueError("Изображение не содержит сообщения заявленной длины")
+    body = _values_to_bytes(_read_values(pixels, start, start + value_count, channels) & ((1 << depth) - 1), depth)
+    payload = decode_body(header, body)
+    verify_payload(header, payload)
+    return payload
+
+def _channel_indices(bands, channels):
+    # channels - строка из имен каналов изображения, например 'RGB', 'B' или 'RGBA'
+    if channels is None:
+        return None
+    if not channels or any(band not in bands for band in channels):
+        raise ValueError(f"Каналы {channels!r} отсутствуют в изображении {''.join(bands)}")
+    return sorted({bands.index(band) for band in channels})
+
+def _open_cover(image):
+    # image - путь, изображение PIL или массив NumPy
+    img = images.load(image)
+    if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        img = img.convert('RGB')
+    return img
+
+def _check_output_channels(output_path, channels):
+    # Маска с альфа-каналом отклоняется до записи, если формат результата его не сохраняет
+    if channels is None or 'A' not in channels:
+        return
+    output_format = Image.registered_extensions().get(os.path.splitext(output_path)[1].lower())
+    if output_format in ALPHA_LOSING_FORMATS:
+        raise ValueError(f"Формат {output_format} не сохраняет альфа-канал: выберите каналы без A или PNG")
+
+def _uses_mapped_bmp(image_path, output_path=None):
+    if output_path is not None and not output_path.lower().endswith('.bmp'):
+        return False
+    return bmp.is_supported(image_path)
+
+# Байт рабочей памяти на пиксель при обработке полосами: полоса и ее копия при записи
+TILE_BYTES_PER_PIXEL = 6
+
+def _embed_tiled(image_path, payload, output_path, tile_budget, depth, channels, meter=None, fec=None):
+    # Полосы всегда RGB: результат сохраняется в 24-битный BMP
+    width, height = tiles.image_size(image_path)
+    channels = _channel_indices(('R', 'G', 'B'), channels)
+    with profiling.stage('payload'):
+        depth, segments = _frame_segments((height, width, 3), payload, depth, channels, fec)
+
+    def transform(top, strip):
+        original = strip.copy() if meter is not None else None
+        with profiling.stage('modify'):
+            _write_segments(strip, segments, top)
+        if meter is not None:
+            with profiling.stage('metrics'):
+                meter.update(original, strip)
+        return strip
+
+    rows_per_strip = tiles.strip_height(width, tile_budget, TILE_BYTES_PER_PIXEL)
+    tiles.process_strips(image_path, output_path, rows_per_strip, transform)
+    return depth
+
+@profiling.profiled('lsb.embed')
+def embed_text_lsb(image_path, text, output_path, tile_budget=None, depth=1, channels=None, meter=None, fec=None):
+    # depth - число младших бит на отсчет (1-4) или 'fit'; channels - имена каналов, например 'RGBA'.
+    # meter (metrics.QualityMeter) накапливает метрики качества без повторного чтения файлов.
+    # Возвращает использованную глубину
+    _check_output_channels(output_path, channels)
+    payload = encode_text(text)
+
+    if tile_budget is not None and not _uses_mapped_bmp(image_path, output_path):
+        # Полосами обрабатываются только контейнеры, которые нельзя изменить на месте
+        return _embed_tiled(image_path, payload, output_path, tile_budget, depth, channels, meter, fec)
+
+    if _uses_mapped_bmp(image_path, output_path):
+        # Несжатый BMP: копируем файл и меняем младшие биты прямо в отображенном в память файле
+        channels = _channel_indices(('R', 'G', 'B'), channels)
+        if os.path.abspath(image_path) != os.path.abspath(output_path):
+            size = os.path.getsize(image_path)
+            with profiling.stage('copy', bytes_read=size, bytes_written=size):
+                shutil.copyfile(image_path, output_path)
+        with bmp.mapped_pixels(output_path, mode='r+') as pixels:
+            return embed_payload(pixels, payload, depth, channels, meter, fec)
+
+    embedded_image, depth = _embed_image(image_path, payload, depth, channels, meter, fec)
+    images.save(embedded_image, output_path)
+    return depth
+
+def _embed_image(image, payload, depth, channels, meter, fec=None):
+    img = _open_cover(image)
     img_data = np.array(img)
-    extracted_bin = ""
-    height, width, _ = img_data.shape
-
-    for i in range(height):
-        for j in range(width):
-            for k in range(3):
-                extracted_bin += str(img_data[i, j, k] & 1)
-
-    extracted_text = ""
-    for i in range(0, len(extracted_bin), 8):
-        byte = extracted_bin[i:i+8]
-        if byte == "00000000":
-            break
-        extracted_text += chr(int(byte, 2))
-    
-    return extracted_text
+    depth = embed_payload(img_data, payload, depth, _channel_indices(img.getbands(), channels), meter, fec)
+    return Image.fromarray(img_data, mode=img.mode), depth
+
+@profiling.profiled('lsb.embed')
+def embed_text_lsb_image(image, text, depth=1, channels=None, meter=None, fec=None):
+    return _embed_image(image, encode_text(text), depth, channels, meter, fec)[0]
+
+@profiling.profiled('lsb.extract')
+def extract_text_lsb(image_path):
+    if _uses_mapped_bmp(image_path):
+        with bmp.mapped_pixels(image_path) as pixels:
+            with profiling.stage('extract'):
+                payload = extract_payload(pixels)
+        return decode_text(payload)
+    return extract_text_lsb_image(image_path)
+
+@profiling.profiled('lsb.extract')
+def extract_text_lsb_image(image):
+    img_data = np.array(_open_cover(image))
+    with profiling.stage('extract'):
+        payload = extract_payload(img_data)
+    return decode_text(payload)
 
 def calculate_psnr(original_image_path, modified_image_path):
-    original_img = Image.open(original_image_path)
-    modified_img = Image.open(modified_image_path)
-    original_data = np.array(original_img, dtype=np.float64)
-    modified_data = np.array(modified_img, dtype=np.float64)
-    
-    mse = np.mean((original_data - modified_data) ** 2)
-    if mse == 0:
-        return float('inf')
-    
-    max_pixel_value = 255.0
-    psnr = 20 * math.log10(max_pixel_value / math.sqrt(mse))
-    return psnr
+    return metrics.compare_files(original_image_path, modified_image_path).psnr()
 
 if __name__ == "__main__":
     original_image = "clown.bmp"
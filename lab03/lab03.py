@@ -1,112 +1,155 @@
 import numpy as np
 from PIL import Image
-import random
 import os
-
-def embed_message(image_path, message, output_path, key):
-    # Открытие изображения и преобразование в формат numpy массива
-    image = Image.open(image_path).convert('RGB')
-    image_array = np.array(image)
-
-    # Преобразование сообщения в двоичный формат
-    binary_message = ''.join(format(ord(char), '08b') for char in message)
-    message_length = len(binary_message)
-    
-    random.seed(key)
-
-    # Внедрение сообщения в изображение
-    for bit in binary_message:
-        # Выбор случайных координат для коэффициентов
-        x1, y1 = random.randint(0, image_array.shape[0] - 1), random.randint(0, image_array.shape[1] - 1)
-        x2, y2 = random.randint(0, image_array.shape[0] - 1), random.randint(0, image_array.shape[1] - 1)
-
-        # Внедрение бита путем изменения значения яркости
-        if bit == '1':
-            image_array[x1, y1, 0] = min(255, image_array[x1, y1, 0] + 1)
-        else:
-            image_array[x1, y1, 0] = max(0, image_array[x1, y1, 0] - 1)
+import sys
+
+if __package__ in (None, ''):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stego import images, metrics, profiling
+from stego.codec import bits_to_bytes, bits_to_text, bytes_to_bits, decode_text, encode_text
+from stego.header import METHOD_RANDOM_PIXEL, build_frame, header_size, read_frame
+from stego.permutation import pixel_positions
+
+def calculate_capacity(width, height):
+    # Один бит на пару пикселей
+    return width * height // 2
+
+def _pixel_pairs(image_array, count, key):
+    # Пары различных пикселей для каждого бита: позиции 2k и 2k+1 ключевой перестановки,
+    # так что первые пары не зависят от общей длины сообщения
+    if 2 * count > image_array.shape[0] * image_array.shape[1]:
+        raise ValueError("Сообщение слишком длинное для данного изображения")
+    rows, cols = pixel_positions(image_array.shape, key, 2 * count)
+    return (rows[0::2], cols[0::2]), (rows[1::2], cols[1::2])
+
+def embed_bits(image_array, bits, key):
+    first, second = _pixel_pairs(image_array, len(bits), key)
+    bits = np.asarray(bits)
+    p1 = image_array[first + (0,)].astype(np.int16)
+    p2 = image_array[second + (0,)].astype(np.int16)
+    middle = (p1 + p2) // 2
+
+    # Бит 0: яркость первого пикселя пары больше второго
+    to_zero = (bits == 0) & (p1 <= p2)
+    low = np.minimum(middle, 254)
+    p1 = np.where(to_zero, low + 1, p1)
+    p2 = np.where(to_zero, low, p2)
+
+    # Бит 1: яркость первого пикселя не больше второго
+    to_one = (bits == 1) & (p1 > p2)
+    p1 = np.where(to_one, middle, p1)
+    p2 = np.where(to_one, middle, p2)
+
+    image_array[first + (0,)] = p1
+    image_array[second + (0,)] = p2
+
+def extract_bits(image_array, count, key, start=0):
+    first, second = _pixel_pairs(image_array, start + count, key)
+    first = (first[0][start:], first[1][start:])
+    second = (second[0][start:], second[1][start:])
+    return (image_array[first + (0,)] <= image_array[second + (0,)]).astype(np.uint8)
+
+@profiling.profiled('random.embed')
+def embed_message(image_path, message, output_path, key, meter=None, fec=None):
+    # Преобразование сообщения в двоичный формат вместе с заголовком
+    with profiling.stage('payload'):
+        binary_message = bytes_to_bits(build_frame(METHOD_RANDOM_PIXEL, encode_text(message), fec=fec))
 
     # Сохранение нового изображения с внедренным сообщением
-    result_image = Image.fromarray(image_array)
-    result_image.save(output_path)
-    
-    print(f'Количество внедренных бит: {message_length}')
-    return message_length
-
+    images.save(_embed_image(image_path, binary_message, key, meter), output_path)
+    return binary_message.size
 
-def extract_message(image_path, message_length, key):
+def _embed_image(image, binary_message, key, meter):
     # Открытие изображения и преобразование в формат numpy массива
-    image = Image.open(image_path).convert('RGB')
+    image = images.load(image, 'RGB')
     image_array = np.array(image)
 
-    random.seed(key)
-
-    binary_message = ''
-    # Извлечение сообщения из изображения
-    for _ in range(message_length):
-        # Выбор случайных координат для коэффициентов
-        x1, y1 = random.randint(0, image_array.shape[0] - 1), random.randint(0, image_array.shape[1] - 1)
-        x2, y2 = random.randint(0, image_array.shape[0] - 1), random.randint(0, image_array.shape[1] - 1)
-
-        # Извлечение бита из разности пикселей
-        if image_array[x1, y1, 0] > image_array[x2, y2, 0]:
-            binary_message += '0'
-        else:
-            binary_message += '1'
-
-    # Преобразование двоичного сообщения в текст
-    extracted_message = ''.join(chr(int(binary_message[i:i+8], 2)) for i in range(0, len(binary_message), 8))
-    return extracted_message
-
-def check_resilience(image_path, message_length, key):
-    # Открытие изображения и сохранение его в формате JPEG с сжатием
-    image = Image.open(image_path)
-    compressed_image_path = 'compressed_image.jpg'
-    compressed_image = image.resize((image.width // 2, image.height // 2))
-    compressed_image.save(compressed_image_path, format='JPEG', quality=50)
-
-    # Загрузка сжатого изображения и восстановление сообщения
-    compressed_image = Image.open(compressed_image_path).resize((image.width, image.height))
-    compressed_image.save('restored_image.bmp')
-    restored_message = extract_message('restored_image.bmp', message_length, key)
-    
-    # Оценка количества ошибок
-    error_count = sum(1 for a, b in zip(message, restored_message) if a != b)
+    with profiling.stage('modify'):
+        embed_bits(image_array, binary_message, key)
+    if meter is not None:
+        # Метрики по массивам в памяти, без повторного чтения файлов
+        with profiling.stage('metrics'):
+            metrics.compare_arrays(np.asarray(image), image_array, meter)
+    return Image.fromarray(image_array)
+
+@profiling.profiled('random.embed')
+def embed_image(image, message, key, meter=None, fec=None):
+    with profiling.stage('payload'):
+        binary_message = bytes_to_bits(build_frame(METHOD_RANDOM_PIXEL, encode_text(message), fec=fec))
+    return _embed_image(image, binary_message, key, meter)
+
+def _pixel_reader(image_array, key):
+    position = 0
+
+    def read_bytes(count):
+        nonlocal position
+        bits = extract_bits(image_array, count * 8, key, position)
+        position += count * 8
+        return bits_to_bytes(bits)
+
+    return read_bytes
+
+@profiling.profiled('random.extract')
+def extract_message(image_path, key):
+    return extract_image(image_path, key)
+
+@profiling.profiled('random.extract')
+def extract_image(image, key):
+    image_array = images.to_array(image, 'RGB')
+    with profiling.stage('extract'):
+        _, payload = read_frame(_pixel_reader(image_array, key), METHOD_RANDOM_PIXEL)
+    return decode_text(payload)
+
+def attack_image(image, scale=0.5, quality=50):
+    # Уменьшение, JPEG-сжатие и восстановление исходного размера - целиком в памяти
+    image = images.load(image, 'RGB')
+    compressed_image = image.resize((int(image.width * scale), int(image.height * scale)))
+    return images.jpeg_roundtrip(compressed_image, quality).resize(image.size)
+
+def check_resilience(image, message, key, fec=None):
+    # image - путь, изображение PIL или массив; временные файлы не создаются.
+    # fec - код, с которым сообщение было внедрено
+    restored_array = images.to_array(attack_image(image), 'RGB')
+    expected_bits = bytes_to_bits(build_frame(METHOD_RANDOM_PIXEL, encode_text(message), fec=fec))
+    restored_bits = extract_bits(restored_array, expected_bits.size, key)
+
+    # Оценка количества ошибочных бит (до исправления кодом)
+    error_count = int(np.count_nonzero(restored_bits != expected_bits))
+
+    # Сообщение извлекается с исправлением ошибок; если заголовок или контрольная сумма
+    # не сошлись, биты после заголовка читаются как есть
+    try:
+        _, payload = read_frame(_pixel_reader(restored_array, key), METHOD_RANDOM_PIXEL)
+        restored_message = decode_text(payload)
+    except ValueError:
+        restored_message = bits_to_text(restored_bits[header_size(fec) * 8:], errors='replace')
     return error_count, restored_message
 
 def calculate_psnr(original_image_path, processed_image_path):
-    # Открытие оригинального и обработанного изображений
-    original_image = Image.open(original_image_path).convert('RGB')
-    processed_image = Image.open(processed_image_path).convert('RGB')
-
-    original_array = np.array(original_image)
-    processed_array = np.array(processed_image)
-
-    mse = np.mean((original_array - processed_array) ** 2)
-    if mse == 0:
-        return float('inf')
-    max_pixel = 255.0
-    psnr = 20 * np.log10(max_pixel / np.sqrt(mse))
-    return psnr
+    return metrics.compare_files(original_image_path, processed_image_path).psnr()
 
 
-image_path = 'clown.bmp'
-message = 'Hello, world!'
-output_path = 'output_image.bmp'
-key = 12345
-embed_message(image_path, message, output_path, key)
+if __name__ == "__main__":
+    image_path = 'clown.bmp'
+    message = 'Hello, world!'
+    output_path = 'output_image.bmp'
+    key = 12345
+    bits_embedded = embed_message(image_path, message, output_path, key)
+    print(f'Количество внедренных бит: {bits_embedded}')
 
-extracted_message = extract_message(output_path, len(message) * 8, key)
-print(f'Извлеченное сообщение: {extracted_message}')
+    extracted_message = extract_message(output_path, key)
+    print(f'Извлеченное сообщение: {extracted_message}')
 
-psnr_value = calculate_psnr(image_path, output_path)
-print(f'PSNR для встраивания информации: {psnr_value} dB')
+    psnr_value = calculate_psnr(image_path, output_path)
+    print(f'PSNR для встраивания информации: {psnr_value} dB')
 
-print()
-error_count, restored_message = check_resilience(output_path, len(message) * 8, key)
-print(f'Количество ошибок извлечения: {error_count}')
-print(f'Восстановленное сообщение: {restored_message}')
+    print()
+    restored_image = attack_image(output_path)
+    error_count, restored_message = check_resilience(output_path, message, key)
+    print(f'Количество ошибок извлечения: {error_count}')
+    print(f'Восстановленное сообщение: {restored_message}')
 
-print()
-compressed_psnr_value = calculate_psnr(image_path, 'restored_image.bmp')
-print(f'PSNR после сжатия и восстановления: {compressed_psnr_value} dB')
\ No newline at end of file
+    print()
+    compressed_psnr_value = metrics.psnr(images.to_array(image_path), images.to_array(restored_image))
+    print(f'PSNR после сжатия и восстановления: {compressed_psnr_value} dB')
@@ -1,101 +1,486 @@
+import os
+import sys
 from PIL import Image
 import numpy as np
-from scipy.fft import dct, idct
+from scipy.fft import dctn, idctn
+
+if __package__ in (None, ''):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stego import images, metrics, parallel, profiling, tiles
+from stego.codec import bits_to_bytes, bytes_to_bits, decode_text, encode_text
+from stego.fec import get_code
+from stego.header import (HEADER_BITS, METHOD_KOCH, build_frame, decode_body, header_size, read_header,
+                          verify_payload)
+
+# Байт рабочей памяти на пиксель при обработке полосами: float64 на три канала и uint8-копии
+TILE_BYTES_PER_PIXEL = 32
+
+# Пары среднечастотных коэффициентов блока 8x8 без общих коэффициентов.
+# Пара 0 используется по умолчанию и несет заголовок
+KOCH_PAIRS = (
+    ((3, 4), (4, 3)),
+    ((2, 5), (5, 2)),
+    ((4, 5), (5, 4)),
+    ((2, 4), (4, 2)),
+)
+MAX_PAIRS = len(KOCH_PAIRS)
+CHANNEL_COUNT = 3
+# Число пар каждого канала хранится в параметрах заголовка: по 2 бита на канал, следующий бит - адаптивный режим
+PAIR_BITS = 2
+ADAPTIVE_FLAG = 1 << (PAIR_BITS * CHANNEL_COUNT)
+# Адаптивный режим: сообщение занимает блоки с текстурностью не ниже порога. Код порога (байт)
+# встраивается сразу после заголовка; порог кода - 2^(код/TEXTURE_STEPS) - 1
+CUTOFF_BITS = 8
+TEXTURE_STEPS = 16
+# Запас текстурности выбранных блоков над порогом: округление пикселей не должно опустить их ниже
+TEXTURE_MARGIN = 16.0
+ADAPTIVE_ATTEMPTS = 8
+# Порог блока - от половины до полного threshold в зависимости от текстурности
+THRESHOLD_SCALE = (0.5, 1.0)
+# Первые блоки канала 0 заняты заголовком и кодом порога (для заголовка версии 1)
+FIXED_BLOCKS = HEADER_BITS + CUTOFF_BITS
+
+def _texture_mask():
+    # Текстурность блока считается без DC и без коэффициентов пар, которые меняет встраивание
+    mask = np.ones((8, 8), dtype=bool)
+    mask[0, 0] = False
+    for pair in KOCH_PAIRS:
+        for row, col in pair:
+            mask[row, col] = False
+    return mask
+
+TEXTURE_MASK = _texture_mask()
+
+def _channel_pairs(pairs):
+    # pairs - число пар на блок для всех каналов или по числу на каждый канал (R, G, B)
+    if isinstance(pairs, (int, np.integer)):
+        pairs = (pairs,) * CHANNEL_COUNT
+    pairs = tuple(int(count) for count in pairs)
+    if len(pairs) == 1:
+        pairs *= CHANNEL_COUNT
+    if len(pairs) != CHANNEL_COUNT or any(not 1 <= count <= MAX_PAIRS for count in pairs):
+        raise ValueError(f"Число пар коэффициентов должно быть от 1 до {MAX_PAIRS} для каждого из каналов")
+    return pairs
+
+def _encode_options(channel_pairs, adaptive=False):
+    options = sum((count - 1) << (PAIR_BITS * channel) for channel, count in enumerate(channel_pairs))
+    return options | (ADAPTIVE_FLAG if adaptive else 0)
+
+def _decode_options(options):
+    mask = (1 << PAIR_BITS) - 1
+    channel_pairs = tuple(((options >> (PAIR_BITS * channel)) & mask) + 1 for channel in range(CHANNEL_COUNT))
+    return channel_pairs, bool(options & ADAPTIVE_FLAG)
+
+def _texture_cutoff(code):
+    return 2 ** (code / TEXTURE_STEPS) - 1
+
+def _adaptive_selection(texture, cutoff, fixed_blocks=FIXED_BLOCKS):
+    # Блоки сообщения (каналы, номера блоков): все блоки с текстурностью не ниже порога,
+    # по каналам и построчно. Блоки вне выбора не изменяются, поэтому извлечение получает тот же выбор
+    selected = texture >= cutoff
+    selected[0, :fixed_blocks] = False
+    return np.nonzero(selected)
+
+def _segments(block_count, channel_pairs, header_bits=HEADER_BITS):
+    # Раскладка бит: участки (канал, первый блок, число блоков, пар на блок) по порядку.
+    # Заголовок занимает первые header_bits блоков канала 0 по одной паре, поэтому читается
+    # до того, как известно число пар; при одной паре раскладка совпадает с прежней
+    first_pairs = channel_pairs[0]
+    if first_pairs == 1:
+        segments = [(0, 0, block_count, 1)]
+    else:
+        header_blocks = min(header_bits, block_count)
+        segments = [(0, 0, header_blocks, 1), (0, header_blocks, block_count - header_blocks, first_pairs)]
+    for channel in range(1, CHANNEL_COUNT):
+        segments.append((channel, 0, block_count, channel_pairs[channel]))
+    return segments
+
+def block_dct(image, workers=1):
+    # Коэффициенты DCT всех блоков всех каналов изображения (H, W, 3): массив (3, H/8, W/8, 8, 8)
+    rows, cols = image.shape[0] // 8, image.shape[1] // 8
+    blocks = image[:rows * 8, :cols * 8].reshape(rows, 8, cols, 8, CHANNEL_COUNT).transpose(4, 0, 2, 1, 3)
+    return dctn(blocks.astype(float), axes=(-2, -1), norm='ortho', workers=parallel.worker_count(workers))
 
 class KochSteganography:
-    def __init__(self, threshold=50):
+    def __init__(self, threshold=50, pairs=1, adaptive=False, workers=1, fec=None):
+        # adaptive - сообщение занимает сначала самые текстурные блоки, порог масштабируется по блоку;
+        # workers - число потоков для преобразований блоков (None - по числу процессоров)
+        if not np.isfinite(threshold) or threshold <= 0:
+            raise ValueError("Порог должен быть конечным положительным числом")
         self.threshold = threshold
-        self.dct_pairs = [
-            ((3,4), (4,3)),
-        ]
-
-    def _split_into_blocks(self, image):
-        height, width = image.shape
-        blocks = []
-        positions = []
-        for i in range(0, height-7, 8):
-            for j in range(0, width-7, 8):
-                block = image[i:i+8, j:j+8]
-                if block.shape == (8, 8):
-                    blocks.append(block)
-                    positions.append((i, j))
-        return blocks, positions
-
-    def _embed_bit(self, dct_block, bit):
-        pos1, pos2 = self.dct_pairs[0]
-        if bit == 0:
-            if dct_block[pos1] <= dct_block[pos2]:
-                diff = abs(dct_block[pos1] - dct_block[pos2])
-                adjustment = self.threshold + diff
-                dct_block[pos1] += adjustment
-                dct_block[pos2] -= adjustment
-        else:
-            if dct_block[pos1] >= dct_block[pos2]:
-                diff = abs(dct_block[pos1] - dct_block[pos2])
-                adjustment = self.threshold + diff
-                dct_block[pos1] -= adjustment
-                dct_block[pos2] += adjustment
-        return dct_block
-
-    def _extract_bit(self, dct_block):
-        pos1, pos2 = self.dct_pairs[0]
-        return 0 if dct_block[pos1] > dct_block[pos2] else 1
-
-    def embed_message(self, image_path, message, output_path):
-        img = Image.open(image_path).convert('RGB')
-        image = np.array(img, dtype=float)
+        self.dct_pairs = list(KOCH_PAIRS)
+        self.channel_pairs = _channel_pairs(pairs)
+        self.adaptive = adaptive
+        self.workers = workers
+        self.fec = get_code(fec)
+        # Число бит заголовка встраиваемого кадра; при извлечении берется из найденного заголовка
+        self.header_bits = header_size(self.fec) * 8
+
+    def _channel_slots(self, image, start, stop, channel_pairs, first_block_row=0, grid_rows=None,
+                       header_bits=HEADER_BITS, dct_blocks=None):
+        # Блоки, несущие биты с номерами [start, stop): для каждого участка раскладки -
+        # блоки, номера их бит (N, пар на блок) и маска бит, попадающих в диапазон.
+        # image может быть горизонтальной полосой, начинающейся с блочной строки first_block_row
+        # изображения высотой grid_rows блоков. С dct_blocks блоки берутся из готовых коэффициентов
+        slots = []
+        offset = 0
+        for channel, first_block, block_count, pair_count in self._layout(image, channel_pairs, grid_rows,
+                                                                          header_bits):
+            blocks = images.block_view(image[:, :, channel]) if dct_blocks is None else dct_blocks[channel]
+            rows, cols = blocks.shape[:2]
+            segment_bits = block_count * pair_count
+            # Блоки участка с нужными битами, ограниченные полосой
+            low = first_block + max(0, start - offset) // pair_count
+            high = first_block + min(block_count, -(-max(0, stop - offset) // pair_count))
+            low = max(low, first_block_row * cols)
+            high = min(high, (first_block_row + rows) * cols)
+            if low < high:
+                block_indices = np.arange(low, high)
+                bit_indices = (offset + (block_indices - first_block)[:, np.newaxis] * pair_count
+                               + np.arange(pair_count))
+                mask = (bit_indices >= start) & (bit_indices < stop)
+                block_rows, block_cols = np.divmod(block_indices - first_block_row * cols, cols)
+                slots.append((blocks, block_rows, block_cols, bit_indices - start, mask))
+            offset += segment_bits
+        return slots
+
+    def _layout(self, image, channel_pairs, grid_rows=None, header_bits=HEADER_BITS):
+        rows = image.shape[0] // 8 if grid_rows is None else grid_rows
+        return _segments(rows * (image.shape[1] // 8), channel_pairs, header_bits)
+
+    def _capacity(self, image, channel_pairs=None, adaptive=False, header_bits=None):
+        return self.capacity(image.shape[1], image.shape[0], channel_pairs, adaptive, header_bits)
+
+    def capacity(self, width, height, channel_pairs=None, adaptive=None, header_bits=None):
+        # В адаптивном режиме - наибольшая емкость, если все блоки достаточно текстурные
+        channel_pairs = self.channel_pairs if channel_pairs is None else channel_pairs
+        adaptive = self.adaptive if adaptive is None else adaptive
+        header_bits = self.header_bits if header_bits is None else header_bits
+        block_count = (height // 8) * (width // 8)
+        if adaptive:
+            fixed = min(header_bits + CUTOFF_BITS, block_count)
+            return min(header_bits, block_count) + sum(channel_pairs) * block_count - channel_pairs[0] * fixed
+        return sum(count * pairs for _, _, count, pairs in _segments(block_count, channel_pairs, header_bits))
+
+    def _pair_coordinates(self, pair_count):
+        first, second = zip(*self.dct_pairs[:pair_count])
+        return np.array(first).T, np.array(second).T
+
+    def _embed_block_bits(self, dct_blocks, bits, mask, threshold=None):
+        # Все пары всех блоков изменяются за один проход: dct_blocks (N, 8, 8), bits и mask (N, пар);
+        # threshold - общий порог или порог каждого блока (N, 1)
+        threshold = self.threshold if threshold is None else threshold
+        (r1, c1), (r2, c2) = self._pair_coordinates(bits.shape[1])
+        first = dct_blocks[:, r1, c1]
+        second = dct_blocks[:, r2, c2]
+        # Разность пары доводится до порога, чтобы бит пережил округление пикселей
+        diff = first - second
+        to_zero = mask & (bits == 0) & (diff < threshold)
+        to_one = mask & (bits == 1) & (-diff < threshold)
+        shift = np.where(to_zero, (threshold - diff) / 2, 0.0) - np.where(to_one, (threshold + diff) / 2, 0.0)
+        dct_blocks[:, r1, c1] = first + shift
+        dct_blocks[:, r2, c2] = second - shift
+        return dct_blocks
+
+    def _extract_block_bits(self, dct_blocks, pair_count):
+        (r1, c1), (r2, c2) = self._pair_coordinates(pair_count)
+        return np.where(dct_blocks[:, r1, c1] > dct_blocks[:, r2, c2], 0, 1).astype(np.uint8)
 
-        binary_message = ''.join(format(ord(c), '08b') for c in message)
-        message_length = len(binary_message)
+    def _extract_block_margins(self, dct_blocks, pair_count):
+        # Запасы бит (N, пар): разность пары со знаком бита, после встраивания не меньше порога блока
+        (r1, c1), (r2, c2) = self._pair_coordinates(pair_count)
+        return dct_blocks[:, r2, c2] - dct_blocks[:, r1, c1]
 
-        blocks = []
-        positions = []
-        for channel in range(3):
-            channel_blocks, channel_positions = self._split_into_blocks(image[:,:,channel])
-            blocks.extend(channel_blocks)
-            positions.extend([(pos, channel) for pos in channel_positions])
+    def _embed_slots(self, slots, bits, thresholds=None):
+        # Блоки каждого участка делятся на полосы строк, которые обрабатываются потоками
+        for index, (blocks, block_rows, block_cols, bit_indices, mask) in enumerate(slots):
+            threshold = None if thresholds is None else thresholds[index]
 
-        if len(blocks) < message_length:
+            def embed_band(band):
+                with profiling.stage('split'):
+                    selected = blocks[block_rows[band], block_cols[band]]
+                    band_mask = mask[band]
+                    block_bits = bits[np.where(band_mask, bit_indices[band], 0)]
+                with profiling.stage('dct'):
+                    dct_blocks = dctn(selected, axes=(-2, -1), norm='ortho')
+                with profiling.stage('modify'):
+                    band_threshold = None if threshold is None else threshold[band]
+                    modified_dct = self._embed_block_bits(dct_blocks, block_bits, band_mask, band_threshold)
+                with profiling.stage('idct'):
+                    blocks[block_rows[band], block_cols[band]] = idctn(modified_dct, axes=(-2, -1), norm='ortho')
+
+            parallel.map_bands(embed_band, parallel.row_bands(block_rows, self.workers))
+
+    def _extract_slots(self, slots, count, soft=False, transformed=False):
+        # transformed - блоки слотов уже содержат коэффициенты DCT
+        extracted_bits = np.zeros(count, dtype=float if soft else np.uint8)
+        extract_values = self._extract_block_margins if soft else self._extract_block_bits
+        for blocks, block_rows, block_cols, bit_indices, mask in slots:
+
+            def extract_band(band):
+                with profiling.stage('split'):
+                    selected = blocks[block_rows[band], block_cols[band]]
+                if transformed:
+                    dct_blocks = selected
+                else:
+                    with profiling.stage('dct'):
+                        dct_blocks = dctn(selected, axes=(-2, -1), norm='ortho')
+                with profiling.stage('extract'):
+                    band_mask = mask[band]
+                    extracted_bits[bit_indices[band][band_mask]] = \
+                        extract_values(dct_blocks, mask.shape[1])[band_mask]
+
+            parallel.map_bands(extract_band, parallel.row_bands(block_rows, self.workers))
+        return extracted_bits
+
+    def embed_bits(self, image, bits, first_block_row=0, grid_rows=None, channel_pairs=None, header_bits=None):
+        # image - массив (H, W, 3) типа float, изменяется на месте
+        channel_pairs = self.channel_pairs if channel_pairs is None else channel_pairs
+        header_bits = self.header_bits if header_bits is None else header_bits
+        if grid_rows is None and self._capacity(image, channel_pairs, header_bits=header_bits) < bits.size:
             raise ValueError("Изображение слишком маленькое для этого сообщения")
 
-        for idx, bit in enumerate(binary_message):
-            if idx < len(blocks):
-                dct_block = dct(dct(blocks[idx].T, norm='ortho').T, norm='ortho')
-                modified_dct = self._embed_bit(dct_block, int(bit))
-                modified_block = idct(idct(modified_dct.T, norm='ortho').T, norm='ortho')
-                i, j = positions[idx][0]
-                channel = positions[idx][1]
-                image[i:i+8, j:j+8, channel] = modified_block
+        with profiling.stage('split'):
+            slots = self._channel_slots(image, 0, bits.size, channel_pairs, first_block_row, grid_rows, header_bits)
+        self._embed_slots(slots, bits)
+
+    def extract_bits(self, image, count, start=0, channel_pairs=None, header_bits=None, soft=False,
+                     dct_blocks=None):
+        # soft=True - вместо бит возвращаются их запасы (см. stego.codec);
+        # dct_blocks - готовые коэффициенты DCT блоков (3, H/8, W/8, 8, 8), см. block_dct
+        channel_pairs = self.channel_pairs if channel_pairs is None else channel_pairs
+        header_bits = self.header_bits if header_bits is None else header_bits
+        with profiling.stage('split'):
+            slots = self._channel_slots(image, start, start + count, channel_pairs, header_bits=header_bits,
+                                        dct_blocks=dct_blocks)
+        return self._extract_slots(slots, count, soft, dct_blocks is not None)
 
-        Image.fromarray(np.uint8(np.clip(image, 0, 255))).save(output_path, 'BMP')
+    def _texture(self, image, dct_blocks=None):
+        # Текстурность всех блоков всех каналов за один проход: сумма модулей AC-коэффициентов (3, блоков)
+        if dct_blocks is None:
+            dct_blocks = block_dct(image, self.workers)
+        coefficients = dct_blocks.reshape(CHANNEL_COUNT, -1, 8, 8)
+        return np.abs(coefficients[:, :, TEXTURE_MASK]).sum(axis=-1)
 
-        with open(output_path, 'ab') as f:
-            f.write(message_length.to_bytes(4, byteorder='big'))
+    def _adaptive_slots(self, image, selection, start, stop, channel_pairs, header_bits=HEADER_BITS,
+                        dct_blocks=None):
+        # Блоки выбора, несущие биты сообщения [start, stop) (start не меньше header_bits);
+        # вместе со слотами возвращаются каналы и номера использованных блоков
+        channels, block_numbers = selection
+        pair_counts = np.asarray(channel_pairs)[channels]
+        offsets = header_bits + np.cumsum(pair_counts) - pair_counts
+        if header_bits + pair_counts.sum() < stop:
+            raise ValueError("Недостаточно текстурных блоков для этого сообщения")
+        used = (offsets < stop) & (offsets + pair_counts > start)
+        slots, blocks_used = [], []
+        for channel in range(CHANNEL_COUNT):
+            chosen = used & (channels == channel)
+            if not chosen.any():
+                continue
+            blocks = images.block_view(image[:, :, channel]) if dct_blocks is None else dct_blocks[channel]
+            block_rows, block_cols = np.divmod(block_numbers[chosen], blocks.shape[1])
+            bit_indices = offsets[chosen][:, np.newaxis] + np.arange(channel_pairs[channel])
+            mask = (bit_indices >= start) & (bit_indices < stop)
+            slots.append((blocks, block_rows, block_cols, bit_indices - start, mask))
+            blocks_used.append((channel, block_numbers[chosen]))
+        return slots, blocks_used
 
-    def extract_message(self, image_path, message_length):
-        img = Image.open(image_path).convert('RGB')
+    def _cutoff_codes(self, texture, bit_count):
+        # Коды порога от наибольшего, при которых выбранным блокам хватает емкости и текстурность
+        # каждого использованного блока выше порога с запасом. Код 0 (порог 0) подходит всегда
+        header_bits = self.header_bits
+        for code in range(2 ** CUTOFF_BITS - 1, 0, -1):
+            cutoff = _texture_cutoff(code)
+            channels, block_numbers = _adaptive_selection(texture, cutoff, header_bits + CUTOFF_BITS)
+            pair_counts = np.asarray(self.channel_pairs)[channels]
+            offsets = header_bits + np.cumsum(pair_counts) - pair_counts
+            used = offsets < bit_count
+            if header_bits + pair_counts.sum() < bit_count:
+                continue
+            if not used.any() or texture[channels[used], block_numbers[used]].min() >= cutoff + TEXTURE_MARGIN:
+                yield code
+        yield 0
+
+    def _embed_adaptive(self, image, bits):
+        # image - массив (H, W, 3) типа float; возвращает итоговый массив uint8.
+        # Встраивание проверяется извлечением: если округление изменило выбор блоков, берется меньший порог,
+        # если исказило биты (в том числе заголовка и кода порога) - порог встраивания этих блоков увеличивается
+        if self._capacity(image, adaptive=True) < bits.size:
+            raise ValueError("Изображение слишком маленькое для этого сообщения")
+        with profiling.stage('texture'):
+            texture = self._texture(image)
+        boost = np.ones_like(texture)
+        codes = self._cutoff_codes(texture, bits.size)
+        code = next(codes)
+        fixed_pairs = (1,) * CHANNEL_COUNT
+        header_bits = self.header_bits
+        fixed_blocks = header_bits + CUTOFF_BITS
+
+        for _ in range(ADAPTIVE_ATTEMPTS):
+            fixed_bits = np.concatenate([bits[:header_bits],
+                                         np.unpackbits(np.array([code], dtype=np.uint8))])
+            selection = _adaptive_selection(texture, _texture_cutoff(code), fixed_blocks)
+            stego = image.copy()
+            with profiling.stage('split'):
+                # Фиксированные блоки - первые блоки канала 0, в выбор они не входят; их порог тоже в boost
+                fixed_slots = self._channel_slots(stego, 0, fixed_bits.size, fixed_pairs, header_bits=header_bits)
+            self._embed_slots(fixed_slots, fixed_bits, [self.threshold * boost[0, :fixed_blocks, np.newaxis]])
+            with profiling.stage('split'):
+                slots, blocks_used = self._adaptive_slots(stego, selection, 0, bits.size, self.channel_pairs,
+                                                          header_bits)
+                # Порог растет с текстурностью блока относительно медианы: гладкие блоки искажаются меньше
+                reference = max(np.median(np.concatenate([texture[channel, numbers]
+                                                          for channel, numbers in blocks_used])), 1.0)
+                thresholds = [self.threshold * boost[channel, numbers, np.newaxis]
+                              * np.clip(np.sqrt(texture[channel, numbers, np.newaxis] / reference),
+                                        *THRESHOLD_SCALE)
+                              for channel, numbers in blocks_used]
+            self._embed_slots(slots, bits, thresholds)
+            result = np.uint8(np.clip(stego, 0, 255))
+
+            with profiling.stage('verify'):
+                check = result.astype(float)
+                fixed_wrong = self.extract_bits(check, fixed_bits.size, channel_pairs=fixed_pairs) != fixed_bits
+                check_selection = _adaptive_selection(self._texture(check), _texture_cutoff(code), fixed_blocks)
+                try:
+                    check_slots, check_used = self._adaptive_slots(check, check_selection, header_bits,
+                                                                   bits.size, self.channel_pairs, header_bits)
+                except ValueError:
+                    check_used = None
+            if fixed_wrong.any():
+                boost[0, np.nonzero(fixed_wrong)[0]] *= 2
+                continue
+            if check_used is None or any(channel != check_channel or not np.array_equal(numbers, check_numbers)
+                                         for (channel, numbers), (check_channel, check_numbers)
+                                         in zip(blocks_used, check_used)):
+                # Выбор блоков изменился: следующая попытка с меньшим порогом
+                code = next(codes, 0)
+                continue
+            extracted = self._extract_slots(check_slots, bits.size - header_bits)
+            if np.array_equal(extracted, bits[header_bits:]):
+                return result
+            # Биты искажены округлением или ограничением яркости: порог этих блоков увеличивается
+            for (channel, numbers), (_, _, _, bit_indices, mask) in zip(blocks_used, slots):
+                positions = np.where(mask, bit_indices - header_bits, 0)
+                wrong = mask & (extracted[positions] != bits[header_bits:][positions])
+                boost[channel, numbers[wrong.any(axis=1)]] *= 2
+        raise ValueError("Не удалось встроить сообщение в адаптивном режиме: извлечение не совпадает")
+
+    def _embed_tiled(self, image_path, bits, output_path, tile_budget, meter=None):
+        width, height = tiles.image_size(image_path)
+        if self.capacity(width, height) < bits.size:
+            raise ValueError("Изображение слишком маленькое для этого сообщения")
+
+        def transform(top, strip):
+            image = strip.astype(float)
+            self.embed_bits(image, bits, top // 8, height // 8)
+            result = np.uint8(np.clip(image, 0, 255))
+            if meter is not None:
+                meter.update(strip, result)
+            return result
+
+        rows_per_strip = tiles.strip_height(width, tile_budget, TILE_BYTES_PER_PIXEL)
+        tiles.process_strips(image_path, output_path, rows_per_strip, transform)
+
+    @profiling.profiled('koch.embed')
+    def embed_message(self, image_path, message, output_path, tile_budget=None, meter=None):
+        # meter (metrics.QualityMeter) получает исходное и итоговое изображения из памяти
+        with profiling.stage('payload'):
+            bits = bytes_to_bits(build_frame(METHOD_KOCH, encode_text(message),
+                                             _encode_options(self.channel_pairs, self.adaptive), fec=self.fec))
+        if tile_budget is not None:
+            if self.adaptive:
+                raise ValueError("Адаптивный режим требует всего изображения и не поддерживает обработку полосами")
+            self._embed_tiled(image_path, bits, output_path, tile_budget, meter)
+            return bits.size
+
+        images.save(self._embed_image(image_path, bits, meter), output_path, 'BMP')
+        return bits.size
+
+    def _embed_image(self, image, bits, meter):
+        img = images.load(image, 'RGB')
         image = np.array(img, dtype=float)
+        if self.adaptive:
+            result = self._embed_adaptive(image, bits)
+        else:
+            self.embed_bits(image, bits)
+            result = np.uint8(np.clip(image, 0, 255))
+        if meter is not None:
+            with profiling.stage('metrics'):
+                metrics.compare_arrays(np.asarray(img), result, meter)
+        return Image.fromarray(result)
 
-        blocks = []
-        for channel in range(3):
-            channel_blocks, _ = self._split_into_blocks(image[:,:,channel])
-            blocks.extend(channel_blocks)
+    @profiling.profiled('koch.embed')
+    def embed_image(self, image, message, meter=None):
+        with profiling.stage('payload'):
+            bits = bytes_to_bits(build_frame(METHOD_KOCH, encode_text(message),
+                                             _encode_options(self.channel_pairs, self.adaptive), fec=self.fec))
+        return self._embed_image(image, bits, meter)
 
-        extracted_bits = []
-        for idx in range(message_length * 8):
-            if idx < len(blocks):
-                dct_block = dct(dct(blocks[idx].T, norm='ortho').T, norm='ortho')
-                bit = self._extract_bit(dct_block)
-                extracted_bits.append(str(bit))
+    def _read_bytes(self, image, start, count, channel_pairs, header_bits=HEADER_BITS, soft=False,
+                    dct_blocks=None):
+        # При soft=True возвращаются запасы бит вместо байт
+        if start + count * 8 > self._capacity(image, channel_pairs, header_bits=header_bits):
+            raise ValueError("Изображение не содержит сообщения заявленной длины")
+        bits = self.extract_bits(image, count * 8, start, channel_pairs, header_bits, soft, dct_blocks)
+        return bits if soft else bits_to_bytes(bits)
 
-        binary_string = ''.join(extracted_bits)
-        message = ''
-        for i in range(0, len(binary_string), 8):
-            byte = binary_string[i:i+8]
-            if len(byte) == 8:
-                message += chr(int(byte, 2))
+    def _header_reader(self, image, dct_blocks=None):
+        # Последовательное чтение заголовка из пары 0: раскладка с одной парой не зависит от его размера
+        position = 0
 
-        return message
+        def read_bytes(count):
+            nonlocal position
+            data = self._read_bytes(image, position, count, (1,) * CHANNEL_COUNT, dct_blocks=dct_blocks)
+            position += count * 8
+            return data
+
+        return read_bytes
+
+    def _read_adaptive(self, image, count, channel_pairs, header_bits=HEADER_BITS, soft=False, dct_blocks=None):
+        # Выбор блоков восстанавливается по текстурности самого стегоизображения и коду порога
+        if header_bits + count * 8 > self._capacity(image, channel_pairs, adaptive=True, header_bits=header_bits):
+            raise ValueError("Изображение не содержит сообщения заявленной длины")
+        code = int(bits_to_bytes(self.extract_bits(image, CUTOFF_BITS, header_bits, (1,) * CHANNEL_COUNT,
+                                                   dct_blocks=dct_blocks))[0])
+        with profiling.stage('texture'):
+            selection = _adaptive_selection(self._texture(image, dct_blocks), _texture_cutoff(code),
+                                            header_bits + CUTOFF_BITS)
+        with profiling.stage('split'):
+            try:
+                slots, _ = self._adaptive_slots(image, selection, header_bits, header_bits + count * 8,
+                                                channel_pairs, header_bits, dct_blocks)
+            except ValueError:
+                raise ValueError("Изображение не содержит сообщения заявленной длины")
+        bits = self._extract_slots(slots, count * 8, soft, dct_blocks is not None)
+        return bits if soft else bits_to_bytes(bits)
+
+    @profiling.profiled('koch.extract')
+    def extract_message(self, image_path, soft=False):
+        return self.extract_image(image_path, soft)
+
+    @profiling.profiled('koch.extract')
+    def extract_image(self, image, soft=False, dct_blocks=None):
+        # soft=True - сообщение, защищенное кодом, декодируется мягкими решениями по запасам бит.
+        # dct_blocks - готовые коэффициенты блоков этого изображения (см. block_dct, stego.session):
+        # тогда пиксели не преобразуются, а image (массив RGB) задает только размер
+        if dct_blocks is None:
+            image = images.to_array(image, 'RGB', float)
+        # Заголовок всегда лежит в паре 0, число пар каналов берется из его параметров
+        header = read_header(self._header_reader(image, dct_blocks), METHOD_KOCH)
+        channel_pairs, adaptive = _decode_options(header.options)
+        header_bits = header.size * 8
+        # Без кода мягкие решения ничего не дают, а при равенстве пары жесткое правило дает 1, а не 0
+        soft = soft and header.fec is not None
+        if adaptive:
+            body = self._read_adaptive(image, header.body_size, channel_pairs, header_bits, soft, dct_blocks)
+        else:
+            body = self._read_bytes(image, header_bits, header.body_size, channel_pairs, header_bits, soft,
+                                    dct_blocks)
+        payload = decode_body(header, body, soft)
+        verify_payload(header, payload)
+        return decode_text(payload)
 
 def main():
     steganography = KochSteganography(threshold=50)
@@ -107,7 +492,7 @@ def main():
     print(f"Сообщение '{message}' встроено в изображение output.bmp")
 
     print("\nИзвлечение сообщения...")
-    extracted_message = steganography.extract_message('output.bmp', len(message))
+    extracted_message = steganography.extract_message('output.bmp')
     print(f"Извлеченное сообщение: {extracted_message}")
 
     if message == extracted_message:
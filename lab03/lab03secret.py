@@ -1,129 +1,264 @@
-import random
+import os
+import sys
 import numpy as np
 from PIL import Image
-import math
 import scipy.fftpack
 
-# Русские буквы, которые мы будем отображать в диапазон ASCII от 128 до 159
-russian_to_ascii = {
-    'А': 128, 'Б': 129, 'В': 130, 'Г': 131, 'Д': 132, 'Е': 133, 'Ж': 134, 'З': 135, 'И': 136, 'Й': 137,
-    'К': 138, 'Л': 139, 'М': 140, 'Н': 141, 'О': 142, 'П': 143, 'Р': 144, 'С': 145, 'Т': 146, 'У': 147,
-    'Ф': 148, 'Х': 149, 'Ц': 150, 'Ч': 151, 'Ш': 152, 'Щ': 153, 'Ъ': 154, 'Ы': 155, 'Ь': 156, 'Э': 157,
-    'Ю': 158, 'Я': 159, 'а': 128, 'б': 129, 'в': 130, 'г': 131, 'д': 132, 'е': 133, 'ж': 134, 'з': 135,
-    'и': 136, 'й': 137, 'к': 138, 'л': 139, 'м': 140, 'н': 141, 'о': 142, 'п': 143, 'р': 144, 'с': 145,
-    'т': 146, 'у': 147, 'ф': 148, 'х': 149, 'ц': 150, 'ч': 151, 'ш': 152, 'щ': 153, 'ъ': 154, 'ы': 155,
-    'ь': 156, 'э': 157, 'ю': 158, 'я': 159
-}
-ascii_to_russian = {v: k for k, v in russian_to_ascii.items()}
-
-def text_to_bits(text):
-    bits = []
-    for char in text:
-        if char in russian_to_ascii:
-            bits.append(format(russian_to_ascii[char], '08b'))
-        else:
-            bits.append(format(ord(char), '08b'))
-    return ''.join(bits)
-
-def bits_to_text(bits):
-    chars = []
-    for i in range(0, len(bits), 8):
-        byte = bits[i:i+8]
-        ascii_code = int(byte, 2)
-        chars.append(chr(ascii_code))
-        # if 128 <= ascii_code <= 159:
-        #     chars.append(ascii_to_russian[ascii_code])
-        # else:
-        #     chars.append(chr(ascii_code))
-    return ''.join(chars)
+if __package__ in (None, ''):
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stego import images, jpeg, metrics, parallel, profiling, tiles
+from stego.codec import bits_to_bytes, bytes_to_bits, decode_text, encode_text
+from stego.header import METHOD_DCT_SWAP, METHOD_JPEG_SWAP, build_frame, read_frame
+from stego.permutation import block_positions
+
+COEFFICIENT_PAIR = ((3, 5), (5, 3))
+SWAP_MARGIN = 2.0
+# Квантованные коэффициенты JPEG целые и не меняются при копировании файла: достаточно одного шага
+JPEG_SWAP_MARGIN = 1
+# Байт рабочей памяти на пиксель при обработке полосами: RGB, YCbCr и результат
+TILE_BYTES_PER_PIXEL = 12
 
+# Двумерные преобразования по двум последним осям: один блок (8, 8) или пачка блоков (N, 8, 8)
 def dct2(block):
-    return scipy.fftpack.dct(scipy.fftpack.dct(block.T, norm='ortho').T, norm='ortho')
+    return scipy.fftpack.dct(scipy.fftpack.dct(block, axis=-2, norm='ortho'), axis=-1, norm='ortho')
 
 def idct2(block):
-    return scipy.fftpack.idct(scipy.fftpack.idct(block.T, norm='ortho').T, norm='ortho')
+    return scipy.fftpack.idct(scipy.fftpack.idct(block, axis=-2, norm='ortho'), axis=-1, norm='ortho')
 
-def embed_message(image_path, message, seed_key=42):
-    img = Image.open(image_path).convert('YCbCr')
-    img_array = np.array(img)
-    
-    message_bits = text_to_bits(message)
+def calculate_capacity(width, height):
+    return (height // 8) * (width // 8)
+
+def _swap_coefficients(dct_blocks, bits, margin=SWAP_MARGIN):
+    # Бит 1: |c1| > |c2|, бит 0: |c1| < |c2|; коэффициенты меняются местами, если порядок неверный
+    c1, c2 = COEFFICIENT_PAIR
+    first = dct_blocks[:, c1[0], c1[1]]
+    second = dct_blocks[:, c2[0], c2[1]]
+    one = bits == 1
+    swap = np.where(one, np.abs(first) < np.abs(second), np.abs(first) > np.abs(second))
+    first, second = np.where(swap, second, first), np.where(swap, first, second)
+    larger = np.where(one, first, second)
+    smaller = np.where(one, second, first)
+
+    # Близкие по модулю коэффициенты разводим, иначе бит теряется при округлении пикселей
+    close = np.abs(larger) < np.abs(smaller) + margin
+    larger = np.where(close, np.copysign(np.abs(smaller) + margin, larger), larger)
+    dct_blocks[:, c1[0], c1[1]] = np.where(one, larger, smaller)
+    dct_blocks[:, c2[0], c2[1]] = np.where(one, smaller, larger)
+
+def block_dct(channel):
+    # Коэффициенты DCT всех блоков канала: массив (H/8, W/8, 8, 8)
+    return dct2(images.block_view(channel).astype(float))
+
+def _swap_margins(dct_blocks):
+    # Запасы бит правила пары: |c1| - |c2| (бит 1 при положительном запасе)
+    c1, c2 = COEFFICIENT_PAIR
+    return np.abs(dct_blocks[:, c1[0], c1[1]]) - np.abs(dct_blocks[:, c2[0], c2[1]])
+
+def embed_bits(img_array, message_bits, seed_key=42, top=0, grid_shape=None, workers=1):
+    # img_array - массив YCbCr (H, W, 3) типа uint8, канал Y изменяется на месте.
+    # При обработке полосами img_array - полоса, начинающаяся со строки top,
+    # а grid_shape - сетка блоков всего изображения.
+    # workers - число потоков: блоки делятся на полосы строк, обрабатываемые параллельно
     bits_count = len(message_bits)
-    random.seed(seed_key)
-    all_indexes = [(i, j) for i in range(0, img_array.shape[0], 8) for j in range(0, img_array.shape[1], 8)]
-    random.shuffle(all_indexes)
-    
-    bit_index = 0
-    for i, j in all_indexes:
-        if bit_index >= bits_count:
-            break
-        block = img_array[i:i+8, j:j+8, 0].astype(float)
-        dct_block = dct2(block)
-        
-        c1, c2 = (3, 5), (5, 3)
-        
-        if message_bits[bit_index] == '1':
-            if abs(dct_block[c1]) < abs(dct_block[c2]):
-                dct_block[c1], dct_block[c2] = dct_block[c2], dct_block[c1]
+    if grid_shape is None:
+        grid_shape = (img_array.shape[0] // 8, img_array.shape[1] // 8)
+        if bits_count > grid_shape[0] * grid_shape[1]:
+            raise ValueError("Сообщение слишком длинное для данного изображения")
+    rows, cols = block_positions(grid_shape, seed_key, bits_count)
+    in_strip = np.nonzero((rows >= top) & (rows < top + img_array.shape[0]))[0]
+    block_rows = (rows[in_strip] - top) // 8
+    block_cols = cols[in_strip] // 8
+    bits = np.asarray(message_bits)[in_strip]
+    blocks = images.block_view(img_array[:, :, 0])
+
+    def embed_band(band):
+        with profiling.stage('split'):
+            selected = blocks[block_rows[band], block_cols[band]].astype(float)
+        with profiling.stage('dct'):
+            dct_blocks = dct2(selected)
+        with profiling.stage('modify'):
+            _swap_coefficients(dct_blocks, bits[band])
+        with profiling.stage('idct'):
+            blocks[block_rows[band], block_cols[band]] = np.clip(idct2(dct_blocks), 0, 255)
+
+    parallel.map_bands(embed_band, parallel.row_bands(block_rows, workers))
+
+def extract_bits(stego_img, bits_count, seed_key=42, start=0, workers=1, soft=False, dct_blocks=None):
+    # soft=True - вместо бит возвращаются их запасы (см. stego.codec);
+    # dct_blocks - готовые коэффициенты блоков канала Y (см. block_dct)
+    grid_shape = (stego_img.shape[0] // 8, stego_img.shape[1] // 8)
+    rows, cols = block_positions(grid_shape, seed_key, start + bits_count)
+    block_rows = rows[start:] // 8
+    block_cols = cols[start:] // 8
+    blocks = images.block_view(stego_img[:, :, 0]) if dct_blocks is None else dct_blocks
+    extracted_bits = np.empty(bits_count, dtype=float if soft else np.uint8)
+
+    def extract_band(band):
+        with profiling.stage('split'):
+            selected = blocks[block_rows[band], block_cols[band]]
+        if dct_blocks is None:
+            with profiling.stage('dct'):
+                band_dct = dct2(selected.astype(float))
         else:
-            if abs(dct_block[c1]) > abs(dct_block[c2]):
-                dct_block[c1], dct_block[c2] = dct_block[c2], dct_block[c1]
-                
-        img_array[i:i+8, j:j+8, 0] = idct2(dct_block)
-        bit_index += 1
-    
-    stego_image = Image.fromarray(img_array, mode='YCbCr').convert('RGB')
-    stego_image.save("stego_output.bmp")
+            band_dct = selected
+        with profiling.stage('extract'):
+            margins = _swap_margins(band_dct)
+            extracted_bits[band] = margins if soft else margins > 0
+
+    parallel.map_bands(extract_band, parallel.row_bands(block_rows, workers))
+    return extracted_bits
+
+def _embed_tiled(image_path, message_bits, seed_key, output_path, tile_budget, meter=None, workers=1):
+    width, height = tiles.image_size(image_path)
+    grid_shape = (height // 8, width // 8)
+    if len(message_bits) > grid_shape[0] * grid_shape[1]:
+        raise ValueError("Сообщение слишком длинное для данного изображения")
+
+    def transform(top, strip):
+        img_array = np.array(Image.fromarray(strip).convert('YCbCr'))
+        embed_bits(img_array, message_bits, seed_key, top, grid_shape, workers)
+        result = np.array(Image.fromarray(img_array, mode='YCbCr').convert('RGB'))
+        if meter is not None:
+            meter.update(strip, result)
+        return result
+
+    rows_per_strip = tiles.strip_height(width, tile_budget, TILE_BYTES_PER_PIXEL)
+    tiles.process_strips(image_path, output_path, rows_per_strip, transform)
+
+@profiling.profiled('dct.embed')
+def embed_message(image_path, message, seed_key=42, output_path=None, tile_budget=None, meter=None, workers=1,
+                  fec=None):
+    # meter (metrics.QualityMeter) получает исходное и итоговое изображения RGB из памяти;
+    # workers - число потоков для преобразований блоков (None - по числу процессоров).
+    # Без output_path результат сохраняется рядом с контейнером: <имя>_stego.bmp
+    if output_path is None:
+        output_path = os.path.splitext(image_path)[0] + '_stego.bmp'
+    with profiling.stage('payload'):
+        message_bits = bytes_to_bits(build_frame(METHOD_DCT_SWAP, encode_text(message), fec=fec))
+    if tile_budget is not None:
+        _embed_tiled(image_path, message_bits, seed_key, output_path, tile_budget, meter, workers)
+        return len(message_bits)
+
+    images.save(_embed_image(image_path, message_bits, seed_key, meter, workers), output_path)
+    return len(message_bits)
+
+def _embed_image(image, message_bits, seed_key, meter, workers=1):
+    img = images.load(image, 'RGB')
+    img_array = np.array(img.convert('YCbCr'))
+    embed_bits(img_array, message_bits, seed_key, workers=workers)
+
+    with profiling.stage('convert'):
+        stego_image = Image.fromarray(img_array, mode='YCbCr').convert('RGB')
+    if meter is not None:
+        with profiling.stage('metrics'):
+            metrics.compare_arrays(np.asarray(img), np.asarray(stego_image), meter)
+    return stego_image
+
+@profiling.profiled('dct.embed')
+def embed_image(image, message, seed_key=42, meter=None, workers=1, fec=None):
+    # Результат всегда в режиме RGB
+    with profiling.stage('payload'):
+        message_bits = bytes_to_bits(build_frame(METHOD_DCT_SWAP, encode_text(message), fec=fec))
+    return _embed_image(image, message_bits, seed_key, meter, workers)
+
+def _block_reader(stego_img, seed_key, workers=1, soft=False, dct_blocks=None):
+    # При soft=True читатель возвращает запасы бит для read_frame(..., soft=True)
+    capacity = (stego_img.shape[0] // 8) * (stego_img.shape[1] // 8)
+    position = 0
+
+    def read_bytes(count):
+        nonlocal position
+        stop = position + count * 8
+        if stop > capacity:
+            raise ValueError("Изображение не содержит сообщения заявленной длины")
+        extracted_bits = extract_bits(stego_img, count * 8, seed_key, position, workers, soft, dct_blocks)
+        position = stop
+        return extracted_bits if soft else bits_to_bytes(extracted_bits)
+
+    return read_bytes
+
+@profiling.profiled('dct.extract')
+def extract_message(stego_path, seed_key=42, workers=1, soft=False):
+    return extract_image(stego_path, seed_key, workers, soft)
+
+@profiling.profiled('dct.extract')
+def extract_image(image, seed_key=42, workers=1, soft=False, dct_blocks=None):
+    # soft=True - сообщение, защищенное кодом, декодируется мягкими решениями по запасам бит.
+    # dct_blocks - готовые коэффициенты блоков канала Y этого изображения (см. block_dct, stego.session):
+    # тогда пиксели не преобразуются, а image (массив YCbCr) задает только размер
+    stego_img = images.to_array(image, 'YCbCr') if dct_blocks is None else image
+    _, payload = read_frame(_block_reader(stego_img, seed_key, workers, soft, dct_blocks), METHOD_DCT_SWAP, soft)
+    return decode_text(payload)
+
+def _jpeg_blocks(jpeg_image, seed_key, count, start=0):
+    # Блоки компонента Y (первого в кадре) в порядке ключевой перестановки, как у embed_bits
+    width, height = jpeg_image.component_size(0)
+    grid_shape = (height // 8, width // 8)
+    if start + count > grid_shape[0] * grid_shape[1]:
+        raise ValueError("Сообщение слишком длинное для данного изображения")
+    rows, cols = block_positions(grid_shape, seed_key, start + count)
+    return rows[start:] // 8, cols[start:] // 8
+
+def embed_jpeg(jpeg_image, message, seed_key=42, fec=None):
+    # Встраивание в jpeg.JpegImage на месте: то же правило пары коэффициентов, что у embed_message,
+    # но над квантованными коэффициентами, без перехода к пикселям
+    with profiling.stage('payload'):
+        message_bits = bytes_to_bits(build_frame(METHOD_JPEG_SWAP, encode_text(message), fec=fec))
+    block_rows, block_cols = _jpeg_blocks(jpeg_image, seed_key, len(message_bits))
+    coefficients = jpeg_image.components[0].coefficients
+    with profiling.stage('modify'):
+        dct_blocks = coefficients[block_rows, block_cols]
+        _swap_coefficients(dct_blocks, message_bits, JPEG_SWAP_MARGIN)
+        coefficients[block_rows, block_cols] = dct_blocks
+    return len(message_bits)
+
+@profiling.profiled('jpeg.embed')
+def embed_message_jpeg(image_path, message, seed_key=42, output_path=None, fec=None):
+    # Контейнер и результат - baseline JPEG; без output_path результат сохраняется как <имя>_stego.jpg
+    if output_path is None:
+        output_path = os.path.splitext(image_path)[0] + '_stego.jpg'
+    jpeg_image = jpeg.read(image_path)
+    bits_count = embed_jpeg(jpeg_image, message, seed_key, fec)
+    jpeg.write(jpeg_image, output_path)
     return bits_count
 
-def extract_message(stego_path, bits_count, seed_key=42):
-    stego_img = np.array(Image.open(stego_path).convert('YCbCr'))
-    extracted_bits = ""
-    
-    random.seed(seed_key)
-    all_indexes = [(i, j) for i in range(0, stego_img.shape[0], 8) for j in range(0, stego_img.shape[1], 8)]
-    random.shuffle(all_indexes)
-    
-    bit_index = 0
-    for i, j in all_indexes:
-        if bit_index >= bits_count:
-            break
-        block = stego_img[i:i+8, j:j+8, 0].astype(float)
-        dct_block = dct2(block)
-        
-        c1, c2 = (3, 5), (5, 3)
-
-        if abs(dct_block[c1]) > abs(dct_block[c2]):
-            extracted_bits += '1'
-        else:
-            extracted_bits += '0'
-            
-        bit_index += 1
-    
-    return bits_to_text(extracted_bits)
+def extract_jpeg(jpeg_image, seed_key=42, soft=False):
+    # soft=True - мягкое декодирование по запасам |c1| - |c2| квантованных коэффициентов
+    coefficients = jpeg_image.components[0].coefficients
+    capacity = calculate_capacity(*jpeg_image.component_size(0))
+    position = 0
+
+    def read_bytes(count):
+        nonlocal position
+        if position + count * 8 > capacity:
+            raise ValueError("Изображение не содержит сообщения заявленной длины")
+        block_rows, block_cols = _jpeg_blocks(jpeg_image, seed_key, count * 8, position)
+        position += count * 8
+        with profiling.stage('extract'):
+            margins = _swap_margins(coefficients[block_rows, block_cols])
+        return margins.astype(float) if soft else bits_to_bytes(margins > 0)
+
+    _, payload = read_frame(read_bytes, METHOD_JPEG_SWAP, soft)
+    return decode_text(payload)
+
+@profiling.profiled('jpeg.extract')
+def extract_message_jpeg(stego_path, seed_key=42, soft=False):
+    # stego_path - путь или байты файла JPEG
+    return extract_jpeg(jpeg.read(stego_path), seed_key, soft)
 
 def calculate_psnr(original_image_path, modified_image_path):
-    original_img = Image.open(original_image_path)
-    modified_img = Image.open(modified_image_path)
-    original_data = np.array(original_img, dtype=np.float64)
-    modified_data = np.array(modified_img, dtype=np.float64)
-    
-    mse = np.mean((original_data - modified_data) ** 2)
-    if mse == 0:
-        return float('inf')
-    
-    max_pixel_value = 255.0
-    psnr = 20 * math.log10(max_pixel_value / math.sqrt(mse))
-    return psnr
+    return metrics.compare_files(original_image_path, modified_image_path).psnr()
 
 def compress_image_jpeg(input_path, output_path, quality=50):
     img = Image.open(input_path)
     img.save(output_path, "JPEG", quality=quality)
 
 
-def visualize_changes(original_path, modified_path, output_path):
-    original_img = np.array(Image.open(original_path).convert('YCbCr'), dtype=np.float64)
-    modified_img = np.array(Image.open(modified_path).convert('YCbCr'), dtype=np.float64)
+def visualize_changes(original, modified, output_path):
+    # original, modified - пути, изображения PIL или массивы
+    original_img = images.to_array(original, 'YCbCr', np.float64)
+    modified_img = images.to_array(modified, 'YCbCr', np.float64)
     
     # Compute the absolute difference in the Y (luminance) channel
     difference = np.abs(original_img[..., 0] - modified_img[..., 0])
@@ -139,40 +274,35 @@ def convert_jpeg_to_bmp(jpeg_path, bmp_path):
     img = Image.open(jpeg_path)
     img.save(bmp_path, "BMP")
 
-# Test the updated implementation
-input_image = "clown.bmp"
-message = "Love GUAP n SUAI"
-
-bits_embedded = embed_message(input_image, message)
-print(f"Number of embedded bits: {bits_embedded}")
-
-extracted_message = extract_message("stego_output.bmp", bits_embedded)
-print(f"Extracted message: {extracted_message}")
-
-psnr_value = calculate_psnr(input_image, "stego_output.bmp")
-print(f"PSNR value: {psnr_value} dB")
+if __name__ == "__main__":
+    input_image = "clown.bmp"
+    message = "Love GUAP n SUAI"
+    stego_image_path = "stego_output.bmp"
 
-stego_image_path = "stego_output.bmp"
+    bits_embedded = embed_message(input_image, message, output_path=stego_image_path)
+    print(f"Number of embedded bits: {bits_embedded}")
 
-compressed_path = "compressed_output.jpg"
-compress_image_jpeg(stego_image_path, compressed_path, quality=50)
-convert_jpeg_to_bmp(compressed_path, "compressed_output.bmp")
+    extracted_message = extract_message(stego_image_path)
+    print(f"Extracted message: {extracted_message}")
 
-compressed_bits_count = bits_embedded
-extracted_message_after_compression = extract_message("compressed_output.bmp", compressed_bits_count)
-print(f"Extracted message after compression: {extracted_message_after_compression}")
+    psnr_value = calculate_psnr(input_image, stego_image_path)
+    print(f"PSNR value: {psnr_value} dB")
 
-visualization_path = "changes_visualization.png"
-visualize_changes("clown.bmp", stego_image_path, visualization_path)
+    # JPEG-сжатие и извлечение после него выполняются в памяти
+    original = images.load(input_image, 'RGB')
+    compressed = images.jpeg_roundtrip(stego_image_path, quality=50)
 
-original_img = np.array(Image.open("clown.bmp").convert('YCbCr'), dtype=np.float64)
-compressed_img = np.array(Image.open(compressed_path).convert('YCbCr'), dtype=np.float64)
+    try:
+        extracted_message_after_compression = extract_image(compressed)
+        print(f"Extracted message after compression: {extracted_message_after_compression}")
+    except ValueError as e:
+        print(f"Extraction after compression failed: {e}")
 
-psnr_channels = []
-for channel in range(3):  # Y, Cb, Cr
-    mse_channel = np.mean((original_img[..., channel] - compressed_img[..., channel]) ** 2)
-    psnr = 20 * math.log10(255.0 / math.sqrt(mse_channel)) if mse_channel != 0 else float('inf')
-    psnr_channels.append(psnr)
+    visualization_path = "changes_visualization.png"
+    visualize_changes(original, stego_image_path, visualization_path)
 
+    # Y, Cb, Cr
+    psnr_channels = metrics.compare_arrays(images.to_array(original, 'YCbCr'),
+                                           images.to_array(compressed, 'YCbCr')).channel_psnr()
 
-print(f"PSNR after compression for each channel: Y: {psnr_channels[0]:.2f} dB, Cb: {psnr_channels[1]:.2f} dB, Cr: {psnr_channels[2]:.2f} dB")
+    print(f"PSNR after compression for each channel: Y: {psnr_channels[0]:.2f} dB, Cb: {psnr_channels[1]:.2f} dB, Cr: {psnr_channels[2]:.2f} dB")
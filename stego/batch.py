@@ -0,0 +1,107 @@
+import csv
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from lab01 import lab01, lab012
+from lab011 import lab01 as lab011
+from lab02 import lab02
+from lab03.lab03final import KochSteganography
+from lab03 import lab03secret
+
+IMAGE_METHODS = ('lsb', 'koch', 'dct', 'jpeg')
+TEXT_METHODS = ('line_endings', 'spaces', 'invisible')
+METHODS = IMAGE_METHODS + TEXT_METHODS
+
+def read_manifest(manifest_path):
+    # Каждая строка манифеста: контейнер, файл с сообщением, выходной файл
+    jobs = []
+    with open(manifest_path, newline='', encoding='utf-8') as file:
+        for row in csv.reader(file):
+            if not row or row[0].startswith('#'):
+                continue
+            if len(row) != 3:
+                raise ValueError(f"Ожидалось 3 поля в строке манифеста: {row}")
+            jobs.append(tuple(field.strip() for field in row))
+    return jobs
+
+def embed_message(method, cover_path, message, output_path, options):
+    if method == 'lsb':
+        lab02.embed_text_lsb(cover_path, message, output_path, tile_budget=options.get('tile_budget'),
+                             depth=options.get('depth', 1), channels=options.get('channels'), fec=options.get('fec'))
+    elif method == 'koch':
+        KochSteganography(threshold=options.get('threshold', 50), pairs=options.get('pairs', 1),
+                          adaptive=options.get('adaptive', False), workers=options.get('threads', 1),
+                          fec=options.get('fec')).embed_message(cover_path, message, output_path,
+                                                                tile_budget=options.get('tile_budget'))
+    elif method == 'dct':
+        lab03secret.embed_message(cover_path, message, seed_key=options.get('seed_key', 42),
+                                  output_path=output_path, tile_budget=options.get('tile_budget'),
+                                  workers=options.get('threads', 1), fec=options.get('fec'))
+    elif method == 'jpeg':
+        lab03secret.embed_message_jpeg(cover_path, message, seed_key=options.get('seed_key', 42),
+                                       output_path=output_path, fec=options.get('fec'))
+    elif method == 'line_endings':
+        lab01.embed_message_in_container(cover_path, message, output_path, fec=options.get('fec'))
+    elif method == 'spaces':
+        lab012.embed_message_in_spaces(cover_path, message, output_path,
+                                       bits_per_line=options.get('bits_per_line', 1), fec=options.get('fec'))
+    elif method == 'invisible':
+        lab011.embed_message_in_invisible_chars(cover_path, message, output_path,
+                                                bits_per_line=options.get('bits_per_line', 1),
+                                                fec=options.get('fec'))
+    else:
+        raise ValueError(f"Неизвестный метод: {method}")
+    return output_path
+
+def extract_message(method, stego_path, options):
+    if method == 'lsb':
+        return lab02.extract_text_lsb(stego_path)
+    if method == 'koch':
+        return KochSteganography(threshold=options.get('threshold', 50),
+                                 workers=options.get('threads', 1)).extract_message(
+            stego_path, soft=options.get('soft', False))
+    if method == 'dct':
+        return lab03secret.extract_message(stego_path, seed_key=options.get('seed_key', 42),
+                                           workers=options.get('threads', 1), soft=options.get('soft', False))
+    if method == 'jpeg':
+        return lab03secret.extract_message_jpeg(stego_path, seed_key=options.get('seed_key', 42),
+                                                soft=options.get('soft', False))
+    if method == 'line_endings':
+        return lab01.extract_message_from_container(stego_path)
+    if method == 'spaces':
+        return lab012.extract_message_from_spaces(stego_path)
+    if method == 'invisible':
+        return lab011.extract_message_from_invisible_chars(stego_path)
+    raise ValueError(f"Неизвестный метод: {method}")
+
+def embed_one(method, cover_path, payload_path, output_path, options):
+    with open(payload_path, 'r', encoding='utf-8') as file:
+        message = file.read()
+    return embed_message(method, cover_path, message, output_path, options)
+
+def run_batch(jobs, method, workers=None, options=None, report=print):
+    options = options or {}
+    succeeded = 0
+    failed = 0
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(embed_one, method, cover, payload, output, options): (cover, output)
+            for cover, payload, output in jobs
+        }
+        for future in as_completed(futures):
+            cover, output = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                report(f"FAIL {cover}: {type(e).__name__}: {e}")
+            else:
+                succeeded += 1
+                report(f"OK   {cover} -> {output}")
+
+    elapsed = time.perf_counter() - started
+    rate = succeeded / elapsed if elapsed > 0 else 0.0
+    report(f"{succeeded} succeeded, {failed} failed in {elapsed:.2f} s ({rate:.1f} images/s)")
+    return succeeded, failed
@@ -0,0 +1,153 @@
+import csv
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+from lab02 import lab02
+from lab03 import lab03
+from lab03 import lab03secret
+from lab03.lab03final import KochSteganography
+from stego import fec, images, metrics
+from stego.codec import bits_to_bytes, bytes_to_bits
+
+RANDOM_PIXEL_KEY = 12345
+DCT_SEED_KEY = 42
+
+FIELDS = ['method', 'fec', 'payload_bytes', 'jpeg_quality', 'resize', 'bits', 'bit_errors', 'ber',
+          'payload_bit_errors', 'psnr', 'embed_mb_s', 'extract_mb_s', 'decode_mb_s', 'error']
+
+def _embed_lsb(image, bits):
+    stego = image.copy()
+    lab02.embed_bits(stego, bits)
+    return stego
+
+def _extract_lsb(image, count):
+    return lab02.extract_bits(image, count)
+
+def _embed_koch(image, bits):
+    stego = image.astype(float)
+    KochSteganography().embed_bits(stego, bits)
+    return np.uint8(np.clip(stego, 0, 255))
+
+def _extract_koch(image, count):
+    return KochSteganography().extract_bits(image.astype(float), count)
+
+def _embed_dct(image, bits):
+    ycbcr = np.array(Image.fromarray(image).convert('YCbCr'))
+    lab03secret.embed_bits(ycbcr, bits, DCT_SEED_KEY)
+    return np.array(Image.fromarray(ycbcr, mode='YCbCr').convert('RGB'))
+
+def _extract_dct(image, count):
+    ycbcr = np.array(Image.fromarray(image).convert('YCbCr'))
+    return lab03secret.extract_bits(ycbcr, count, DCT_SEED_KEY)
+
+def _embed_random_pixel(image, bits):
+    stego = image.copy()
+    lab03.embed_bits(stego, bits, RANDOM_PIXEL_KEY)
+    return stego
+
+def _extract_random_pixel(image, count):
+    return lab03.extract_bits(image, count, RANDOM_PIXEL_KEY)
+
+METHODS = {
+    'lsb': (_embed_lsb, _extract_lsb),
+    'koch': (_embed_koch, _extract_koch),
+    'dct': (_embed_dct, _extract_dct),
+    'random': (_embed_random_pixel, _extract_random_pixel),
+}
+
+def attack(image, jpeg_quality=None, resize=1.0):
+    # Сжатие и масштабирование выполняются в памяти, без временных файлов
+    img = Image.fromarray(image)
+    if resize != 1.0:
+        size = (max(1, round(img.width * resize)), max(1, round(img.height * resize)))
+        img = img.resize(size)
+    if jpeg_quality is not None:
+        img = images.jpeg_roundtrip(img, jpeg_quality)
+    if img.size != (image.shape[1], image.shape[0]):
+        img = img.resize((image.shape[1], image.shape[0]))
+    return np.array(img.convert('RGB'))
+
+def _mb_per_second(image, seconds):
+    return image.nbytes / 1e6 / seconds if seconds > 0 else float('inf')
+
+def _decode(code, extracted, payload_bits):
+    # Ошибки сообщения после исправления кодом, скорость декодирования (МБ/с кодированных данных)
+    # и текст ошибки; если код не справился, ошибки не считаются
+    if code is None:
+        return int(np.count_nonzero(extracted != payload_bits)), None, None
+    data = bits_to_bytes(extracted)
+    started = time.perf_counter()
+    try:
+        decoded = code.decode(data, payload_bits.size // 8)
+    except ValueError as e:
+        return None, None, str(e)
+    seconds = time.perf_counter() - started
+    speed = len(data) / 1e6 / seconds if seconds > 0 else float('inf')
+    return int(np.count_nonzero(bytes_to_bits(decoded) != payload_bits)), speed, None
+
+def run(image, methods, payload_sizes, jpeg_qualities, resizes, seed=0, codes=(None,)):
+    # codes - коды, исправляющие ошибки (None или 'none' - без кода); встраиваются кодированные биты.
+    # Если сообщение не встроилось или код не справился, строка остается в отчете с текстом ошибки в error
+    rng = np.random.default_rng(seed)
+    rows = []
+    for payload_bytes in payload_sizes:
+        payload_bits = rng.integers(0, 2, size=payload_bytes * 8, dtype=np.uint8)
+        for spec in codes:
+            code = fec.get_code(spec)
+            bits = payload_bits if code is None else bytes_to_bits(code.encode(bits_to_bytes(payload_bits)))
+            for name in methods:
+                embed, extract = METHODS[name]
+                started = time.perf_counter()
+                try:
+                    stego = embed(image, bits)
+                except ValueError as e:
+                    stego, embed_error = None, str(e)
+                else:
+                    embed_error = None
+                    embed_seconds = time.perf_counter() - started
+                    stego_psnr = metrics.psnr(image, stego)
+
+                for jpeg_quality in jpeg_qualities:
+                    for resize in resizes:
+                        row = dict.fromkeys(FIELDS)
+                        row.update({
+                            'method': name,
+                            'fec': 'none' if code is None else code.name,
+                            'payload_bytes': payload_bytes,
+                            'jpeg_quality': jpeg_quality,
+                            'resize': resize,
+                            'bits': int(bits.size),
+                            'error': embed_error,
+                        })
+                        rows.append(row)
+                        if stego is None:
+                            continue
+                        attacked = attack(stego, jpeg_quality, resize)
+                        started = time.perf_counter()
+                        extracted = extract(attacked, bits.size)
+                        extract_seconds = time.perf_counter() - started
+                        errors = int(np.count_nonzero(extracted != bits))
+                        payload_errors, decode_speed, decode_error = _decode(code, extracted, payload_bits)
+                        row.update({
+                            'bit_errors': errors,
+                            'ber': errors / bits.size,
+                            'payload_bit_errors': payload_errors,
+                            'psnr': stego_psnr,
+                            'embed_mb_s': _mb_per_second(image, embed_seconds),
+                            'extract_mb_s': _mb_per_second(image, extract_seconds),
+                            'decode_mb_s': decode_speed,
+                            'error': decode_error,
+                        })
+    return rows
+
+def write_report(rows, file, output_format='csv'):
+    if output_format == 'json':
+        json.dump(rows, file, indent=2)
+        file.write('\n')
+    else:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,66 @@
+import contextlib
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+FILE_HEADER_FORMAT = '<2sIHHI'
+FILE_HEADER_SIZE = struct.calcsize(FILE_HEADER_FORMAT)
+INFO_HEADER_FORMAT = '<IiiHHI'
+INFO_HEADER_SIZE = struct.calcsize(INFO_HEADER_FORMAT)
+BI_RGB = 0
+
+BmpInfo = namedtuple('BmpInfo', ['width', 'height', 'channels', 'offset', 'row_stride', 'top_down'])
+
+def read_bmp_info(path):
+    # Разбор заголовков несжатого 24/32-битного BMP; пиксели не читаются
+    with open(path, 'rb') as file:
+        data = file.read(FILE_HEADER_SIZE + INFO_HEADER_SIZE)
+    if len(data) < FILE_HEADER_SIZE + INFO_HEADER_SIZE:
+        raise ValueError(f"{path}: не BMP-файл")
+    signature, _, _, _, offset = struct.unpack_from(FILE_HEADER_FORMAT, data)
+    header_size, width, height, _, bits_per_pixel, compression = \
+        struct.unpack_from(INFO_HEADER_FORMAT, data, FILE_HEADER_SIZE)
+    if signature != b'BM' or header_size < 40:
+        raise ValueError(f"{path}: не BMP-файл")
+    if compression != BI_RGB or bits_per_pixel not in (24, 32):
+        raise ValueError(f"{path}: поддерживаются только несжатые 24/32-битные BMP")
+    channels = bits_per_pixel // 8
+    row_stride = (width * channels + 3) & ~3
+    return BmpInfo(width, abs(height), channels, offset, row_stride, height < 0)
+
+def is_supported(path):
+    try:
+        read_bmp_info(path)
+    except (OSError, ValueError):
+        return False
+    return True
+
+@contextlib.contextmanager
+def mapped_pixels(path, mode='r'):
+    # Массив (H, W, 3) в порядке RGB сверху вниз поверх отображенного в память файла.
+    # Выравнивание строк, порядок строк снизу вверх и BGR учитываются видами без копирования
+    info = read_bmp_info(path)
+    memmap = np.memmap(path, dtype=np.uint8, mode=mode, offset=info.offset,
+                       shape=(info.height, info.row_stride))
+    rows = memmap[:, :info.width * info.channels].reshape(info.height, info.width, info.channels)
+    if not info.top_down:
+        rows = rows[::-1]
+    try:
+        yield rows[:, :, 2::-1]
+        if mode != 'r':
+            memmap.flush()
+    finally:
+        del rows
+        del memmap
+
+def create_bmp(path, width, height):
+    # Пустой 24-битный BMP нужного размера: строки затем записываются через mapped_pixels
+    row_stride = (width * 3 + 3) & ~3
+    offset = FILE_HEADER_SIZE + 40
+    file_size = offset + row_stride * height
+    with open(path, 'wb') as file:
+        file.write(struct.pack(FILE_HEADER_FORMAT, b'BM', file_size, 0, 0, offset))
+        file.write(struct.pack(INFO_HEADER_FORMAT, 40, width, height, 1, 24, BI_RGB))
+        file.write(struct.pack('<IiiII', row_stride * height, 2835, 2835, 0, 0))
+        file.truncate(file_size)
@@ -0,0 +1,94 @@
+import json
+import os
+
+from PIL import Image, UnidentifiedImageError
+
+from lab01 import lab012
+from lab011 import lab01 as lab011
+from lab02 import lab02
+from lab03 import lab03
+from lab03 import lab03secret
+from lab03.lab03final import MAX_PAIRS, KochSteganography
+from stego.header import HEADER_BITS, HEADER_SIZE
+from stego.lines import MAX_BITS_PER_LINE, READ_CHUNK_SIZE, count_lines
+
+IMAGE_METHODS = {
+    'lsb': lab02.calculate_capacity,
+    'koch': lambda width, height: KochSteganography().capacity(width, height),
+    'koch_dense': lambda width, height: KochSteganography(pairs=MAX_PAIRS).capacity(width, height),
+    'dct': lab03secret.calculate_capacity,
+    'random': lab03.calculate_capacity,
+}
+# Метод jpeg работает только с baseline JPEG: его емкость указывается лишь для файлов JPEG
+JPEG_METHODS = {
+    'jpeg': lab03secret.calculate_capacity,
+}
+# Текстовые методы: бит на строку. Плотные режимы (spaces_dense, invisible_dense)
+# считаются при наибольшем допустимом числе бит на строку
+TEXT_METHODS = ('line_endings', 'spaces', 'invisible')
+
+def _method_capacity(bits):
+    return {'bits': bits, 'payload_bytes': max(0, bits // 8 - HEADER_SIZE)}
+
+def scan_file(file_path):
+    # Файл открывается один раз: сначала пробуем прочитать заголовок изображения,
+    # иначе считаем строки текста тем же дескриптором
+    with open(file_path, 'rb') as file:
+        try:
+            with Image.open(file) as img:
+                width, height = img.size
+                methods = dict(IMAGE_METHODS)
+                if img.format == 'JPEG':
+                    methods.update(JPEG_METHODS)
+        except UnidentifiedImageError:
+            pass
+        else:
+            return {
+                'path': file_path,
+                'kind': 'image',
+                'width': width,
+                'height': height,
+                'capacity': {name: _method_capacity(capacity(width, height))
+                             for name, capacity in methods.items()},
+            }
+
+        file.seek(0)
+        if b'\0' in file.read(READ_CHUNK_SIZE):
+            return None
+        file.seek(0)
+        lines = count_lines(file)
+        file.seek(0)
+        gap_bits = lab012.count_gap_bits(file, MAX_BITS_PER_LINE)
+
+    capacity = {name: _method_capacity(lines) for name in TEXT_METHODS}
+    capacity['spaces_dense'] = _method_capacity(min(lines, HEADER_BITS) + gap_bits)
+    capacity['invisible_dense'] = _method_capacity(
+        lab011.calculate_capacity(lines, MAX_BITS_PER_LINE))
+    return {
+        'path': file_path,
+        'kind': 'text',
+        'lines': lines,
+        'capacity': capacity,
+    }
+
+def scan_tree(root):
+    for directory, directory_names, file_names in os.walk(root):
+        # Служебные каталоги (.git и т.п.) не просматриваем
+        directory_names[:] = sorted(name for name in directory_names if not name.startswith('.'))
+        for file_name in sorted(file_names):
+            entry = scan_file(os.path.join(directory, file_name))
+            if entry is not None:
+                yield entry
+
+def write_index(entries, file):
+    for entry in entries:
+        file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+def load_index(file):
+    return [json.loads(line) for line in file if line.strip()]
+
+def covers_for(index, method, payload_bytes):
+    # Контейнеры, в которые метод способен внедрить payload_bytes байт, от меньшего к большему
+    fitting = [entry for entry in index
+               if entry['capacity'].get(method, {}).get('payload_bytes', 0) >= payload_bytes]
+    return sorted(fitting, key=lambda entry: entry['capacity'][method]['payload_bytes'])
@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from stego import batch, bench, capacity, profiling, service, session
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+def _float_list(value):
+    return [float(item) for item in value.split(',') if item]
+
+def _quality_list(value):
+    # "none" означает проверку без JPEG-сжатия
+    return [None if item == 'none' else int(item) for item in value.split(',') if item]
+
+def _batch_command(args):
+    jobs = batch.read_manifest(args.manifest)
+    options = {'threshold': args.threshold, 'pairs': args.pairs, 'adaptive': args.adaptive,
+               'seed_key': args.seed_key, 'tile_budget': args.tile_budget, 'threads': args.threads,
+               'fec': args.fec}
+    _, failed = batch.run_batch(jobs, args.method, workers=args.workers, options=options)
+    return 1 if failed else 0
+
+def _bench_command(args):
+    image = np.array(Image.open(args.cover).convert('RGB'))
+    rows = bench.run(image, args.methods, args.payload_sizes, args.qualities, args.resize, seed=args.seed,
+                     codes=args.fec)
+    if args.output:
+        with open(args.output, 'w', newline='', encoding='utf-8') as file:
+            bench.write_report(rows, file, args.format)
+    else:
+        bench.write_report(rows, sys.stdout, args.format)
+    return 0
+
+def _capacity_command(args):
+    entries = capacity.scan_tree(args.root)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            capacity.write_index(entries, file)
+    else:
+        capacity.write_index(entries, sys.stdout)
+    return 0
+
+def _audit_command(args):
+    # Все методы и ключи проверяются по одному декодированию изображения
+    requests = []
+    for method in args.methods:
+        if method in ('dct', 'random'):
+            requests.extend((method, {'seed_key': key, 'soft': args.soft}) for key in args.seed_keys)
+        else:
+            requests.append((method, {'soft': args.soft}))
+    with session.AnalysisSession(args.cover, workers=args.threads) as analysis:
+        entries = analysis.extract_many(requests, args.workers)
+    for entry in entries:
+        print(json.dumps(entry, ensure_ascii=False))
+    return 0
+
+def _profile_command(args):
+    options = {'threshold': args.threshold, 'pairs': args.pairs, 'adaptive': args.adaptive,
+               'seed_key': args.seed_key, 'tile_budget': args.tile_budget, 'threads': args.threads,
+               'fec': args.fec}
+    if args.method in batch.TEXT_METHODS:
+        suffix = '.txt'
+    else:
+        suffix = '.jpg' if args.method == 'jpeg' else '.bmp'
+    with tempfile.TemporaryDirectory() as directory, profiling.Profiler(trace_memory=not args.no_memory) as profiler:
+        output_path = os.path.join(directory, 'output' + suffix)
+        for _ in range(args.repeat):
+            batch.embed_message(args.method, args.cover, args.message, output_path, options)
+            batch.extract_message(args.method, output_path, options)
+
+    if args.events:
+        with open(args.events, 'w', encoding='utf-8') as file:
+            profiler.write_events(file)
+    print(profiler.format_report())
+    return 0
+
+def _serve_command(args):
+    service.run(args.host, args.port, workers=args.workers, queue_size=args.queue_size)
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='stego')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    batch_parser = commands.add_parser('batch', help='embed payloads into many covers in parallel')
+    batch_parser.add_argument('manifest', help='CSV file with cover,payload,output rows')
+    batch_parser.add_argument('--method', choices=batch.METHODS, default='lsb')
+    batch_parser.add_argument('-j', '--workers', type=int, default=None,
+                              help='number of worker processes (default: CPU count)')
+    batch_parser.add_argument('--threshold', type=float, default=50, help='Koch threshold')
+    batch_parser.add_argument('--pairs', type=_int_list, default=[1],
+                              help='Koch coefficient pairs per block: one count or R,G,B counts (1-4)')
+    batch_parser.add_argument('--adaptive', action='store_true',
+                              help='Koch: use the most textured blocks with per-block thresholds')
+    batch_parser.add_argument('--seed-key', type=int, default=42, help='DCT block order key')
+    batch_parser.add_argument('--threads', type=int, default=1,
+                              help='threads per image for the Koch and DCT block transforms')
+    batch_parser.add_argument('--tile-budget', type=int, default=None,
+                              help='process covers in horizontal strips using about this many bytes')
+    batch_parser.add_argument('--fec', default=None, help='error correcting code: rep3, hamming, rs32, ...')
+    batch_parser.set_defaults(handler=_batch_command)
+
+    bench_parser = commands.add_parser('bench', help='measure robustness and throughput of the methods')
+    bench_parser.add_argument('cover', help='cover image')
+    bench_parser.add_argument('--methods', type=lambda value: value.split(','),
+                              default=['lsb', 'koch', 'dct', 'random'])
+    bench_parser.add_argument('--qualities', type=_quality_list, default=[None, 95, 75, 50],
+                              help='comma-separated JPEG qualities, "none" for no compression')
+    bench_parser.add_argument('--resize', type=_float_list, default=[1.0, 0.5])
+    bench_parser.add_argument('--payload-sizes', type=_int_list, default=[16, 128])
+    bench_parser.add_argument('--seed', type=int, default=0)
+    bench_parser.add_argument('--fec', type=lambda value: value.split(','), default=['none'],
+                              help='comma-separated error correcting codes, e.g. none,rep3,hamming,rs32')
+    bench_parser.add_argument('--format', choices=('csv', 'json'), default='csv')
+    bench_parser.add_argument('-o', '--output', help='write the report here instead of stdout')
+    bench_parser.set_defaults(handler=_bench_command)
+
+    capacity_parser = commands.add_parser('capacity', help='index the capacity of every cover under a directory')
+    capacity_parser.add_argument('root', help='directory with cover images and texts')
+    capacity_parser.add_argument('-o', '--output', help='write the JSON-lines index here instead of stdout')
+    capacity_parser.set_defaults(handler=_capacity_command)
+
+    audit_parser = commands.add_parser('audit', help='try several methods and keys on one decoded image')
+    audit_parser.add_argument('cover', help='image to examine')
+    audit_parser.add_argument('--methods', type=lambda value: value.split(','),
+                              default=list(session.METHOD_ARRAYS))
+    audit_parser.add_argument('--seed-keys', type=_int_list, default=[42], help='keys for the dct and random methods')
+    audit_parser.add_argument('--soft', action='store_true', help='soft-decision decoding for koch and dct')
+    audit_parser.add_argument('-j', '--workers', type=int, default=1,
+                              help='worker processes sharing the decoded image through shared memory')
+    audit_parser.add_argument('--threads', type=int, default=1, help='threads for the block transforms')
+    audit_parser.set_defaults(handler=_audit_command)
+
+    profile_parser = commands.add_parser('profile', help='time the stages of one method on a cover')
+    profile_parser.add_argument('cover', help='cover image or text')
+    profile_parser.add_argument('--method', choices=batch.METHODS, default='lsb')
+    profile_parser.add_argument('--message', default='Hello world!')
+    profile_parser.add_argument('--repeat', type=int, default=1)
+    profile_parser.add_argument('--threshold', type=float, default=50, help='Koch threshold')
+    profile_parser.add_argument('--pairs', type=_int_list, default=[1],
+                                help='Koch coefficient pairs per block: one count or R,G,B counts (1-4)')
+    profile_parser.add_argument('--adaptive', action='store_true',
+                                help='Koch: use the most textured blocks with per-block thresholds')
+    profile_parser.add_argument('--seed-key', type=int, default=42, help='DCT block order key')
+    profile_parser.add_argument('--threads', type=int, default=1,
+                                help='threads per image for the Koch and DCT block transforms')
+    profile_parser.add_argument('--tile-budget', type=int, default=None)
+    profile_parser.add_argument('--fec', default=None, help='error correcting code: rep3, hamming, rs32, ...')
+    profile_parser.add_argument('--no-memory', action='store_true', help='do not trace peak allocations')
+    profile_parser.add_argument('--events', help='write every stage as a JSON line to this file')
+    profile_parser.set_defaults(handler=_profile_command)
+
+    serve_parser = commands.add_parser('serve', help='run the local HTTP embedding service')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('-j', '--workers', type=int, default=None,
+                              help='number of worker processes (default: CPU count)')
+    serve_parser.add_argument('--queue-size', type=int, default=service.DEFAULT_QUEUE_SIZE,
+                              help='pending jobs accepted before answering 503')
+    serve_parser.set_defaults(handler=_serve_command)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sys.exit(args.handler(args))
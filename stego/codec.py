@@ -0,0 +1,26 @@
+import numpy as np
+
+# Полезная нагрузка - байты (UTF-8 для текста), биты - массивы uint8 из нулей и единиц.
+# Мягкие решения - запасы бит (float): знак задает бит (больше нуля - 1), модуль - уверенность,
+# нулевой запас не несет информации
+
+def encode_text(text):
+    return text.encode('utf-8')
+
+def decode_text(data, errors='strict'):
+    return bytes(data).decode('utf-8', errors)
+
+def bytes_to_bits(data):
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+def bits_to_bytes(bits):
+    return np.packbits(np.asarray(bits, dtype=np.uint8)).tobytes()
+
+def margins_to_bits(margins):
+    return (np.asarray(margins) > 0).astype(np.uint8)
+
+def text_to_bits(text):
+    return bytes_to_bits(encode_text(text))
+
+def bits_to_text(bits, errors='strict'):
+    return decode_text(bits_to_bytes(bits), errors)
@@ -0,0 +1,319 @@
+import functools
+import re
+
+import numpy as np
+
+from stego.codec import bits_to_bytes, bytes_to_bits, margins_to_bits
+
+# Коды, исправляющие ошибки, между кодеком сообщения и методами встраивания: кодируются байты
+# полезной нагрузки, схема кода и ее параметр записываются в заголовок версии 2.
+# Код задается строкой: 'rep3' - повторение (нечетная кратность), 'hamming' - Хэмминг (7,4),
+# 'rs32' - Рид-Соломон над GF(256) с указанным числом проверочных байт на блок. Параметр fec
+# методов встраивания - такая строка, готовый код или None (см. get_code).
+# decode_soft принимает запасы бит (см. stego.codec) вместо байт
+
+SCHEME_REPETITION = 1
+SCHEME_HAMMING = 2
+SCHEME_REED_SOLOMON = 3
+
+DEFAULT_REPETITION = 3
+DEFAULT_PARITY = 32
+# Наибольшее число байт блока, обрабатываемых за один шаг деления на порождающий многочлен
+RS_SLICE = 32
+
+# Поле GF(256) с порождающим многочленом x^8 + x^4 + x^3 + x^2 + 1, примитивный элемент 2.
+# EXP продлена до 510 элементов, чтобы произведение бралось без взятия остатка
+GF_POLYNOMIAL = 0x11D
+RS_BLOCK = 255
+
+def _gf_tables():
+    exp = np.zeros(2 * RS_BLOCK, dtype=np.int64)
+    log = np.zeros(RS_BLOCK + 1, dtype=np.int64)
+    value = 1
+    for power in range(RS_BLOCK):
+        exp[power] = value
+        log[value] = power
+        value <<= 1
+        if value & 0x100:
+            value ^= GF_POLYNOMIAL
+    exp[RS_BLOCK:] = exp[:RS_BLOCK]
+    return exp, log
+
+GF_EXP, GF_LOG = _gf_tables()
+_EXP = GF_EXP.tolist()
+_LOG = GF_LOG.tolist()
+
+def _gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+def _gf_mul_table():
+    # Таблица умножения 256x256 для векторных операций
+    logs = GF_LOG[1:]
+    table = np.zeros((256, 256), dtype=np.uint8)
+    table[1:, 1:] = GF_EXP[logs[:, np.newaxis] + logs]
+    return table
+
+GF_MUL = _gf_mul_table()
+
+# Логарифм нуля указывает на нулевой хвост таблицы степеней: произведения с нулем дают ноль
+# той же выборкой GF_EXP_ZERO[log a + log b], без отдельной проверки
+ZERO_LOG = 2 * RS_BLOCK
+GF_EXP_ZERO = np.concatenate([GF_EXP, np.zeros(2 * RS_BLOCK + 1, dtype=np.int64)]).astype(np.uint8)
+GF_LOG_ZERO = GF_LOG.astype(np.uint16)
+GF_LOG_ZERO[0] = ZERO_LOG
+
+class Repetition:
+    # Сообщение повторяется factor раз подряд, так что копии одного бита разнесены по контейнеру;
+    # бит восстанавливается голосованием большинства
+    scheme = SCHEME_REPETITION
+
+    def __init__(self, factor=DEFAULT_REPETITION):
+        if not 3 <= factor <= 255 or factor % 2 == 0:
+            raise ValueError("Кратность повторения должна быть нечетной, от 3 до 255")
+        self.factor = factor
+        self.parameter = factor
+        self.name = f'rep{factor}'
+
+    def encoded_size(self, size):
+        return size * self.factor
+
+    def encode(self, data):
+        return bytes(data) * self.factor
+
+    def decode(self, data, size):
+        copies = bytes_to_bits(data[:size * self.factor]).reshape(self.factor, size * 8)
+        return bits_to_bytes(copies.sum(axis=0, dtype=np.int32) > self.factor // 2)
+
+    def decode_soft(self, margins, size):
+        # Голосование с весами: складываются запасы копий, уверенная копия перевешивает сомнительные
+        copies = np.asarray(margins, dtype=float)[:size * 8 * self.factor].reshape(self.factor, size * 8)
+        return bits_to_bytes(margins_to_bits(copies.sum(axis=0)))
+
+def _hamming_tables():
+    # Кодовые слова [p1 p2 d1 p3 d2 d3 d4] для каждой тетрады и декодирование всех 128 слов
+    # в ближайшую тетраду: код совершенный, одна ошибка в слове всегда исправляется
+    data = (np.arange(16)[:, np.newaxis] >> np.arange(3, -1, -1)) & 1
+    d1, d2, d3, d4 = data.T
+    codewords = np.stack([d1 ^ d2 ^ d4, d1 ^ d3 ^ d4, d1, d2 ^ d3 ^ d4, d2, d3, d4], axis=1)
+    received = (np.arange(128)[:, np.newaxis] >> np.arange(6, -1, -1)) & 1
+    distances = (received[:, np.newaxis, :] != codewords[np.newaxis]).sum(axis=-1)
+    return codewords.astype(np.uint8), distances.argmin(axis=1).astype(np.uint8)
+
+HAMMING_CODEWORDS, HAMMING_DECODE = _hamming_tables()
+HAMMING_WEIGHTS = 1 << np.arange(6, -1, -1)
+# Знаки бит кодовых слов (+1 для единицы) для декодирования по корреляции с запасами
+HAMMING_SIGNS = 2.0 * HAMMING_CODEWORDS - 1
+
+class Hamming:
+    # Каждая тетрада - слово из 7 бит. Слова перемежаются: сначала первые биты всех слов, затем вторые
+    # и т.д., чтобы пачка соседних ошибок пришлась на разные слова
+    scheme = SCHEME_HAMMING
+    parameter = 0
+    name = 'hamming'
+
+    def encoded_size(self, size):
+        return -(-size * 14 // 8)
+
+    def encode(self, data):
+        data = np.frombuffer(bytes(data), dtype=np.uint8)
+        nibbles = np.stack([data >> 4, data & 15], axis=1).reshape(-1)
+        return bits_to_bytes(HAMMING_CODEWORDS[nibbles].T.reshape(-1))
+
+    def decode(self, data, size):
+        words = bytes_to_bits(data)[:size * 14].reshape(7, size * 2).T
+        nibbles = HAMMING_DECODE[words @ HAMMING_WEIGHTS].reshape(size, 2)
+        return (nibbles[:, 0] << 4 | nibbles[:, 1]).astype(np.uint8).tobytes()
+
+    def decode_soft(self, margins, size):
+        # Кодовое слово с наибольшей корреляцией с запасами - решение по максимуму правдоподобия
+        words = np.asarray(margins, dtype=float)[:size * 14].reshape(7, size * 2).T
+        nibbles = (words @ HAMMING_SIGNS.T).argmax(axis=1).reshape(size, 2)
+        return (nibbles[:, 0] << 4 | nibbles[:, 1]).astype(np.uint8).tobytes()
+
+class ReedSolomon:
+    # Сообщение делится на блоки одинаковой длины k <= 255 - parity (последний дополняется нулями),
+    # к каждому добавляется parity проверочных байт; блок исправляет до parity/2 ошибочных байт.
+    # Байты блоков перемежаются, как слова кода Хэмминга
+    scheme = SCHEME_REED_SOLOMON
+
+    def __init__(self, parity=DEFAULT_PARITY):
+        if not 1 <= parity < RS_BLOCK:
+            raise ValueError(f"Число проверочных байт должно быть от 1 до {RS_BLOCK - 1}")
+        self.parity = parity
+        self.parameter = parity
+        self.name = f'rs{parity}'
+        self._slices = _slice_tables(parity)
+
+    def _shape(self, size):
+        blocks = max(1, -(-size // (RS_BLOCK - self.parity)))
+        return blocks, -(-size // blocks)
+
+    def encoded_size(self, size):
+        blocks, length = self._shape(size)
+        return blocks * (length + self.parity)
+
+    def _remainders(self, columns):
+        # Остатки от деления всех блоков на порождающий многочлен; columns - (длина, число блоков),
+        # байты блоков по позициям, как при перемежении. За шаг обрабатывается группа байт:
+        # остаток после группы - сумма табличных вкладов ее байт и сдвинутого прежнего остатка
+        length, blocks = columns.shape
+        size = self._slices.shape[0]
+        remainders = np.zeros((blocks, self._slices.shape[2] * 8), dtype=np.uint8)
+        # Первая неполная группа считается последними позициями таблиц, как если бы ей предшествовали нули
+        start = 0
+        count = length % size or size
+        while start < length:
+            values = columns[start:start + count] ^ remainders[:, :count].T
+            tables = self._slices[size - count:]
+            result = tables[0][values[0]]
+            for position in range(1, count):
+                result ^= tables[position][values[position]]
+            result = result.view(np.uint8)
+            result[:, :self.parity - count] ^= remainders[:, count:self.parity]
+            remainders = result
+            start += count
+            count = size
+        return remainders[:, :self.parity]
+
+    def encode(self, data):
+        blocks, length = self._shape(len(data))
+        messages = np.zeros(blocks * length, dtype=np.uint8)
+        messages[:len(data)] = np.frombuffer(bytes(data), dtype=np.uint8)
+        columns = messages.reshape(blocks, length).T
+        return np.vstack([columns, self._remainders(columns).T]).tobytes()
+
+    def decode(self, data, size):
+        blocks, length = self._shape(size)
+        columns = np.frombuffer(data, dtype=np.uint8, count=self.encoded_size(size))
+        columns = columns.reshape(length + self.parity, blocks)
+        # Ненулевой остаток принятого блока означает ошибки; исправляются только такие блоки
+        remainders = self._remainders(columns[:length]) ^ columns[length:].T
+        damaged = np.nonzero(remainders.any(axis=1))[0]
+        messages = columns[:length].T.copy()
+        if damaged.size:
+            messages[damaged] = self._correct(columns[:, damaged].T.copy(), remainders[damaged])[:, :length]
+        return messages.tobytes()[:size]
+
+    def decode_soft(self, margins, size):
+        # Код исправляет байты, поэтому запасы сводятся к жестким решениям
+        return self.decode(bits_to_bytes(margins_to_bits(margins)), size)
+
+    def _correct(self, codewords, remainders):
+        # Исправление сразу всех поврежденных блоков (строки codewords) векторными операциями.
+        # Синдромы S_j = r(2^j) равны значениям остатка; локатор ошибок - алгоритм Берлекэмпа-Мэсси,
+        # позиции - перебор Ченя, значения - формула Форни
+        parity = self.parity
+        count, size = codewords.shape
+        syndromes = np.zeros((count, parity), dtype=np.uint8)
+        for index in range(parity):
+            syndromes = GF_MUL[syndromes, GF_EXP[:parity]] ^ remainders[:, index:index + 1]
+
+        # Шаг алгоритма одинаков для всех блоков: при нулевой невязке множитель нулевой,
+        # и локатор не меняется. shifted - прежний локатор, уже умноженный на x^shift
+        locator = np.zeros((count, parity + 1), dtype=np.uint8)
+        locator[:, 0] = 1
+        shifted = np.zeros_like(locator)
+        shifted[:, 1] = 1
+        errors = np.zeros(count, dtype=np.int64)
+        scale = np.ones(count, dtype=np.uint8)
+        for step in range(parity):
+            delta = syndromes[:, step] ^ np.bitwise_xor.reduce(
+                GF_MUL[locator[:, 1:step + 1], syndromes[:, :step][:, ::-1]], axis=1)
+            factor = GF_EXP_ZERO[GF_LOG_ZERO[delta] + RS_BLOCK - GF_LOG[scale]]
+            grow = (delta != 0) & (2 * errors <= step)
+            updated = locator ^ GF_MUL[factor[:, np.newaxis], shifted]
+            shifted = np.where(grow[:, np.newaxis], locator, shifted)
+            shifted[:, 1:] = shifted[:, :-1].copy()
+            shifted[:, 0] = 0
+            locator = updated
+            errors = np.where(grow, step + 1 - errors, errors)
+            scale = np.where(grow, delta, scale)
+        if (2 * errors > parity).any():
+            raise ValueError("Слишком много ошибок для кода Рида-Соломона")
+        degree = int(errors.max())
+
+        # Корни локатора 2^(-e): e - степень позиции, считая от последнего байта блока
+        powers = np.arange(size)
+        values = np.zeros((count, size), dtype=np.uint8)
+        for index in range(degree + 1):
+            exponents = ((-index * powers) % RS_BLOCK).astype(np.uint16)
+            values ^= GF_EXP_ZERO[GF_LOG_ZERO[locator[:, index:index + 1]] + exponents]
+        roots = values == 0
+        if (roots.sum(axis=1) != errors).any():
+            raise ValueError("Слишком много ошибок для кода Рида-Соломона")
+
+        evaluator = np.zeros((count, parity), dtype=np.uint8)
+        for step in range(degree + 1):
+            evaluator[:, step:] ^= GF_MUL[syndromes[:, :parity - step], locator[:, step:step + 1]]
+        # Значения многочленов в 2^(-e) по схеме Горнера; умножение на степень двойки - сложение логарифмов
+        blocks, powers = np.nonzero(roots)
+        inverse = (RS_BLOCK - powers) % RS_BLOCK
+        evaluator = evaluator[blocks]
+        numerator = np.zeros(blocks.size, dtype=np.uint8)
+        for index in range(parity - 1, -1, -1):
+            numerator = GF_EXP_ZERO[GF_LOG_ZERO[numerator] + inverse] ^ evaluator[:, index]
+        # Формальная производная локатора: остаются нечетные степени, многочлен от 2^(-2e)
+        inverse = 2 * inverse % RS_BLOCK
+        locator = locator[blocks]
+        denominator = np.zeros(blocks.size, dtype=np.uint8)
+        for index in range(degree - 1 + degree % 2, 0, -2):
+            denominator = GF_EXP_ZERO[GF_LOG_ZERO[denominator] + inverse] ^ locator[:, index]
+        if (denominator == 0).any():
+            raise ValueError("Слишком много ошибок для кода Рида-Соломона")
+        magnitudes = GF_EXP_ZERO[GF_LOG_ZERO[numerator] + (powers + RS_BLOCK - GF_LOG[denominator]) % RS_BLOCK]
+        codewords[blocks, size - 1 - powers] ^= magnitudes
+        return codewords
+
+@functools.lru_cache(maxsize=None)
+def _slice_tables(parity):
+    # Порождающий многочлен (x - 1)(x - 2)...(x - 2^(parity-1)) от старшей степени
+    generator = [1]
+    for power in range(parity):
+        root = _EXP[power]
+        generator = [a ^ _gf_mul(b, root) for a, b in zip(generator + [0], [0] + generator)]
+    feedback = GF_MUL[:, generator[1:]]
+
+    # Вклад байта x на позиции j группы из size байт в остаток после всей группы - остаток
+    # последовательности с x на месте j, посчитанный регистром сдвига по байту за шаг.
+    # Строки дополнены до целого числа слов uint64, чтобы вклады складывались словами
+    size = min(parity, RS_SLICE)
+    messages = np.zeros((size, 256, size), dtype=np.uint8)
+    messages[np.arange(size), :, np.arange(size)] = np.arange(256, dtype=np.uint8)
+    messages = messages.reshape(size * 256, size)
+    remainders = np.zeros((messages.shape[0], parity), dtype=np.uint8)
+    for column in range(size):
+        values = messages[:, column] ^ remainders[:, 0]
+        remainders[:, :-1] = remainders[:, 1:]
+        remainders[:, -1] = 0
+        remainders ^= feedback[values]
+    tables = np.zeros((size, 256, -(-parity // 8) * 8), dtype=np.uint8)
+    tables[..., :parity] = remainders.reshape(size, 256, parity)
+    tables.flags.writeable = False
+    return tables.view(np.uint64)
+
+def get_code(spec):
+    # spec - None, 'none', строка вида 'rep3', 'hamming', 'rs32' или готовый код
+    if spec is None or spec == 'none':
+        return None
+    if not isinstance(spec, str):
+        return spec
+    match = re.fullmatch(r'(rep|hamming|rs)(\d*)', spec)
+    if match is None or (match.group(1) == 'hamming' and match.group(2)):
+        raise ValueError(f"Неизвестный код: {spec}")
+    name, parameter = match.group(1), match.group(2)
+    if name == 'rep':
+        return Repetition(int(parameter) if parameter else DEFAULT_REPETITION)
+    if name == 'rs':
+        return ReedSolomon(int(parameter) if parameter else DEFAULT_PARITY)
+    return Hamming()
+
+def from_header(scheme, parameter):
+    if scheme == SCHEME_REPETITION:
+        return Repetition(parameter)
+    if scheme == SCHEME_HAMMING:
+        return Hamming()
+    if scheme == SCHEME_REED_SOLOMON:
+        return ReedSolomon(parameter)
+    raise ValueError(f"Неизвестная схема кода в заголовке: {scheme}")
@@ -0,0 +1,148 @@
+import itertools
+import struct
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+from stego.codec import bits_to_bytes, margins_to_bits
+from stego.fec import from_header, get_code
+
+MAGIC = b'SG'
+VERSION = 1
+
+METHOD_LSB = 1
+METHOD_KOCH = 2
+METHOD_DCT_SWAP = 3
+METHOD_RANDOM_PIXEL = 4
+METHOD_TEXT_LINE_ENDINGS = 5
+METHOD_TEXT_SPACES = 6
+METHOD_TEXT_INVISIBLE = 7
+METHOD_JPEG_SWAP = 8
+
+# Сигнатура, версия, метод, параметры метода, длина полезной нагрузки, CRC32
+HEADER_FORMAT = '>2sBBBII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+HEADER_BITS = HEADER_SIZE * 8
+
+# Версия 2 - сообщение защищено кодом, исправляющим ошибки (stego.fec): после параметров метода
+# идут схема кода и ее параметр. Заголовок записывается FEC_HEADER_COPIES раз подряд
+# и восстанавливается побитовым голосованием большинства; length и CRC32 относятся к исходному сообщению
+FEC_VERSION = 2
+FEC_HEADER_FORMAT = '>2sBBBBBII'
+FEC_HEADER_COPIES = 3
+FEC_HEADER_SIZE = struct.calcsize(FEC_HEADER_FORMAT) * FEC_HEADER_COPIES
+
+class Header(namedtuple('Header', ['method', 'options', 'length', 'crc', 'fec'], defaults=(None,))):
+    __slots__ = ()
+
+    @property
+    def size(self):
+        # Байт заголовка в контейнере
+        return header_size(self.fec)
+
+    @property
+    def body_size(self):
+        # Байт сообщения в контейнере после заголовка (с проверочными данными кода)
+        return body_size(self.length, self.fec)
+
+def header_size(fec=None):
+    return HEADER_SIZE if get_code(fec) is None else FEC_HEADER_SIZE
+
+def body_size(length, fec=None):
+    code = get_code(fec)
+    return length if code is None else code.encoded_size(length)
+
+def build_frame(method, payload, options=0, fec=None):
+    # fec - код (см. stego.fec.get_code); без него кадр записывается в формате версии 1
+    code = get_code(fec)
+    if code is None:
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, method, options,
+                             len(payload), zlib.crc32(payload))
+        return header + payload
+    header = struct.pack(FEC_HEADER_FORMAT, MAGIC, FEC_VERSION, method, options, code.scheme, code.parameter,
+                         len(payload), zlib.crc32(payload))
+    return header * FEC_HEADER_COPIES + code.encode(payload)
+
+def _vote_header(data):
+    copies = np.frombuffer(data[:FEC_HEADER_SIZE], dtype=np.uint8).reshape(FEC_HEADER_COPIES, -1)
+    votes = np.unpackbits(copies, axis=1).sum(axis=0)
+    return np.packbits(votes > FEC_HEADER_COPIES // 2).tobytes()
+
+def _is_plain_header(data):
+    return data[:len(MAGIC)] == MAGIC and data[len(MAGIC)] == VERSION
+
+def parse_header(data, method=None):
+    # data - HEADER_SIZE байт заголовка версии 1 или FEC_HEADER_SIZE байт заголовка версии 2
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Недостаточно данных для заголовка")
+    fec = None
+    if len(data) >= FEC_HEADER_SIZE and not _is_plain_header(data):
+        magic, version, found_method, options, scheme, parameter, length, crc = \
+            struct.unpack(FEC_HEADER_FORMAT, _vote_header(data))
+        if magic == MAGIC and version == FEC_VERSION:
+            fec = from_header(scheme, parameter)
+    else:
+        magic, version, found_method, options, length, crc = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
+    if magic != MAGIC:
+        raise ValueError("Заголовок не найден: контейнер не содержит сообщения")
+    if version != VERSION and fec is None:
+        raise ValueError(f"Неподдерживаемая версия заголовка: {version}")
+    if method is not None and found_method != method:
+        raise ValueError(f"Сообщение внедрено другим методом: {found_method}")
+    return Header(found_method, options, length, crc, fec)
+
+def read_header(read_bytes, method=None):
+    # read_bytes(n) возвращает следующие n байт области заголовка. Заголовок версии 2 дочитывается,
+    # если первые HEADER_SIZE байт не являются заголовком версии 1
+    data = read_bytes(HEADER_SIZE)
+    if _is_plain_header(data):
+        return parse_header(data, method)
+    try:
+        data += read_bytes(FEC_HEADER_SIZE - HEADER_SIZE)
+    except ValueError:
+        raise ValueError("Заголовок не найден: контейнер не содержит сообщения")
+    return parse_header(data, method)
+
+def decode_body(header, body, soft=False):
+    # Исправление ошибок кодом из заголовка; для версии 1 сообщение возвращается как есть.
+    # При soft=True body - запасы бит сообщения (см. stego.codec), код декодирует их мягкими решениями
+    if soft:
+        if header.fec is None:
+            return bits_to_bytes(margins_to_bits(body))
+        return header.fec.decode_soft(body, header.length)
+    return body if header.fec is None else header.fec.decode(body, header.length)
+
+def verify_payload(header, payload):
+    if len(payload) != header.length or zlib.crc32(payload) != header.crc:
+        raise ValueError("Контрольная сумма сообщения не совпадает")
+
+def margin_reader(read_margins):
+    # Читатель байт поверх читателя запасов: read_margins(n) возвращает запасы следующих 8n бит
+    def read_bytes(count):
+        return bits_to_bytes(margins_to_bits(read_margins(count)))
+
+    return read_bytes
+
+def read_frame(read_bytes, method=None, soft=False):
+    # read_bytes(n) возвращает следующие n байт из контейнера, при soft=True - запасы следующих 8n бит.
+    # Заголовок всегда читается жесткими решениями
+    if soft:
+        header = read_header(margin_reader(read_bytes), method)
+    else:
+        header = read_header(read_bytes, method)
+    payload = decode_body(header, read_bytes(header.body_size), soft)
+    verify_payload(header, payload)
+    return header, payload
+
+def bit_stream_reader(bits):
+    # Читатель для read_frame поверх итератора битов 0/1 (например, по строкам файла)
+    bits = iter(bits)
+
+    def read_bytes(count):
+        chunk = np.fromiter(itertools.islice(bits, count * 8), dtype=np.uint8)
+        if chunk.size < count * 8:
+            raise ValueError("Контейнер не содержит сообщения заявленной длины")
+        return bits_to_bytes(chunk)
+
+    return read_bytes
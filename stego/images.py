@@ -0,0 +1,57 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+from stego import profiling
+
+# Методы принимают путь, изображение PIL или массив NumPy; преобразования выполняются в памяти.
+# Функции методов с суффиксом _image встраивают и извлекают без файлов и возвращают изображение PIL
+
+def load(image, mode=None):
+    # Путь открывается с диска, изображение PIL и массив используются как есть
+    if isinstance(image, (str, os.PathLike)):
+        with profiling.stage('decode', bytes_read=os.path.getsize(image)):
+            img = Image.open(image)
+            img.load()
+    elif isinstance(image, np.ndarray):
+        img = Image.fromarray(np.asarray(image, dtype=np.uint8))
+    else:
+        img = image
+    if mode is not None and img.mode != mode:
+        img = img.convert(mode)
+    return img
+
+def as_channels(pixels):
+    # Полутоновое изображение (H, W) рассматривается как (H, W, 1); запись идет в исходный массив
+    return pixels[:, :, np.newaxis] if pixels.ndim == 2 else pixels
+
+def block_view(channel):
+    # Представление канала в виде (H/8, W/8, 8, 8) без копирования данных
+    rows, cols = channel.shape[0] // 8, channel.shape[1] // 8
+    return channel[:rows * 8, :cols * 8].reshape(rows, 8, cols, 8).swapaxes(1, 2)
+
+def to_array(image, mode='RGB', dtype=None):
+    # Всегда возвращает новый массив, который можно менять на месте
+    return np.array(load(image, mode), dtype=dtype)
+
+def save(image, output_path, format=None):
+    with profiling.stage('encode') as encode_stage:
+        image.save(output_path, format)
+        encode_stage.add_bytes(written=os.path.getsize(output_path))
+
+def jpeg_roundtrip(image, quality=75):
+    # JPEG-сжатие и декодирование через буфер в памяти, без временных файлов
+    buffer = io.BytesIO()
+    load(image, 'RGB').save(buffer, format='JPEG', quality=quality)
+    buffer.seek(0)
+    img = Image.open(buffer)
+    img.load()
+    return img
+
+def resize_roundtrip(image, scale):
+    # Уменьшение (или увеличение) и возврат к исходному размеру
+    img = load(image)
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size).resize(img.size)
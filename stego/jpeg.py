@@ -0,0 +1,571 @@
+import os
+import struct
+
+import numpy as np
+
+from stego import profiling
+
+# Baseline JPEG (SOF0/SOF1, коды Хаффмана, 8 бит на отсчет): квантованные коэффициенты DCT
+# читаются и записываются обратно без перехода к пикселям, поэтому не меняются при пересохранении
+
+SOI = 0xD8
+EOI = 0xD9
+SOS = 0xDA
+DHT = 0xC4
+DQT = 0xDB
+DRI = 0xDD
+BASELINE_FRAMES = (0xC0, 0xC1)
+RST_FIRST, RST_LAST = 0xD0, 0xD7
+
+# ZIGZAG[k] - индекс k-го по зигзагу коэффициента в блоке 8x8, записанном построчно
+ZIGZAG = np.array([
+    0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+])
+UNZIGZAG = np.argsort(ZIGZAG)
+
+# Наибольшие категории (число дополнительных бит) разности DC и коэффициента AC при 8 битах на отсчет
+MAX_DC_SIZE = 11
+MAX_AC_SIZE = 10
+ZRL = 0xF0
+EOB = 0x00
+# Ключ сортировки событий блока: позиция коэффициента (0..64) и номер события перед ним (0..16)
+EVENT_SLOTS = 17
+BLOCK_KEYS = 65 * EVENT_SLOTS
+PACK_CHUNK = 1 << 18
+# Запас нулевых байт после данных интервала: больше, чем может занять один блок
+# (код DC и 63 кода AC не длиннее 16 бит плюс дополнительные биты)
+BLOCK_PADDING = 256
+
+class Component:
+    # coefficients - массив (строки блоков, столбцы блоков, 8, 8) int32 в построчном порядке,
+    # включая блоки дополнения до целого числа MCU
+    def __init__(self, component_id, h, v, quant_id, coefficients):
+        self.id = component_id
+        self.h = h
+        self.v = v
+        self.quant_id = quant_id
+        self.coefficients = coefficients
+
+class JpegImage:
+    def __init__(self, width, height, components, quant_tables, scans, segments):
+        self.width = width
+        self.height = height
+        self.components = components
+        # Таблицы квантования (8, 8) по номеру; scans - номера компонентов в каждом скане;
+        # segments - маркеры APPn, COM, DQT и SOF, которые переносятся в файл без изменений
+        self.quant_tables = quant_tables
+        self.scans = scans
+        self.segments = segments
+
+    def component_size(self, index):
+        # Размер компонента в пикселях с учетом прореживания
+        component = self.components[index]
+        h_max = max(c.h for c in self.components)
+        v_max = max(c.v for c in self.components)
+        return -(-self.width * component.h // h_max), -(-self.height * component.v // v_max)
+
+def _next_marker(data, pos):
+    if pos >= len(data) or data[pos] != 0xFF:
+        raise ValueError("Поврежденный JPEG: ожидался маркер")
+    while pos < len(data) and data[pos] == 0xFF:
+        pos += 1
+    if pos >= len(data):
+        raise ValueError("Поврежденный JPEG: файл обрывается")
+    return data[pos], pos + 1
+
+def _parse_quant_tables(payload, quant_tables):
+    pos = 0
+    while pos < len(payload):
+        precision, table_id = payload[pos] >> 4, payload[pos] & 15
+        pos += 1
+        if pos + (128 if precision else 64) > len(payload):
+            raise ValueError("Поврежденный JPEG: таблица квантования обрывается")
+        if precision:
+            values = np.frombuffer(payload, dtype='>u2', count=64, offset=pos)
+            pos += 128
+        else:
+            values = np.frombuffer(payload, dtype=np.uint8, count=64, offset=pos)
+            pos += 64
+        quant_tables[table_id] = values[UNZIGZAG].astype(np.int32).reshape(8, 8)
+
+def _parse_huffman_tables(payload, huffman_tables):
+    pos = 0
+    while pos < len(payload):
+        table_class, table_id = payload[pos] >> 4, payload[pos] & 15
+        if table_class > 1:
+            raise ValueError("Поврежденный JPEG: неизвестный класс таблицы Хаффмана")
+        counts = list(payload[pos + 1:pos + 17])
+        if len(counts) < 16 or pos + 17 + sum(counts) > len(payload):
+            raise ValueError("Поврежденный JPEG: таблица Хаффмана обрывается")
+        symbols = list(payload[pos + 17:pos + 17 + sum(counts)])
+        # Категория DC больше 15 не помещается в окно чтения дополнительных бит; проверяется здесь,
+        # а не при декодировании каждого блока (категории AC ограничены 4 битами символа)
+        if table_class == 0 and any(symbol > 15 for symbol in symbols):
+            raise ValueError("Поврежденный JPEG: недопустимая категория DC в таблице Хаффмана")
+        huffman_tables[table_class, table_id] = _huffman_lookup(counts, symbols)
+        pos += 17 + sum(counts)
+
+def _parse_frame(payload):
+    if len(payload) < 6 or len(payload) < 6 + payload[5] * 3:
+        raise ValueError("Поврежденный JPEG: заголовок кадра обрывается")
+    precision, height, width, count = struct.unpack_from('>BHHB', payload)
+    if precision != 8:
+        raise ValueError(f"Поддерживается только 8 бит на отсчет, в файле {precision}")
+    if height == 0:
+        raise ValueError("Высота, заданная маркером DNL, не поддерживается")
+    if width == 0 or count == 0:
+        raise ValueError("Поврежденный JPEG: пустой кадр")
+    components = []
+    for index in range(count):
+        component_id, sampling, quant_id = payload[6 + index * 3:9 + index * 3]
+        if not (1 <= sampling >> 4 <= 4 and 1 <= sampling & 15 <= 4):
+            raise ValueError("Поврежденный JPEG: недопустимое прореживание компонента")
+        components.append(Component(component_id, sampling >> 4, sampling & 15, quant_id, None))
+    h_max = max(c.h for c in components)
+    v_max = max(c.v for c in components)
+    mcus_x = -(-width // (8 * h_max))
+    mcus_y = -(-height // (8 * v_max))
+    for component in components:
+        component.coefficients = np.zeros((mcus_y * component.v, mcus_x * component.h, 64), np.int32)
+    return width, height, components
+
+def _huffman_lookup(counts, symbols):
+    # Таблица по 16 следующим битам потока: символ и длина его кода (0 - недопустимый код)
+    lookup_symbols = np.zeros(1 << 16, np.int32)
+    lookup_lengths = np.zeros(1 << 16, np.int32)
+    code = 0
+    index = 0
+    for length in range(1, 17):
+        # Коды длины length должны помещаться в length бит
+        if code + counts[length - 1] > 1 << length:
+            raise ValueError("Поврежденный JPEG: число кодов Хаффмана превышает пространство кодов")
+        for _ in range(counts[length - 1]):
+            shift = 16 - length
+            lookup_symbols[code << shift:(code + 1) << shift] = symbols[index]
+            lookup_lengths[code << shift:(code + 1) << shift] = length
+            code += 1
+            index += 1
+        code <<= 1
+    return lookup_symbols.tolist(), lookup_lengths.tolist()
+
+def _scan_blocks(width, height, components, scan):
+    # Номер компонента, строка и столбец блока в том порядке, в котором блоки идут в скане,
+    # и число блоков в одном MCU
+    h_max = max(c.h for c in components)
+    v_max = max(c.v for c in components)
+    if len(scan) == 1:
+        component = components[scan[0]]
+        cols = -(-(-(-width * component.h // h_max)) // 8)
+        rows = -(-(-(-height * component.v // v_max)) // 8)
+        block_rows, block_cols = np.divmod(np.arange(rows * cols), cols)
+        return np.full(rows * cols, scan[0]), block_rows, block_cols, 1
+
+    mcus_x = -(-width // (8 * h_max))
+    mcus_y = -(-height // (8 * v_max))
+    layout = [(index, dv, dh) for index in scan
+              for dv in range(components[index].v) for dh in range(components[index].h)]
+    indexes, dv, dh = (np.array(values) for values in zip(*layout))
+    v = np.array([components[index].v for index in indexes])
+    h = np.array([components[index].h for index in indexes])
+    mcu_rows, mcu_cols = np.divmod(np.arange(mcus_y * mcus_x), mcus_x)
+    block_rows = mcu_rows[:, None] * v + dv
+    block_cols = mcu_cols[:, None] * h + dh
+    return np.tile(indexes, mcus_y * mcus_x), block_rows.ravel(), block_cols.ravel(), len(layout)
+
+def _entropy_intervals(data, pos):
+    # Энтропийно-кодированные данные скана до следующего маркера, разделенные маркерами RSTn,
+    # с удаленными нулями после 0xFF
+    intervals = []
+    start = pos
+    while True:
+        pos = data.find(b'\xff', pos)
+        if pos < 0 or pos + 1 >= len(data):
+            raise ValueError("Поврежденный JPEG: данные скана обрываются")
+        following = data[pos + 1]
+        if following == 0x00 or following == 0xFF:
+            pos += 1 if following == 0xFF else 2
+            continue
+        intervals.append(data[start:pos].replace(b'\xff\x00', b'\xff'))
+        if RST_FIRST <= following <= RST_LAST:
+            pos += 2
+            start = pos
+            continue
+        return intervals, pos
+
+def _decode_scan(intervals, block_components, dc_tables, ac_tables, interval_blocks):
+    # Декодирование кодов Хаффмана; возвращает массив (число блоков, 64) в зигзаг-порядке
+    count = len(block_components)
+    block_components = block_components.tolist()
+    indexes = []
+    values = []
+    position = 0
+    for data in intervals:
+        if position >= count:
+            break
+        stop = min(count, position + interval_blocks)
+        available = len(data) * 8
+        data += bytes(BLOCK_PADDING)
+        predictors = {}
+        bit = 0
+        while position < stop:
+            component = block_components[position]
+            dc_symbols, dc_lengths = dc_tables[component]
+            ac_symbols, ac_lengths = ac_tables[component]
+            base = position * 64
+
+            i = bit >> 3
+            window = ((data[i] << 16 | data[i + 1] << 8 | data[i + 2]) >> (8 - (bit & 7))) & 0xFFFF
+            if not dc_lengths[window]:
+                raise ValueError("Поврежденный JPEG: недопустимый код Хаффмана")
+            size = dc_symbols[window]
+            bit += dc_lengths[window]
+            difference = 0
+            if size:
+                i = bit >> 3
+                value = ((data[i] << 24 | data[i + 1] << 16 | data[i + 2] << 8 | data[i + 3])
+                         >> (32 - (bit & 7) - size)) & ((1 << size) - 1)
+                bit += size
+                difference = value if value >> (size - 1) else value - (1 << size) + 1
+            predictor = predictors.get(component, 0) + difference
+            predictors[component] = predictor
+            if predictor:
+                indexes.append(base)
+                values.append(predictor)
+
+            k = 1
+            while k < 64:
+                i = bit >> 3
+                window = ((data[i] << 16 | data[i + 1] << 8 | data[i + 2]) >> (8 - (bit & 7))) & 0xFFFF
+                if not ac_lengths[window]:
+                    raise ValueError("Поврежденный JPEG: недопустимый код Хаффмана")
+                symbol = ac_symbols[window]
+                bit += ac_lengths[window]
+                size = symbol & 15
+                if not size:
+                    if symbol != ZRL:
+                        break
+                    k += 16
+                    continue
+                k += symbol >> 4
+                if k > 63:
+                    raise ValueError("Поврежденный JPEG: выход за пределы блока")
+                i = bit >> 3
+                value = ((data[i] << 24 | data[i + 1] << 16 | data[i + 2] << 8 | data[i + 3])
+                         >> (32 - (bit & 7) - size)) & ((1 << size) - 1)
+                bit += size
+                indexes.append(base + k)
+                values.append(value if value >> (size - 1) else value - (1 << size) + 1)
+                k += 1
+            position += 1
+            if bit > available:
+                raise ValueError("Поврежденный JPEG: данные скана обрываются")
+    if position < count:
+        raise ValueError("Поврежденный JPEG: в скане не хватает блоков")
+
+    coefficients = np.zeros(count * 64, np.int32)
+    coefficients[np.array(indexes, dtype=np.int64)] = values
+    return coefficients.reshape(count, 64)
+
+def decode(data):
+    # Разбор файла JPEG из байтов в JpegImage
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("Не JPEG-файл")
+    pos = 2
+    segments = []
+    quant_tables = {}
+    huffman_tables = {}
+    restart_interval = 0
+    frame = None
+    scans = []
+    while True:
+        marker, pos = _next_marker(data, pos)
+        if marker == EOI:
+            break
+        if RST_FIRST <= marker <= RST_LAST or marker == 0x01:
+            continue
+        if pos + 2 > len(data):
+            raise ValueError("Поврежденный JPEG: файл обрывается")
+        length, = struct.unpack_from('>H', data, pos)
+        if length < 2 or pos + length > len(data):
+            raise ValueError("Поврежденный JPEG: сегмент обрывается")
+        payload = data[pos + 2:pos + length]
+        pos += length
+        if marker == DQT:
+            _parse_quant_tables(payload, quant_tables)
+            segments.append((marker, payload))
+        elif marker == DHT:
+            _parse_huffman_tables(payload, huffman_tables)
+        elif marker == DRI:
+            if len(payload) < 2:
+                raise ValueError("Поврежденный JPEG: сегмент DRI обрывается")
+            restart_interval, = struct.unpack('>H', payload[:2])
+        elif marker in BASELINE_FRAMES:
+            frame = _parse_frame(payload)
+            segments.append((marker, payload))
+        elif 0xC0 <= marker <= 0xCF:
+            raise ValueError("Поддерживается только baseline JPEG с кодами Хаффмана")
+        elif marker == SOS:
+            if frame is None:
+                raise ValueError("Поврежденный JPEG: скан до заголовка кадра")
+            width, height, components = frame
+            if not payload or len(payload) < 4 + payload[0] * 2:
+                raise ValueError("Поврежденный JPEG: заголовок скана обрывается")
+            ids = [component.id for component in components]
+            selectors = [payload[1 + index * 2] for index in range(payload[0])]
+            if not selectors or any(selector not in ids for selector in selectors):
+                raise ValueError("Поврежденный JPEG: скан ссылается на отсутствующий компонент")
+            scan = [ids.index(selector) for selector in selectors]
+            tables = [payload[2 + index * 2] for index in range(payload[0])]
+            start, end, approximation = payload[1 + payload[0] * 2:4 + payload[0] * 2]
+            if (start, end, approximation) != (0, 63, 0):
+                raise ValueError("Поддерживается только последовательный JPEG")
+            if any((0, table >> 4) not in huffman_tables or (1, table & 15) not in huffman_tables
+                   for table in tables):
+                raise ValueError("Поврежденный JPEG: скан ссылается на неопределенную таблицу Хаффмана")
+            dc_tables = {index: huffman_tables[0, table >> 4] for index, table in zip(scan, tables)}
+            ac_tables = {index: huffman_tables[1, table & 15] for index, table in zip(scan, tables)}
+
+            block_components, block_rows, block_cols, mcu_blocks = _scan_blocks(width, height, components, scan)
+            intervals, pos = _entropy_intervals(data, pos)
+            interval_blocks = restart_interval * mcu_blocks if restart_interval else len(block_components)
+            coefficients = _decode_scan(intervals, block_components, dc_tables, ac_tables, interval_blocks)
+            for index in scan:
+                selected = block_components == index
+                components[index].coefficients[block_rows[selected], block_cols[selected]] = coefficients[selected]
+            scans.append(scan)
+        else:
+            segments.append((marker, payload))
+
+    if frame is None or not scans:
+        raise ValueError("Поврежденный JPEG: нет данных изображения")
+    width, height, components = frame
+    for component in components:
+        zigzag = component.coefficients
+        component.coefficients = zigzag[..., UNZIGZAG].reshape(zigzag.shape[:2] + (8, 8))
+    return JpegImage(width, height, components, quant_tables, scans, segments)
+
+def read(source):
+    # source - путь, байты или открытый двоичный файл
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            data = file.read()
+    elif isinstance(source, (bytes, bytearray)):
+        data = bytes(source)
+    else:
+        data = source.read()
+    with profiling.stage('decode', bytes_read=len(data)):
+        return decode(data)
+
+def _category(values):
+    # Число дополнительных бит для значения: длина двоичной записи модуля
+    return np.frexp(np.abs(values))[1].astype(np.int64)
+
+def _magnitude_bits(values, sizes):
+    # Отрицательные значения записываются как value - 1 в дополнительном коде младшими size битами
+    return np.where(values < 0, values + (1 << sizes) - 1, values)
+
+def _scan_events(coefficients, block_components, dc_slots, ac_slots):
+    # Кодируемые события скана по порядку: номер таблицы, символ, дополнительные биты и их число.
+    # coefficients - массив (число блоков, 64) в зигзаг-порядке
+    count = coefficients.shape[0]
+    block_keys = np.arange(count, dtype=np.int64) * BLOCK_KEYS
+
+    dc = coefficients[:, 0].astype(np.int64)
+    differences = np.empty_like(dc)
+    for component in np.unique(block_components):
+        selected = np.nonzero(block_components == component)[0]
+        differences[selected] = np.diff(dc[selected], prepend=0)
+    dc_sizes = _category(differences)
+    if dc_sizes.max(initial=0) > MAX_DC_SIZE:
+        raise ValueError("Разность коэффициентов DC вне диапазона baseline JPEG")
+
+    blocks, positions = np.nonzero(coefficients[:, 1:])
+    positions += 1
+    values = coefficients[blocks, positions].astype(np.int64)
+    ac_sizes = _category(values)
+    if ac_sizes.max(initial=0) > MAX_AC_SIZE:
+        raise ValueError("Коэффициент AC вне диапазона baseline JPEG")
+    first = np.ones(blocks.size, dtype=bool)
+    first[1:] = blocks[1:] != blocks[:-1]
+    previous = np.zeros_like(positions)
+    previous[1:] = positions[:-1]
+    previous[first] = 0
+    runs = positions - previous - 1
+    zero_runs = runs >> 4
+
+    # Серии из 16 нулей (ZRL) перед коэффициентом
+    zrl_owner = np.repeat(np.arange(blocks.size), zero_runs)
+    zrl_index = np.arange(zrl_owner.size) - np.repeat(np.cumsum(zero_runs) - zero_runs, zero_runs)
+    zrl_blocks = blocks[zrl_owner]
+
+    # Конец блока (EOB), если последний ненулевой коэффициент не 63-й
+    last = np.zeros(count, dtype=np.int64)
+    final = np.ones(blocks.size, dtype=bool)
+    final[:-1] = blocks[1:] != blocks[:-1]
+    last[blocks[final]] = positions[final]
+    eob_blocks = np.nonzero(last < 63)[0]
+
+    keys = np.concatenate([
+        block_keys,
+        block_keys[blocks] + positions * EVENT_SLOTS + EVENT_SLOTS - 1,
+        block_keys[zrl_blocks] + positions[zrl_owner] * EVENT_SLOTS + zrl_index,
+        block_keys[eob_blocks] + 64 * EVENT_SLOTS,
+    ])
+    tables = np.concatenate([
+        dc_slots[block_components],
+        ac_slots[block_components[blocks]],
+        ac_slots[block_components[zrl_blocks]],
+        ac_slots[block_components[eob_blocks]],
+    ])
+    symbols = np.concatenate([
+        dc_sizes,
+        (runs & 15) << 4 | ac_sizes,
+        np.full(zrl_blocks.size, ZRL),
+        np.full(eob_blocks.size, EOB),
+    ])
+    extra_sizes = np.concatenate([dc_sizes, ac_sizes, np.zeros(zrl_blocks.size + eob_blocks.size, np.int64)])
+    extra_bits = np.concatenate([
+        _magnitude_bits(differences, dc_sizes),
+        _magnitude_bits(values, ac_sizes),
+        np.zeros(zrl_blocks.size + eob_blocks.size, np.int64),
+    ])
+    order = np.argsort(keys, kind='stable')
+    return tables[order], symbols[order], extra_bits[order], extra_sizes[order]
+
+def _huffman_table(frequencies):
+    # Оптимальные длины кодов не длиннее 16 бит (ITU T.81, приложение K.2);
+    # возвращает число кодов каждой длины и символы в порядке возрастания длины кода
+    frequencies = [int(value) for value in frequencies] + [1]
+    code_sizes = [0] * 257
+    others = [-1] * 257
+    while True:
+        candidates = sorted((value, -symbol) for symbol, value in enumerate(frequencies) if value > 0)
+        if len(candidates) < 2:
+            break
+        first, second = -candidates[0][1], -candidates[1][1]
+        frequencies[first] += frequencies[second]
+        frequencies[second] = 0
+        code_sizes[first] += 1
+        while others[first] != -1:
+            first = others[first]
+            code_sizes[first] += 1
+        others[first] = second
+        code_sizes[second] += 1
+        while others[second] != -1:
+            second = others[second]
+            code_sizes[second] += 1
+
+    counts = [0] * 33
+    for size in code_sizes:
+        if size:
+            counts[size] += 1
+    for size in range(32, 16, -1):
+        while counts[size] > 0:
+            shorter = size - 2
+            while counts[shorter] == 0:
+                shorter -= 1
+            counts[size] -= 2
+            counts[size - 1] += 1
+            counts[shorter + 1] += 2
+            counts[shorter] -= 1
+    # Убираем зарезервированный символ 256, чтобы ни один код не состоял из одних единиц
+    size = 16
+    while counts[size] == 0:
+        size -= 1
+    counts[size] -= 1
+
+    symbols = sorted(range(256), key=lambda symbol: code_sizes[symbol])
+    symbols = [symbol for symbol in symbols if code_sizes[symbol]]
+    return counts[1:17], symbols
+
+def _huffman_codes(counts, symbols):
+    codes = np.zeros(256, np.int64)
+    lengths = np.zeros(256, np.int64)
+    code = 0
+    index = 0
+    for length in range(1, 17):
+        for _ in range(counts[length - 1]):
+            codes[symbols[index]] = code
+            lengths[symbols[index]] = length
+            code += 1
+            index += 1
+        code <<= 1
+    return codes, lengths
+
+def _pack_bits(values, lengths):
+    # Коды переменной длины подряд старшими битами вперед; последний байт дополняется единицами,
+    # после каждого байта 0xFF вставляется 0x00
+    keep = lengths > 0
+    values, lengths = values[keep], lengths[keep]
+    total = int(lengths.sum())
+    bits = np.ones(-(-total // 8) * 8, np.uint8)
+    pos = 0
+    for start in range(0, values.size, PACK_CHUNK):
+        chunk_values = values[start:start + PACK_CHUNK]
+        chunk_lengths = lengths[start:start + PACK_CHUNK]
+        chunk_total = int(chunk_lengths.sum())
+        offsets = np.arange(chunk_total) - np.repeat(np.cumsum(chunk_lengths) - chunk_lengths, chunk_lengths)
+        shifts = np.repeat(chunk_lengths, chunk_lengths) - 1 - offsets
+        bits[pos:pos + chunk_total] = (np.repeat(chunk_values, chunk_lengths) >> shifts) & 1
+        pos += chunk_total
+    packed = np.packbits(bits)
+    return np.insert(packed, np.nonzero(packed == 0xFF)[0] + 1, 0).tobytes()
+
+def _segment(marker, payload):
+    return struct.pack('>BBH', 0xFF, marker, len(payload) + 2) + payload
+
+def encode(jpeg):
+    # Сборка файла из JpegImage: исходные маркеры и таблицы квантования сохраняются, коды Хаффмана
+    # строятся заново по статистике символов (яркость - таблицы 0, цветность - таблицы 1)
+    components = jpeg.components
+    slots = np.array([0 if index == 0 else 1 for index in range(len(components))])
+    dc_slots, ac_slots = slots, slots + 2
+
+    scan_events = []
+    for scan in jpeg.scans:
+        block_components, block_rows, block_cols, _ = _scan_blocks(jpeg.width, jpeg.height, components, scan)
+        coefficients = np.empty((block_components.size, 64), np.int32)
+        for index in scan:
+            selected = block_components == index
+            blocks = components[index].coefficients.reshape(components[index].coefficients.shape[:2] + (64,))
+            coefficients[selected] = blocks[block_rows[selected], block_cols[selected]][:, ZIGZAG]
+        scan_events.append(_scan_events(coefficients, block_components, dc_slots, ac_slots))
+
+    all_tables = np.concatenate([events[0] for events in scan_events])
+    all_symbols = np.concatenate([events[1] for events in scan_events])
+    huffman_payload = b''
+    codes = np.zeros((4, 256), np.int64)
+    code_lengths = np.zeros((4, 256), np.int64)
+    for slot in np.unique(all_tables):
+        frequencies = np.bincount(all_symbols[all_tables == slot], minlength=256)
+        counts, symbols = _huffman_table(frequencies)
+        codes[slot], code_lengths[slot] = _huffman_codes(counts, symbols)
+        huffman_payload += bytes([(slot >> 1) << 4 | (slot & 1)] + counts + symbols)
+
+    output = [b'\xff\xd8']
+    output += [_segment(marker, payload) for marker, payload in jpeg.segments]
+    output.append(_segment(DHT, huffman_payload))
+    for scan, (tables, symbols, extra_bits, extra_sizes) in zip(jpeg.scans, scan_events):
+        header = bytes([len(scan)])
+        for index in scan:
+            header += bytes([components[index].id, dc_slots[index] << 4 | (ac_slots[index] & 1)])
+        output.append(_segment(SOS, header + bytes([0, 63, 0])))
+        values = np.stack([codes[tables, symbols], extra_bits], axis=1).ravel()
+        lengths = np.stack([code_lengths[tables, symbols], extra_sizes], axis=1).ravel()
+        output.append(_pack_bits(values, lengths))
+    output.append(b'\xff\xd9')
+    return b''.join(output)
+
+def write(jpeg, output_path=None):
+    # Без output_path возвращает байты файла
+    with profiling.stage('encode') as encode_stage:
+        data = encode(jpeg)
+        encode_stage.add_bytes(written=len(data))
+    if output_path is None:
+        return data
+    with open(output_path, 'wb') as file:
+        file.write(data)
+    return output_path
@@ -0,0 +1,26 @@
+READ_CHUNK_SIZE = 1 << 20
+WRITE_BUFFER_SIZE = 1 << 20
+# Наибольшее число бит на строку у плотных текстовых методов (пробелы, невидимые символы)
+MAX_BITS_PER_LINE = 16
+
+def check_bits_per_line(bits_per_line):
+    if not 1 <= bits_per_line <= MAX_BITS_PER_LINE:
+        raise ValueError(f"Число бит на строку должно быть от 1 до {MAX_BITS_PER_LINE}")
+
+def count_lines(file):
+    # Строки считаются так же, как readlines(): последняя строка без перевода строки тоже учитывается
+    count = 0
+    last_byte = b''
+    while True:
+        chunk = file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        count += chunk.count(b'\n')
+        last_byte = chunk[-1:]
+    if last_byte and last_byte != b'\n':
+        count += 1
+    return count
+
+def count_file_lines(file_path):
+    with open(file_path, 'rb') as file:
+        return count_lines(file)
@@ -0,0 +1,144 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+from stego import images, tiles
+
+MAX_VALUE = 255
+# Окна SSIM - неперекрывающиеся блоки 8x8 (полосы при потоковой обработке кратны 8 строкам)
+SSIM_WINDOW = 8
+# Ограничение на временные массивы при сравнении изображений, уже находящихся в памяти
+STRIP_BUDGET = 16 << 20
+# Байт рабочей памяти на отсчет канала: разность int32 и суммы окон SSIM в int64
+BYTES_PER_SAMPLE = 24
+
+def psnr_from_mse(mse, max_value=MAX_VALUE):
+    if mse == 0:
+        return float('inf')
+    return 20 * math.log10(max_value / math.sqrt(mse))
+
+class QualityMeter:
+    # Накопитель метрик по полосам изображения. Суммы квадратов разностей и суммы внутри окон SSIM
+    # считаются в целых числах, поэтому MSE и PSNR не зависят от разбиения на полосы
+    def __init__(self, max_value=MAX_VALUE):
+        self.max_value = max_value
+        self.squared_errors = None
+        self.samples = 0
+        self.ssim_sum = None
+        self.windows = 0
+
+    def _init_channels(self, channels):
+        if self.squared_errors is None:
+            self.squared_errors = [0] * channels
+            self.ssim_sum = [0.0] * channels
+        elif len(self.squared_errors) != channels:
+            raise ValueError("Число каналов изображений не совпадает")
+
+    def update(self, original, modified):
+        # original, modified - полосы (H, W) или (H, W, C) с одинаковыми размерами
+        original = images.as_channels(np.asarray(original))
+        modified = images.as_channels(np.asarray(modified))
+        if original.shape != modified.shape:
+            raise ValueError("Размеры изображений не совпадают")
+        self._init_channels(original.shape[2])
+
+        diff = original.astype(np.int32) - modified.astype(np.int32)
+        errors = np.einsum('ijc,ijc->c', diff, diff, dtype=np.int64)
+        for channel, value in enumerate(errors.tolist()):
+            self.squared_errors[channel] += value
+        self.samples += original.shape[0] * original.shape[1]
+        self._update_ssim(original, modified)
+
+    def add_unchanged(self, rows, width, channels):
+        # Строки, которые встраивание не затронуло: ошибка 0, SSIM каждого окна равен 1
+        self._init_channels(channels)
+        self.samples += rows * width
+        windows = (rows // SSIM_WINDOW) * (width // SSIM_WINDOW)
+        for channel in range(channels):
+            self.ssim_sum[channel] += windows
+        self.windows += windows
+
+    def _update_ssim(self, original, modified):
+        rows = original.shape[0] // SSIM_WINDOW
+        cols = original.shape[1] // SSIM_WINDOW
+        if rows == 0 or cols == 0:
+            return
+
+        def windows(image):
+            image = image[:rows * SSIM_WINDOW, :cols * SSIM_WINDOW].astype(np.int64)
+            return image.reshape(rows, SSIM_WINDOW, cols, SSIM_WINDOW, -1)
+
+        x = windows(original)
+        y = windows(modified)
+        n = SSIM_WINDOW * SSIM_WINDOW
+        sum_x = x.sum(axis=(1, 3))
+        sum_y = y.sum(axis=(1, 3))
+        # Числители дисперсий и ковариации - точные целые: n*sum(xy) - sum(x)*sum(y)
+        var_x = n * (x * x).sum(axis=(1, 3)) - sum_x * sum_x
+        var_y = n * (y * y).sum(axis=(1, 3)) - sum_y * sum_y
+        cov = n * (x * y).sum(axis=(1, 3)) - sum_x * sum_y
+
+        # Формула SSIM, умноженная на n^2 в числителе и знаменателе (выборочные дисперсии)
+        c1 = (0.01 * self.max_value) ** 2 * n * n
+        c2 = (0.03 * self.max_value) ** 2 * n * (n - 1)
+        ssim = ((2 * sum_x * sum_y + c1) * (2 * cov + c2)
+                / ((sum_x * sum_x + sum_y * sum_y + c1) * (var_x + var_y + c2)))
+        for channel, value in enumerate(ssim.sum(axis=(0, 1)).tolist()):
+            self.ssim_sum[channel] += value
+        self.windows += rows * cols
+
+    def mse(self, channel=None):
+        if not self.samples:
+            raise ValueError("Нет данных для расчета метрик")
+        if channel is None:
+            return sum(self.squared_errors) / (self.samples * len(self.squared_errors))
+        return self.squared_errors[channel] / self.samples
+
+    def psnr(self, channel=None):
+        return psnr_from_mse(self.mse(channel), self.max_value)
+
+    def channel_psnr(self):
+        return [self.psnr(channel) for channel in range(len(self.squared_errors))]
+
+    def ssim(self, channel=None):
+        if not self.windows:
+            return float('nan')
+        if channel is None:
+            return sum(self.ssim_sum) / (self.windows * len(self.ssim_sum))
+        return self.ssim_sum[channel] / self.windows
+
+    def report(self):
+        return {
+            'mse': self.mse(),
+            'psnr': self.psnr(),
+            'channel_psnr': self.channel_psnr(),
+            'ssim': self.ssim(),
+        }
+
+def compare_arrays(original, modified, meter=None):
+    # Массивы в памяти сравниваются полосами, чтобы временные массивы оставались небольшими
+    original = images.as_channels(np.asarray(original))
+    modified = images.as_channels(np.asarray(modified))
+    meter = QualityMeter() if meter is None else meter
+    height, width, channels = original.shape
+    rows_per_strip = tiles.strip_height(width, STRIP_BUDGET, BYTES_PER_SAMPLE * channels)
+    for top in range(0, height, rows_per_strip):
+        meter.update(original[top:top + rows_per_strip], modified[top:top + rows_per_strip])
+    return meter
+
+def compare_files(original_path, modified_path, mode='RGB', tile_budget=tiles.DEFAULT_TILE_BUDGET):
+    # Один проход по обоим файлам полосами; mode - цветовое пространство сравнения (RGB, YCbCr, L)
+    if tiles.image_size(original_path) != tiles.image_size(modified_path):
+        raise ValueError("Размеры изображений не совпадают")
+    width, _ = tiles.image_size(original_path)
+    rows_per_strip = tiles.strip_height(width, tile_budget, 2 * BYTES_PER_SAMPLE * Image.getmodebands(mode))
+    meter = QualityMeter()
+    strips = zip(tiles.iter_strips(original_path, rows_per_strip, mode),
+                 tiles.iter_strips(modified_path, rows_per_strip, mode))
+    for (_, original), (_, modified) in strips:
+        meter.update(original, modified)
+    return meter
+
+def psnr(original, modified):
+    return compare_arrays(original, modified).psnr()
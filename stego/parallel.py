@@ -0,0 +1,36 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from stego import profiling
+
+# Наименьшее число блоков в полосе: на мелких полосах накладные расходы потоков больше выигрыша
+MIN_BAND_BLOCKS = 512
+
+def worker_count(workers):
+    # None - по числу процессоров
+    if workers is None:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+def row_bands(block_rows, workers):
+    # Делит блоки на не более чем workers полос из идущих подряд строк блоков.
+    # Возвращает массивы индексов блоков; блоки 8x8 не пересекаются, поэтому полосы можно
+    # записывать в общий массив одновременно
+    order = np.argsort(block_rows, kind='stable')
+    count = min(worker_count(workers), max(1, order.size // MIN_BAND_BLOCKS))
+    return np.array_split(order, count)
+
+def map_bands(function, bands):
+    # Полосы обрабатываются потоками над общим массивом изображения без копирования:
+    # NumPy и scipy.fft отпускают GIL на операциях с массивами.
+    # Каждая полоса выполняется в копии контекста, чтобы стадии профилирования сохранялись
+    # (без измерения памяти, см. profiling.run_concurrent)
+    if len(bands) <= 1:
+        return [function(band) for band in bands]
+    with ThreadPoolExecutor(max_workers=len(bands)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, profiling.run_concurrent, function, band)
+                   for band in bands]
+        return [future.result() for future in futures]
@@ -0,0 +1,84 @@
+import functools
+import hashlib
+import numbers
+import threading
+
+import numpy as np
+
+FEISTEL_ROUNDS = 4
+CACHE_SIZE = 64
+
+def _seed(seed_key):
+    # Неотрицательный целый ключ передается генератору как есть, чтобы прежние перестановки не менялись;
+    # отрицательные и нецелые ключи (default_rng их не принимает) сводятся к числу через SHA-256 записи ключа
+    if isinstance(seed_key, numbers.Integral):
+        seed_key = int(seed_key)
+        if seed_key >= 0:
+            return seed_key
+    return int.from_bytes(hashlib.sha256(repr(seed_key).encode()).digest(), 'big')
+
+class KeyedPermutation:
+    # Ключевая перестановка чисел 0..size-1 на сети Фейстеля с «cycle walking»:
+    # вычисляется только запрошенный префикс, состояние глобального random не затрагивается
+    def __init__(self, size, seed_key):
+        self.size = size
+        self._half_bits = max(1, (max(size - 1, 1).bit_length() + 1) // 2)
+        self._mask = np.uint64((1 << self._half_bits) - 1)
+        rng = np.random.default_rng(_seed(seed_key))
+        self._round_keys = rng.integers(0, 2**64, size=FEISTEL_ROUNDS, dtype=np.uint64, endpoint=False)
+        self._prefix = np.empty(0, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def _round(self, values, key):
+        x = (values + key) * np.uint64(0x9E3779B97F4A7C15)
+        x ^= x >> np.uint64(31)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(29)
+        return x & self._mask
+
+    def _encrypt(self, values):
+        half = np.uint64(self._half_bits)
+        left = values >> half
+        right = values & self._mask
+        for key in self._round_keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << half) | right
+
+    def _permute(self, indexes):
+        values = self._encrypt(indexes.astype(np.uint64))
+        pending = values >= self.size
+        while pending.any():
+            values[pending] = self._encrypt(values[pending])
+            pending = values >= self.size
+        return values.astype(np.int64)
+
+    def take(self, count):
+        if count > self.size:
+            raise ValueError(f"Запрошено {count} позиций из {self.size}")
+        prefix = self._prefix
+        if count > prefix.size:
+            with self._lock:
+                prefix = self._prefix
+                if count > prefix.size:
+                    extra = self._permute(np.arange(prefix.size, count, dtype=np.uint64))
+                    prefix = np.concatenate([prefix, extra])
+                    prefix.setflags(write=False)
+                    self._prefix = prefix
+        return prefix[:count]
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def block_permutation(grid_shape, seed_key):
+    rows, cols = grid_shape
+    return KeyedPermutation(rows * cols, seed_key)
+
+def block_positions(grid_shape, seed_key, count):
+    # Координаты (строка, столбец) левых верхних углов первых count блоков 8x8
+    order = block_permutation(tuple(grid_shape), seed_key).take(count)
+    block_rows, block_cols = np.divmod(order, grid_shape[1])
+    return block_rows * 8, block_cols * 8
+
+def pixel_positions(image_shape, seed_key, count):
+    # Координаты первых count пикселей ключевой перестановки, без повторов
+    height, width = image_shape[:2]
+    order = block_permutation((height, width), seed_key).take(count)
+    return np.divmod(order, width)
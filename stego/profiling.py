@@ -0,0 +1,161 @@
+import contextvars
+import functools
+import json
+import time
+import tracemalloc
+
+# Профилирование включается только внутри `with Profiler():`; вне его stage() ничего не делает
+_profiler = contextvars.ContextVar('profiler', default=None)
+_current_stage = contextvars.ContextVar('current_stage', default=None)
+# Контекст выполняется одновременно с другими потоками (полосы parallel.map_bands)
+_concurrent = contextvars.ContextVar('concurrent', default=False)
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_bytes(self, read=0, written=0):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class _ReentrantStage(_NullStage):
+    # Повторный вход в текущую стадию: время учитывается внешней стадией, байты передаются ей
+    def __init__(self, current):
+        self.current = current
+
+    def add_bytes(self, read=0, written=0):
+        self.current.add_bytes(read, written)
+
+class _Stage:
+    def __init__(self, profiler, name, bytes_read, bytes_written):
+        self.profiler = profiler
+        self.name = name
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+
+    def add_bytes(self, read=0, written=0):
+        self.bytes_read += read
+        self.bytes_written += written
+
+    def __enter__(self):
+        self.parent = _current_stage.get()
+        self.path = self.name if self.parent is None else f"{self.parent.path}/{self.name}"
+        self.token = _current_stage.set(self)
+        # tracemalloc.reset_peak() сбрасывает пик всего процесса, поэтому одновременные стадии не измеряют
+        # память (peak_bytes - None); их выделения входят в пик объемлющей стадии, поток которой ждет полосы
+        self.trace_memory = self.profiler.trace_memory and not _concurrent.get()
+        if self.trace_memory:
+            # Пик отсчитывается от памяти на входе; пик вложенной стадии передается родителю при выходе
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.memory_start = self.peak = current
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        peak_bytes = None
+        if self.trace_memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            peak_bytes = self.peak - self.memory_start
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, self.peak)
+        _current_stage.reset(self.token)
+        self.profiler.events.append({
+            'stage': self.path,
+            'start': self.started - self.profiler.started,
+            'seconds': seconds,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_bytes': peak_bytes,
+        })
+        return False
+
+def stage(name, bytes_read=0, bytes_written=0):
+    # Стадии вкладываются друг в друга: событие получает путь вида 'koch.embed/dct'.
+    # Стадия с тем же именем, что и текущая (обертка над функцией в памяти), не создается повторно
+    profiler = _profiler.get()
+    if profiler is None:
+        return _NULL_STAGE
+    current = _current_stage.get()
+    if current is not None and current.name == name:
+        return _ReentrantStage(current)
+    return _Stage(profiler, name, bytes_read, bytes_written)
+
+def add_bytes(read=0, written=0):
+    current = _current_stage.get()
+    if current is not None:
+        current.add_bytes(read, written)
+
+def run_concurrent(function, *args):
+    # Запуск функции в контексте, который выполняется одновременно с другими потоками
+    _concurrent.set(True)
+    return function(*args)
+
+def profiled(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class Profiler:
+    # Собирает события стадий в текущем контексте (поток, задача asyncio)
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.events = []
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.started = time.perf_counter()
+        self.token = _profiler.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _profiler.reset(self.token)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def write_events(self, file):
+        for event in self.events:
+            file.write(json.dumps(event) + '\n')
+
+    def report(self):
+        # Сводка по стадиям, от самых затратных по времени
+        stages = {}
+        for event in self.events:
+            entry = stages.setdefault(event['stage'], {
+                'stage': event['stage'], 'count': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                'bytes_read': 0, 'bytes_written': 0, 'peak_bytes': None,
+            })
+            entry['count'] += 1
+            entry['seconds'] += event['seconds']
+            entry['max_seconds'] = max(entry['max_seconds'], event['seconds'])
+            entry['bytes_read'] += event['bytes_read']
+            entry['bytes_written'] += event['bytes_written']
+            if event['peak_bytes'] is not None:
+                entry['peak_bytes'] = max(entry['peak_bytes'] or 0, event['peak_bytes'])
+        return sorted(stages.values(), key=lambda entry: entry['seconds'], reverse=True)
+
+    def format_report(self):
+        lines = [f"{'stage':<32} {'count':>6} {'total ms':>10} {'max ms':>10} "
+                 f"{'read MB':>9} {'written MB':>10} {'peak MB':>9}"]
+        for entry in self.report():
+            peak = '' if entry['peak_bytes'] is None else f"{entry['peak_bytes'] / 1e6:.2f}"
+            lines.append(f"{entry['stage']:<32} {entry['count']:>6} {entry['seconds'] * 1000:>10.2f} "
+                         f"{entry['max_seconds'] * 1000:>10.2f} {entry['bytes_read'] / 1e6:>9.2f} "
+                         f"{entry['bytes_written'] / 1e6:>10.2f} {peak:>9}")
+        return '\n'.join(lines)
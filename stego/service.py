@@ -0,0 +1,349 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from stego import batch, capacity
+
+STREAM_CHUNK_SIZE = 64 << 10
+MAX_BODY_SIZE = 256 << 20
+DEFAULT_QUEUE_SIZE = 64
+# Сколько последних измерений задержки хранится для расчета перцентилей
+LATENCY_WINDOW = 4096
+ENDPOINTS = ('/embed', '/extract', '/capacity', '/metrics')
+PERCENTILES = (50, 90, 99)
+
+logger = logging.getLogger(__name__)
+
+# Параметры запроса, передаваемые методам, и их типы
+OPTION_TYPES = {
+    'threshold': float,
+    'seed_key': int,
+    'tile_budget': int,
+    'depth': lambda value: value if value == 'fit' else int(value),
+    'channels': str,
+    'bits_per_line': int,
+    'pairs': lambda value: [int(item) for item in value.split(',')],
+    'adaptive': lambda value: value.lower() in ('1', 'true', 'yes'),
+    'threads': int,
+    'fec': str,
+    'soft': lambda value: value.lower() in ('1', 'true', 'yes'),
+}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _embed_job(method, cover_path, message, output_path, options):
+    batch.embed_message(method, cover_path, message, output_path, options)
+    return output_path
+
+def _extract_job(method, stego_path, options):
+    return batch.extract_message(method, stego_path, options)
+
+def _capacity_job(path):
+    entry = capacity.scan_file(path)
+    if entry is None:
+        raise ValueError("Файл не является изображением или текстом")
+    entry.pop('path')
+    return entry
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+class Service:
+    # Сетевой ввод-вывод выполняется в цикле asyncio, вычисления - в пуле процессов.
+    # Очередь заданий ограничена: при переполнении запрос сразу получает 503
+    def __init__(self, workers=None, queue_size=DEFAULT_QUEUE_SIZE, max_body_size=MAX_BODY_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.max_body_size = max_body_size
+        self.queue = None
+        self.executor = None
+        self.consumers = []
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latencies = {}
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for consumer in self.consumers:
+            consumer.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.executor.shutdown()
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            function, args, future = await self.queue.get()
+            self.in_flight += 1
+            try:
+                result = await loop.run_in_executor(self.executor, function, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.in_flight -= 1
+                self.queue.task_done()
+
+    def _check_capacity(self):
+        if self.queue.full():
+            self.rejected += 1
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, "Очередь заданий заполнена")
+
+    async def _submit(self, function, *args):
+        self._check_capacity()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((function, args, future))
+        return await future
+
+    def _record(self, endpoint, seconds):
+        self.latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def metrics(self):
+        latency = {}
+        for endpoint, values in self.latencies.items():
+            latency[endpoint] = {'count': len(values)}
+            for percent in PERCENTILES:
+                latency[endpoint][f'p{percent}_ms'] = _percentile(values, percent) * 1000
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue_size,
+            'in_flight': self.in_flight,
+            'workers': self.workers,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'latency': latency,
+        }
+
+    async def handle_connection(self, reader, writer):
+        try:
+            keep_alive = True
+            while keep_alive:
+                request = await _read_request_head(reader)
+                if request is None:
+                    break
+                keep_alive = request['headers'].get('connection', '').lower() != 'close'
+                await self._handle_request(request, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request, writer):
+        started = time.perf_counter()
+        endpoint = request['path']
+        with tempfile.TemporaryDirectory(prefix='stego-') as directory:
+            try:
+                try:
+                    status, content_type, body = await self._dispatch(request, directory)
+                finally:
+                    # Непрочитанное тело запроса мешает следующему запросу в том же соединении
+                    await request['body'].discard()
+            except HttpError as e:
+                if e.status != HTTPStatus.SERVICE_UNAVAILABLE:
+                    self.failed += 1
+                status, content_type, body = e.status, 'application/json', _json_body({'error': str(e)})
+            except (ValueError, OSError) as e:
+                # Ошибки методов (сообщение не помещается, контейнер не распознан) - ошибки запроса
+                self.failed += 1
+                status, content_type, body = HTTPStatus.BAD_REQUEST, 'application/json', _json_body({'error': str(e)})
+            except asyncio.IncompleteReadError:
+                # Клиент закрыл соединение: отвечать некому
+                raise
+            except Exception as e:
+                # Непредвиденная ошибка метода или сервиса: клиент все равно получает ответ, а метрики - запись
+                self.failed += 1
+                logger.exception("Ошибка обработки запроса %s", endpoint)
+                status, content_type, body = (HTTPStatus.INTERNAL_SERVER_ERROR, 'application/json',
+                                              _json_body({'error': f"{type(e).__name__}: {e}"}))
+            else:
+                self.completed += 1
+            await _write_response(writer, status, content_type, body)
+        if endpoint in ENDPOINTS:
+            self._record(endpoint, time.perf_counter() - started)
+
+    async def _dispatch(self, request, directory):
+        path = request['path']
+        if path == '/metrics':
+            _require_method(request, 'GET')
+            return HTTPStatus.OK, 'application/json', _json_body(self.metrics())
+        if path not in ENDPOINTS:
+            raise HttpError(HTTPStatus.NOT_FOUND, f"Неизвестный адрес: {path}")
+        _require_method(request, 'POST')
+        # Задание отклоняется до чтения тела, чтобы при перегрузке не принимать данные зря
+        self._check_capacity()
+        query = request['query']
+
+        input_path = os.path.join(directory, 'input')
+        await request['body'].save(input_path, self.max_body_size)
+
+        if path == '/capacity':
+            entry = await self._submit(_capacity_job, input_path)
+            return HTTPStatus.OK, 'application/json', _json_body(entry)
+
+        method = _query_value(query, 'method')
+        if method not in batch.METHODS:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"Неизвестный метод: {method}")
+        options = _options(query)
+
+        if path == '/extract':
+            message = await self._submit(_extract_job, method, input_path, options)
+            return HTTPStatus.OK, 'application/json', _json_body({'message': message})
+
+        message = _query_value(query, 'message')
+        if method in batch.TEXT_METHODS:
+            output_path, content_type = os.path.join(directory, 'output.txt'), 'text/plain; charset=utf-8'
+        elif method == 'jpeg':
+            output_path, content_type = os.path.join(directory, 'output.jpg'), 'image/jpeg'
+        else:
+            output_path, content_type = os.path.join(directory, 'output.bmp'), 'image/bmp'
+        await self._submit(_embed_job, method, input_path, message, output_path, options)
+        return HTTPStatus.OK, content_type, _file_body(output_path)
+
+class RequestBody:
+    # Тело запроса читается порциями: по Content-Length или в кодировании chunked
+    def __init__(self, reader, headers):
+        self.reader = reader
+        self.chunked = headers.get('transfer-encoding', '').lower() == 'chunked'
+        self.remaining = int(headers.get('content-length', 0) or 0)
+        self.finished = not self.chunked and self.remaining == 0
+
+    async def chunks(self):
+        while not self.finished:
+            if self.chunked:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Завершающие заголовки (trailers) до пустой строки
+                    while (await self.reader.readline()).strip():
+                        pass
+                    self.finished = True
+                    return
+                chunk = await self.reader.readexactly(size)
+                await self.reader.readline()
+                yield chunk
+            else:
+                chunk = await self.reader.read(min(STREAM_CHUNK_SIZE, self.remaining))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b'', self.remaining)
+                self.remaining -= len(chunk)
+                self.finished = self.remaining == 0
+                yield chunk
+
+    async def save(self, path, max_size):
+        size = 0
+        with open(path, 'wb') as file:
+            async for chunk in self.chunks():
+                size += len(chunk)
+                if size > max_size:
+                    raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Тело запроса слишком большое")
+                file.write(chunk)
+
+    async def discard(self):
+        async for _ in self.chunks():
+            pass
+
+async def _read_request_head(reader):
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _ = request_line.decode('latin-1').split()
+    except ValueError:
+        raise ConnectionError("Некорректная строка запроса")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    url = urlsplit(target)
+    return {
+        'method': method,
+        'path': url.path,
+        'query': parse_qs(url.query),
+        'headers': headers,
+        'body': RequestBody(reader, headers),
+    }
+
+def _require_method(request, method):
+    if request['method'] != method:
+        raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f"Ожидался метод {method}")
+
+def _query_value(query, name):
+    if name not in query:
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"Не задан параметр {name}")
+    return query[name][0]
+
+def _options(query):
+    options = {}
+    for name, convert in OPTION_TYPES.items():
+        if name in query:
+            try:
+                options[name] = convert(query[name][0])
+            except ValueError:
+                raise HttpError(HTTPStatus.BAD_REQUEST, f"Некорректное значение параметра {name}")
+    return options
+
+def _json_body(data):
+    return [json.dumps(data, ensure_ascii=False).encode('utf-8')]
+
+def _file_body(path):
+    # Результат передается порциями и не загружается в память целиком
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+async def _write_response(writer, status, content_type, body):
+    status = HTTPStatus(status)
+    writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                 f"Content-Type: {content_type}\r\n"
+                 "Transfer-Encoding: chunked\r\n\r\n".encode('latin-1'))
+    for chunk in body:
+        writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        await writer.drain()
+    writer.write(b'0\r\n\r\n')
+    await writer.drain()
+
+async def serve(host='127.0.0.1', port=8080, workers=None, queue_size=DEFAULT_QUEUE_SIZE,
+                max_body_size=MAX_BODY_SIZE, ready=None):
+    service = Service(workers, queue_size, max_body_size)
+    await service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    try:
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+def run(host='127.0.0.1', port=8080, workers=None, queue_size=DEFAULT_QUEUE_SIZE):
+    try:
+        asyncio.run(serve(host, port, workers, queue_size,
+                          ready=lambda server: print(f"Listening on http://{host}:{port}")))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,200 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from lab02 import lab02
+from lab03 import lab03
+from lab03 import lab03secret
+from lab03.lab03final import KochSteganography, block_dct
+from stego import images, profiling
+from stego.codec import decode_text
+
+# Наибольший объем кэша сеанса по умолчанию
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Массивы сеанса: 'pixels' - декодированное изображение (L, LA, RGB или RGBA, как у метода LSB),
+# плоскости 'RGB' и 'YCbCr', коэффициенты DCT блоков 'dct:RGB' (3, H/8, W/8, 8, 8) и 'dct:Y' (H/8, W/8, 8, 8)
+METHOD_ARRAYS = {
+    'lsb': ('pixels',),
+    'random': ('RGB',),
+    'koch': ('RGB', 'dct:RGB'),
+    'dct': ('YCbCr', 'dct:Y'),
+}
+
+class AnalysisSession:
+    # Изображение декодируется один раз, остальные массивы вычисляются по первому запросу и хранятся
+    # в LRU-кэше не больше cache_bytes байт; массивы только для чтения. Извлечения разными методами
+    # и ключами берут коэффициенты из кэша, не повторяя декодирование, перевод цвета и DCT.
+    # share() переносит массивы в разделяемую память, attach() подключается к ним из другого процесса
+    def __init__(self, image, cache_bytes=DEFAULT_CACHE_BYTES, workers=1):
+        # workers - число потоков для DCT и преобразований блоков
+        img = images.load(image)
+        if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+            img = img.convert('RGB')
+        self._init_cache(cache_bytes, workers)
+        self._pixels = self._readonly(np.array(img))
+        self._owner = True
+
+    def _init_cache(self, cache_bytes, workers):
+        self.cache_bytes = cache_bytes
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self.cached_bytes = 0
+        # Массивы в разделяемой памяти не вытесняются и не учитываются в объеме кэша
+        self._pinned = {}
+        self._segments = {}
+        self._pixels = None
+
+    @classmethod
+    def attach(cls, descriptor, cache_bytes=DEFAULT_CACHE_BYTES, workers=1):
+        # descriptor - результат share() в другом процессе
+        session = cls.__new__(cls)
+        session._init_cache(cache_bytes, workers)
+        session._owner = False
+        for key, (name, shape, dtype) in descriptor.items():
+            segment = shared_memory.SharedMemory(name=name)
+            session._pin(key, np.ndarray(shape, dtype, buffer=segment.buf), segment)
+        return session
+
+    @staticmethod
+    def _readonly(array):
+        array.flags.writeable = False
+        return array
+
+    def _pin(self, key, array, segment):
+        if key in self._cache:
+            self.cached_bytes -= self._cache.pop(key).nbytes
+        self._pinned[key] = self._readonly(array)
+        self._segments[key] = segment
+
+    def get(self, key):
+        if key in self._pinned:
+            self.hits += 1
+            return self._pinned[key]
+        if key == 'pixels' and self._pixels is not None:
+            self.hits += 1
+            return self._pixels
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        array = self._readonly(self._compute(key))
+        self._store(key, array)
+        return array
+
+    def _compute(self, key):
+        if key in ('RGB', 'YCbCr'):
+            pixels = self.get('pixels')
+            with profiling.stage('convert'):
+                return np.array(Image.fromarray(pixels).convert(key))
+        if key == 'dct:RGB':
+            rgb = self.get('RGB')
+            with profiling.stage('dct'):
+                return block_dct(rgb, self.workers)
+        if key == 'dct:Y':
+            ycbcr = self.get('YCbCr')
+            with profiling.stage('dct'):
+                return lab03secret.block_dct(ycbcr[:, :, 0])
+        raise ValueError(f"Неизвестный массив сеанса: {key}")
+
+    def _store(self, key, array):
+        # Массив больше всего кэша не сохраняется; иначе вытесняются давно не использованные
+        if array.nbytes > self.cache_bytes:
+            return
+        self._cache[key] = array
+        self.cached_bytes += array.nbytes
+        while self.cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self.cached_bytes -= evicted.nbytes
+
+    def share(self, keys=()):
+        # Переносит 'pixels' и массивы keys (недостающие вычисляются) в разделяемую память.
+        # Возвращает описание для attach; сегменты живут до close() этого сеанса
+        if not self._owner:
+            raise ValueError("Подключенный сеанс не может раздавать массивы")
+        descriptor = {}
+        for key in ['pixels'] + sorted(set(keys) - {'pixels'}):
+            if key not in self._segments:
+                array = self.get(key)
+                segment = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+                shared = np.ndarray(array.shape, array.dtype, buffer=segment.buf)
+                shared[...] = array
+                self._pin(key, shared, segment)
+            array = self._pinned[key]
+            descriptor[key] = (self._segments[key].name, array.shape, array.dtype.str)
+        return descriptor
+
+    def close(self):
+        # Владелец удаляет сегменты разделяемой памяти, подключенный сеанс только отключается.
+        # Массивы из разделяемой памяти после этого использовать нельзя
+        for key, segment in self._segments.items():
+            del self._pinned[key]
+            try:
+                segment.close()
+            except BufferError:
+                # На массив еще есть ссылки: отображение освободится вместе с ними
+                pass
+            if self._owner:
+                segment.unlink()
+        self._segments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def extract(self, method, options=None):
+        # method - 'lsb', 'koch', 'dct' или 'random'; options - как у stego.batch.extract_message
+        # (seed_key - ключ методов dct и random, soft - мягкие решения для koch и dct)
+        options = options or {}
+        if method == 'lsb':
+            with profiling.stage('extract'):
+                return decode_text(lab02.extract_payload(self.get('pixels')))
+        if method == 'random':
+            return lab03.extract_image(self.get('RGB'), options.get('seed_key', 42))
+        if method == 'koch':
+            steganography = KochSteganography(workers=self.workers)
+            return steganography.extract_image(self.get('RGB'), options.get('soft', False),
+                                               dct_blocks=self.get('dct:RGB'))
+        if method == 'dct':
+            return lab03secret.extract_image(self.get('YCbCr'), options.get('seed_key', 42), self.workers,
+                                             options.get('soft', False), dct_blocks=self.get('dct:Y'))
+        raise ValueError(f"Неизвестный метод: {method}")
+
+    def extract_many(self, requests, processes=1):
+        # requests - пары (метод, параметры); для каждой возвращается словарь с сообщением или ошибкой.
+        # При processes > 1 нужные массивы один раз переносятся в разделяемую память,
+        # и процессы пула подключаются к ним без копирования
+        requests = [(method, options or {}) for method, options in requests]
+        if processes <= 1:
+            return [_extract_entry(self, method, options) for method, options in requests]
+        keys = {key for method, _ in requests for key in METHOD_ARRAYS.get(method, ())}
+        descriptor = self.share(keys)
+        with ProcessPoolExecutor(max_workers=processes, initializer=_attach_worker,
+                                 initargs=(descriptor, self.workers)) as executor:
+            return list(executor.map(_extract_worker, requests))
+
+def _extract_entry(session, method, options):
+    entry = {'method': method, 'options': options, 'message': None, 'error': None}
+    try:
+        entry['message'] = session.extract(method, options)
+    except ValueError as e:
+        entry['error'] = str(e)
+    return entry
+
+# Сеанс процесса пула, подключенный к разделяемой памяти
+_worker_session = None
+
+def _attach_worker(descriptor, workers):
+    global _worker_session
+    _worker_session = AnalysisSession.attach(descriptor, workers=workers)
+
+def _extract_worker(request):
+    return _extract_entry(_worker_session, *request)
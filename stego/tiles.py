@@ -0,0 +1,54 @@
+import numpy as np
+from PIL import Image
+
+from stego import bmp, profiling
+
+DEFAULT_TILE_BUDGET = 64 << 20
+
+def image_size(path):
+    # Размер берется из заголовка, пиксели не декодируются
+    with Image.open(path) as img:
+        return img.size
+
+def strip_height(width, tile_budget, bytes_per_pixel):
+    # Высота полосы кратна 8, чтобы блоки 8x8 не разрезались между полосами
+    rows = tile_budget // max(1, width * bytes_per_pixel)
+    return max(8, rows // 8 * 8)
+
+def iter_strips(path, rows_per_strip, mode='RGB'):
+    # Несжатый BMP читается полосами через memmap; для остальных форматов полосы вырезаются
+    # средствами PIL (большинство декодеров при этом все равно распаковывает файл целиком)
+    if bmp.is_supported(path):
+        with bmp.mapped_pixels(path) as pixels:
+            for top in range(0, pixels.shape[0], rows_per_strip):
+                strip = np.array(pixels[top:top + rows_per_strip])
+                if mode != 'RGB':
+                    strip = np.array(Image.fromarray(strip).convert(mode))
+                yield top, strip
+        return
+
+    with Image.open(path) as img:
+        width, height = img.size
+        for top in range(0, height, rows_per_strip):
+            bottom = min(height, top + rows_per_strip)
+            yield top, np.array(img.crop((0, top, width, bottom)).convert(mode))
+
+def process_strips(image_path, output_path, rows_per_strip, transform):
+    # transform(top, strip) возвращает обработанную полосу RGB uint8; результат пишется в BMP по мере готовности
+    if not output_path.lower().endswith('.bmp'):
+        raise ValueError("При обработке полосами результат сохраняется только в BMP")
+    width, height = image_size(image_path)
+    bmp.create_bmp(output_path, width, height)
+    with bmp.mapped_pixels(output_path, mode='r+') as output:
+        strips = iter_strips(image_path, rows_per_strip)
+        while True:
+            with profiling.stage('decode') as decode_stage:
+                item = next(strips, None)
+                if item is not None:
+                    decode_stage.add_bytes(read=item[1].nbytes)
+            if item is None:
+                break
+            top, strip = item
+            result = transform(top, strip)
+            with profiling.stage('encode', bytes_written=result.nbytes):
+                output[top:top + strip.shape[0]] = result
@@ -0,0 +1,26 @@
+import numpy as np
+
+from stego import bench
+
+def _image():
+    return np.random.default_rng(0).integers(0, 256, (32, 32, 3), dtype=np.uint8)
+
+def test_rows_cover_every_attack():
+    rows = bench.run(_image(), ['lsb', 'koch'], [4], [None, 75], [1.0])
+    assert [(row['method'], row['jpeg_quality']) for row in rows] == [
+        ('lsb', None), ('lsb', 75), ('koch', None), ('koch', 75)]
+    assert all(set(row) == set(bench.FIELDS) for row in rows)
+    assert rows[0]['error'] is None and rows[0]['bit_errors'] == 0
+
+def test_failed_embedding_is_reported():
+    # 16 блоков 8x8 по одному биту не вмещают 100 байт, а LSB вмещает
+    rows = bench.run(_image(), ['koch', 'lsb'], [100], [None, 75], [1.0])
+    koch = [row for row in rows if row['method'] == 'koch']
+    assert len(koch) == 2
+    assert all(row['error'] and row['bit_errors'] is None and row['psnr'] is None for row in koch)
+    assert all(row['error'] is None for row in rows if row['method'] == 'lsb')
+
+def test_failed_decoding_is_reported():
+    rows = bench.run(_image(), ['lsb'], [8], [50], [1.0], codes=['rs2'])
+    assert rows[0]['payload_bit_errors'] is None
+    assert rows[0]['error']
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from stego import fec
+from stego.codec import bytes_to_bits
+
+def _message(size, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8).tobytes()
+
+def _corrupt_blocks(code, encoded, size, errors, seed=0):
+    # errors[b] случайных байт блока b заменяются другими значениями; блоки перемежены
+    # по столбцам (длина блока с проверочными байтами, число блоков)
+    rng = np.random.default_rng(seed)
+    blocks, length = code._shape(size)
+    columns = np.frombuffer(encoded, dtype=np.uint8).reshape(length + code.parity, blocks).copy()
+    for block, count in enumerate(errors):
+        rows = rng.choice(length + code.parity, count, replace=False)
+        columns[rows, block] ^= rng.integers(1, 256, count, dtype=np.uint8)
+    return columns.tobytes()
+
+@pytest.mark.parametrize('spec', ['rep3', 'rep5', 'hamming', 'rs2', 'rs16', 'rs32', 'rs254'])
+@pytest.mark.parametrize('size', [1, 7, 200, 1000])
+def test_round_trip(spec, size):
+    code = fec.get_code(spec)
+    data = _message(size)
+    encoded = code.encode(data)
+    assert len(encoded) == code.encoded_size(size)
+    assert code.decode(encoded, size) == data
+
+@pytest.mark.parametrize('parity', [2, 8, 16, 32, 64])
+@pytest.mark.parametrize('seed', range(5))
+def test_reed_solomon_corrects_half_parity(parity, seed):
+    code = fec.ReedSolomon(parity)
+    size = 600
+    blocks, _ = code._shape(size)
+    data = _message(size, seed)
+    received = _corrupt_blocks(code, code.encode(data), size, [parity // 2] * blocks, seed)
+    assert code.decode(received, size) == data
+
+# При малом parity слово с parity/2 + 1 ошибками нередко оказывается в пределах исправления
+# другого кодового слова (так ведет себя любой декодер с ограниченным расстоянием),
+# поэтому отказ проверяется при parity от 16
+@pytest.mark.parametrize('parity', [16, 32, 64, 128])
+@pytest.mark.parametrize('seed', range(5))
+def test_reed_solomon_fails_above_half_parity(parity, seed):
+    code = fec.ReedSolomon(parity)
+    size = 600
+    blocks, _ = code._shape(size)
+    errors = [0] * blocks
+    errors[seed % blocks] = parity // 2 + 1
+    received = _corrupt_blocks(code, code.encode(_message(size, seed)), size, errors, seed)
+    with pytest.raises(ValueError):
+        code.decode(received, size)
+
+def test_reed_solomon_blocks_with_different_error_counts():
+    code = fec.ReedSolomon(16)
+    size = 2000
+    blocks, _ = code._shape(size)
+    assert blocks == 9
+    data = _message(size, 1)
+    errors = [0, 1, 8, 3, 0, 7, 2, 8, 5]
+    assert code.decode(_corrupt_blocks(code, code.encode(data), size, errors, 1), size) == data
+    # Один блок сверх предела портит все сообщение, даже если остальные исправимы
+    errors[4] = 9
+    with pytest.raises(ValueError):
+        code.decode(_corrupt_blocks(code, code.encode(data), size, errors, 1), size)
+
+def _margins(encoded, strength=1.0):
+    return (2.0 * bytes_to_bits(encoded) - 1) * strength
+
+def test_repetition_soft_trusts_confident_copy():
+    code = fec.Repetition(3)
+    data = _message(64, 2)
+    margins = _margins(code.encode(data)).reshape(3, -1)
+    # Две копии слабо ошибаются, третья уверенно верна: голосование большинства ошибается
+    margins[:2] *= -0.1
+    margins[2] *= 5
+    margins = margins.reshape(-1)
+    assert code.decode_soft(margins, len(data)) == data
+    assert code.decode(bytes(np.packbits(margins > 0)), len(data)) != data
+
+def test_hamming_soft_corrects_two_weak_errors():
+    code = fec.Hamming()
+    data = _message(64, 3)
+    size = len(data)
+    words = _margins(code.encode(data))[:size * 14].reshape(7, size * 2)
+    # В каждом слове два бита перевернуты с малым запасом - больше, чем исправляет жесткое решение
+    words[:2] *= -0.2
+    margins = words.reshape(-1)
+    assert code.decode_soft(margins, size) == data
+    assert code.decode(bytes(np.packbits(margins > 0)), size) != data
+
+@pytest.mark.parametrize('spec', ['rep3', 'hamming'])
+def test_soft_decoding_matches_hard_on_clean_margins(spec):
+    code = fec.get_code(spec)
+    data = _message(100, 4)
+    encoded = code.encode(data)
+    for strength in (0.01, 1.0, 40.0):
+        assert code.decode_soft(_margins(encoded, strength), len(data)) == data
+
+@pytest.mark.parametrize('spec', ['rep3', 'hamming'])
+def test_soft_decoding_beats_hard_on_noise(spec):
+    code = fec.get_code(spec)
+    data = _message(500, 5)
+    rng = np.random.default_rng(5)
+    margins = _margins(code.encode(data)) + rng.normal(0, 0.9, len(code.encode(data)) * 8)
+    hard = code.decode(bytes(np.packbits(margins > 0)), len(data))
+    soft = code.decode_soft(margins, len(data))
+
+    def wrong_bits(decoded):
+        return int(np.count_nonzero(bytes_to_bits(decoded) != bytes_to_bits(data)))
+    assert wrong_bits(soft) < wrong_bits(hard)
+
+def test_reed_solomon_soft_uses_signs():
+    code = fec.ReedSolomon(8)
+    data = _message(100, 6)
+    assert code.decode_soft(_margins(code.encode(data), 0.3), len(data)) == data
+
+@pytest.mark.parametrize('spec', ['rep2', 'rep257', 'hamming7', 'rs0', 'rs255', 'bch'])
+def test_invalid_spec_rejected(spec):
+    with pytest.raises(ValueError):
+        fec.get_code(spec)
@@ -0,0 +1,99 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from stego import jpeg
+
+def _image(mode, width=53, height=37):
+    # Плавный градиент с шумом: в блоках есть и нулевые, и большие коэффициенты
+    rng = np.random.default_rng(width * height)
+    y, x = np.mgrid[:height, :width]
+    channels = 1 if mode == 'L' else 3
+    base = (x[..., np.newaxis] * 3 + y[..., np.newaxis] * 2 + np.arange(channels) * 40) % 256
+    pixels = np.clip(base + rng.normal(0, 20, base.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels[..., 0] if mode == 'L' else pixels, mode)
+
+def _save(img, **options):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=85, **options)
+    return buffer.getvalue()
+
+def _pixels(data):
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(img)
+
+@pytest.mark.parametrize('mode, options', [
+    ('RGB', {'subsampling': 0}),
+    ('RGB', {'subsampling': 1}),
+    ('RGB', {'subsampling': 2}),
+    ('L', {}),
+    ('RGB', {'subsampling': 2, 'restart_marker_blocks': 3}),
+    ('L', {'restart_marker_rows': 1}),
+], ids=['444', '422', '420', 'gray', 'restart-420', 'restart-gray'])
+def test_round_trip_keeps_coefficients(mode, options):
+    data = _save(_image(mode), **options)
+    original = jpeg.decode(data)
+    encoded = jpeg.encode(original)
+    decoded = jpeg.decode(encoded)
+
+    assert (decoded.width, decoded.height) == (original.width, original.height)
+    assert len(decoded.components) == len(original.components)
+    for before, after in zip(original.components, decoded.components):
+        assert (after.h, after.v, after.quant_id) == (before.h, before.v, before.quant_id)
+        assert after.coefficients.shape == before.coefficients.shape
+        assert np.array_equal(after.coefficients, before.coefficients)
+    assert original.quant_tables.keys() == decoded.quant_tables.keys()
+    for key in original.quant_tables:
+        assert np.array_equal(decoded.quant_tables[key], original.quant_tables[key])
+    # Независимая проверка: те же коэффициенты дают тот же рисунок в декодере Pillow
+    assert np.array_equal(_pixels(encoded), _pixels(data))
+
+def test_sampling_factors():
+    expected = {0: (1, 1), 1: (2, 1), 2: (2, 2)}
+    for subsampling, (h, v) in expected.items():
+        image = jpeg.decode(_save(_image('RGB'), subsampling=subsampling))
+        assert [(c.h, c.v) for c in image.components] == [(h, v), (1, 1), (1, 1)]
+
+def test_progressive_rejected():
+    data = _save(_image('RGB'), progressive=True)
+    with pytest.raises(ValueError):
+        jpeg.decode(data)
+
+@pytest.mark.parametrize('fraction', [0.05, 0.3, 0.6, 0.95])
+def test_truncated_rejected(fraction):
+    data = _save(_image('RGB'))
+    with pytest.raises(ValueError):
+        jpeg.decode(data[:int(len(data) * fraction)])
+
+def _segment_offset(data, marker):
+    pos = 2
+    while data[pos + 1] != marker:
+        pos += 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+    return pos
+
+@pytest.mark.parametrize('marker, offset, value', [
+    (jpeg.DQT, 2, 0xFF),   # длина сегмента за концом файла
+    (jpeg.DQT, 3, 0x01),   # длина меньше двух байт
+    (jpeg.DQT, 4, 0x37),   # ненулевая точность: 16-битная таблица не помещается в сегмент
+    (jpeg.DHT, 5, 0xFF),   # счетчики кодов указывают за конец сегмента
+    (0xC0, 9, 0x09),       # компонентов больше, чем описано в заголовке кадра
+    (0xC0, 11, 0x55),      # коэффициенты прореживания больше 4
+    (jpeg.SOS, 5, 0x99),   # скан ссылается на отсутствующий компонент
+    (jpeg.SOS, 6, 0x33),   # скан ссылается на неопределенную таблицу Хаффмана
+])
+def test_corrupted_segment_rejected(marker, offset, value):
+    data = bytearray(_save(_image('RGB')))
+    data[_segment_offset(data, marker) + offset] = value
+    with pytest.raises(ValueError):
+        jpeg.decode(bytes(data))
+
+def test_corrupted_entropy_data_rejected():
+    data = bytearray(_save(_image('RGB')))
+    start = _segment_offset(data, jpeg.SOS)
+    start += 2 + int.from_bytes(data[start + 2:start + 4], 'big')
+    # Поток из единичных бит не является кодом ни одной таблицы Хаффмана
+    data[start:-2] = b'\xff\x00' * ((len(data) - 2 - start) // 2)
+    with pytest.raises(ValueError):
+        jpeg.decode(bytes(data))
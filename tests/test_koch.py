@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from lab03.lab03final import KochSteganography
+
+MESSAGE = 'сообщение ' * 3
+
+@pytest.mark.parametrize('threshold', [0, -5, float('nan'), float('inf')])
+def test_invalid_threshold_rejected(threshold):
+    with pytest.raises(ValueError):
+        KochSteganography(threshold=threshold)
+
+def test_adaptive_boosts_header_blocks():
+    # При малом пороге округление искажает биты заголовка в шумных блоках: их порог должен вырасти
+    image = np.random.default_rng(1).integers(0, 256, (128, 160, 3), dtype=np.uint8)
+    steganography = KochSteganography(threshold=10, adaptive=True)
+    stego = np.asarray(steganography.embed_image(image, MESSAGE))
+    assert steganography.extract_image(stego) == MESSAGE
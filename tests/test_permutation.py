@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from stego.permutation import KeyedPermutation
+
+@pytest.mark.parametrize('seed_key', [0, 42, 2**70, -1, -42, np.int64(-7), 'ключ', 1.5])
+def test_permutation_is_deterministic(seed_key):
+    first = KeyedPermutation(1000, seed_key).take(1000)
+    assert np.array_equal(np.sort(first), np.arange(1000))
+    assert np.array_equal(KeyedPermutation(1000, seed_key).take(1000), first)
+
+def test_nonnegative_keys_keep_generator_seed():
+    # Перестановки для прежних ключей не меняются: иначе не извлекаются уже встроенные сообщения
+    keys = KeyedPermutation(10, 42)._round_keys
+    expected = np.random.default_rng(42).integers(0, 2**64, size=keys.size, dtype=np.uint64)
+    assert np.array_equal(keys, expected)
+
+def test_distinct_keys_give_distinct_orders():
+    orders = {tuple(KeyedPermutation(500, key).take(50)) for key in (1, -1, 2, -2, '1')}
+    assert len(orders) == 5
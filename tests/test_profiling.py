@@ -0,0 +1,24 @@
+import numpy as np
+
+from stego import parallel, profiling
+
+def _allocate(band):
+    with profiling.stage('band'):
+        return np.ones(1 << 20).sum() + band.size
+
+def _run(bands):
+    with profiling.Profiler() as profiler:
+        with profiling.stage('outer'):
+            parallel.map_bands(_allocate, bands)
+    return {event['stage']: event for event in profiler.events}
+
+def test_concurrent_stages_skip_memory():
+    events = _run([np.arange(2), np.arange(3)])
+    assert events['outer/band']['peak_bytes'] is None
+    # Выделения полос видны в пике объемлющей стадии
+    assert events['outer']['peak_bytes'] >= 8 << 20
+
+def test_single_band_measures_memory():
+    events = _run([np.arange(2)])
+    assert events['outer/band']['peak_bytes'] >= 8 << 20
+    assert events['outer']['peak_bytes'] >= events['outer/band']['peak_bytes']